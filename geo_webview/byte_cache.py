@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Thread-safe LRU cache bounded by a byte budget.
+
+Entries are charged by an approximate size in bytes (``len()`` of the
+value unless the caller passes ``size``); least recently used entries are
+evicted once the budget is exceeded. Hit/miss/eviction counters are kept
+for ``/server-stats``.
+"""
+import collections
+import threading
+
+
+class ByteBudgetLRU:
+    """LRU mapping whose total entry size stays within ``max_bytes``.
+
+    Args:
+        name: cache name (statistics)
+        max_bytes: total byte budget; 0 disables the cache
+        max_entry_bytes: larger values are not cached (default: budget / 4)
+    """
+
+    def __init__(self, name, max_bytes, max_entry_bytes=None):
+        self.name = name
+        self.max_bytes = max(0, int(max_bytes))
+        self.max_entry_bytes = int(max_entry_bytes) if max_entry_bytes else self.max_bytes // 4
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'rejected': 0}
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return default
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        """Store ``value``; returns False when it is too large to cache."""
+        if size is None:
+            size = len(value)
+        if self.max_bytes <= 0 or size > self.max_entry_bytes:
+            with self._lock:
+                self._stats['rejected'] += 1
+            return False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                self._stats['evictions'] += 1
+        return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._bytes -= entry[1]
+            return entry[0]
+
+    def invalidate(self, predicate=None):
+        """Drop every entry (or those whose key matches ``predicate(key)``)."""
+        with self._lock:
+            if predicate is None:
+                dropped = len(self._entries)
+                self._entries.clear()
+                self._bytes = 0
+            else:
+                keys = [k for k in self._entries if predicate(k)]
+                for k in keys:
+                    self._bytes -= self._entries.pop(k)[1]
+                dropped = len(keys)
+            if dropped:
+                self._stats['invalidations'] += 1
+            return dropped
+
+    def invalidate_where(self, predicate):
+        """Drop the entries for which ``predicate(key, value)`` is true."""
+        with self._lock:
+            keys = [k for k, (v, _) in self._entries.items() if predicate(k, v)]
+            for k in keys:
+                self._bytes -= self._entries.pop(k)[1]
+            if keys:
+                self._stats['invalidations'] += 1
+            return len(keys)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        stats['max_bytes'] = self.max_bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        return stats
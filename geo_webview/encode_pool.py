@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Image encoding stage with its own worker pool and PNG compression level.
+
+Rendering produces a ``QImage``; turning it into PNG/JPEG/WebP bytes is a
+separate stage run on a dedicated pool, so encodes are bounded (and
+parallel) independently of renders and the render side is done as soon as
+the image exists. The metatile path encodes all its tiles at once.
+
+PNG compression is a zlib level (0-9). Interactive requests use a fast
+level; prewarm/seeding code raises it for the current thread with
+:func:`compression_level` because its output is written once and served
+many times. Encode time and queue wait are recorded as the ``encode`` and
+``encode_wait`` stages of ``render_control.stage_stats``.
+"""
+import concurrent.futures
+import os
+import threading
+import time
+
+from . import image_formats
+from . import render_control
+
+
+def _env_int(name, default, lo, hi):
+    try:
+        v = os.environ.get(name)
+        return max(lo, min(hi, int(v))) if v not in (None, '') else default
+    except Exception:
+        return default
+
+
+# zlib level of interactive PNG output (GetMap, tiles requested by clients)
+PNG_LEVEL = _env_int('QMAP_PNG_LEVEL', 1, 0, 9)
+# zlib level of prewarmed/seeded tiles
+PNG_LEVEL_PREWARM = _env_int('QMAP_PNG_LEVEL_PREWARM', 9, 0, 9)
+# encode pool size
+ENCODE_WORKERS = _env_int('QMAP_ENCODE_WORKERS', max(2, (os.cpu_count() or 4) // 2), 1, 64)
+
+_local = threading.local()
+
+
+class compression_level:
+    """Context manager setting the PNG zlib level for encodes of this thread."""
+
+    def __init__(self, level):
+        self.level = level
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = getattr(_local, 'level', None)
+        _local.level = self.level
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.level = self._previous
+        return False
+
+
+def current_level():
+    """PNG zlib level for encodes submitted from this thread."""
+    level = getattr(_local, 'level', None)
+    return PNG_LEVEL if level is None else level
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {'encoded': 0, 'failed': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=ENCODE_WORKERS, thread_name_prefix='qmap-encode')
+        return _pool
+
+
+def _image_bytes(image):
+    try:
+        return int(image.sizeInBytes())
+    except Exception:
+        try:
+            return int(image.byteCount())
+        except Exception:
+            return 0
+
+
+def _encode(image, fmt, level, submitted):
+    started = time.monotonic()
+    render_control.record_stage('encode_wait', started - submitted)
+    data = image_formats.encode(image, fmt, compression=level)
+    render_control.record_stage('encode', time.monotonic() - started)
+    with _stats_lock:
+        if data:
+            _stats['encoded'] += 1
+            _stats['bytes_in'] += _image_bytes(image)
+            _stats['bytes_out'] += len(data)
+        else:
+            _stats['failed'] += 1
+    return data
+
+
+def submit(image, fmt='png', level=None):
+    """Queue ``image`` for encoding; returns a future of the bytes (None on failure)."""
+    level = current_level() if level is None else level
+    return _executor().submit(_encode, image, fmt, level, time.monotonic())
+
+
+def encode(image, fmt='png', level=None):
+    """Encode ``image`` on the encode pool and return its bytes (None on failure)."""
+    try:
+        return submit(image, fmt, level).result()
+    except Exception:
+        return None
+
+
+def encode_many(images, fmt='png', level=None):
+    """Encode several images in parallel; returns their bytes in the same order."""
+    futures = [submit(image, fmt, level) for image in images]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception:
+            results.append(None)
+    return results
+
+
+def shutdown():
+    """Stop the pool (a new one is created on the next encode)."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
+def stats():
+    with _stats_lock:
+        s = dict(_stats)
+    s['workers'] = ENCODE_WORKERS
+    s['png_level'] = PNG_LEVEL
+    s['png_level_prewarm'] = PNG_LEVEL_PREWARM
+    s['ratio'] = round(s['bytes_out'] / s['bytes_in'], 4) if s['bytes_in'] else 0.0
+    return s
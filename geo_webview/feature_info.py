@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""WMS GetFeatureInfo support: cached per-layer spatial indexes and hit tests.
+
+``FeatureIndexCache`` keeps one ``QgsSpatialIndex`` (bulk loaded,
+bounding boxes only) per vector layer, charged by an estimate of its
+size in a ``ByteBudgetLRU``. Concurrent requests for the same layer
+build the index once (``single_flight``). The WMS service drops a
+layer's index when its geometries change (edits, commit/rollback,
+subset string, data source) and an index built across such a change is
+not stored.
+
+``identify`` turns the request pixel into a search rectangle of
+``tolerance`` pixels in the CRS the map was rendered in (the GetMap
+normalization: usually EPSG:3857), looks up candidates in the
+index, fetches only those features and keeps the ones whose geometry
+really intersects the rectangle, nearest first.
+"""
+import html
+import json
+import re
+import threading
+
+from qgis.core import (
+    QgsCoordinateTransform, QgsFeatureRequest,
+    QgsGeometry, QgsJsonExporter, QgsMapSettings, QgsPointXY, QgsProject,
+    QgsRectangle, QgsSpatialIndex, QgsVectorLayer,
+)
+from qgis.PyQt.QtCore import QSize
+
+from . import single_flight
+
+# INFO_FORMAT -> output kind
+INFO_FORMATS = {
+    'text/html': 'html',
+    'application/json': 'json',
+    'application/geo+json': 'json',
+    'application/vnd.ogc.gml': 'gml',
+    'text/xml': 'gml',
+}
+CONTENT_TYPES = {
+    'html': 'text/html; charset=utf-8',
+    'json': 'application/json; charset=utf-8',
+    'gml': 'application/vnd.ogc.gml; charset=utf-8',
+}
+
+# rough memory of one index entry (R-tree node share + id + box)
+_ENTRY_BYTES = 96
+
+
+class FeatureIndexCache:
+    """Per-layer ``QgsSpatialIndex`` instances bounded by a byte budget.
+
+    Args:
+        cache: ``ByteBudgetLRU`` holding ``layer_id -> QgsSpatialIndex``
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._generations = {}
+        self._builds = 0
+
+    def invalidate(self, layer_id=None):
+        """Drop the index of ``layer_id`` (all indexes when None)."""
+        with self._lock:
+            if layer_id is None:
+                for lid in list(self._generations):
+                    self._generations[lid] += 1
+            else:
+                self._generations[layer_id] = self._generations.get(layer_id, 0) + 1
+        if layer_id is None:
+            self.cache.invalidate()
+        else:
+            self.cache.pop(layer_id)
+
+    def index_for(self, layer):
+        """Spatial index of ``layer`` (built on first use)."""
+        lid = layer.id()
+        index = self.cache.get(lid)
+        if index is not None:
+            return index
+
+        def _build():
+            with self._lock:
+                generation = self._generations.setdefault(lid, 0)
+            request = QgsFeatureRequest().setNoAttributes()
+            built = QgsSpatialIndex(layer.getFeatures(request))
+            with self._lock:
+                self._builds += 1
+                current = self._generations.get(lid, 0) == generation
+            if current:
+                count = max(0, int(layer.featureCount()))
+                self.cache.put(lid, built, size=max(1, count) * _ENTRY_BYTES)
+            return built
+
+        return single_flight.group('wms-featureinfo-index').do(lid, _build)
+
+    def stats(self):
+        s = self.cache.stats()
+        with self._lock:
+            s['builds'] = self._builds
+        return s
+
+
+def pixel_to_map(extent, width, height, i, j, rotation=0.0):
+    """Map point under pixel (``i``, ``j``) of a ``width`` x ``height`` image of ``extent``.
+
+    ``extent`` is the rendered extent, in the CRS the image was rendered in.
+
+    Returns:
+        tuple: (QgsPointXY, map units per pixel)
+    """
+    ms = QgsMapSettings()
+    ms.setExtent(extent)
+    ms.setOutputSize(QSize(int(width), int(height)))
+    ms.setOutputDpi(96)
+    if rotation:
+        ms.setRotation(float(rotation))
+    point = ms.mapToPixel().toMapCoordinates(float(i) + 0.5, float(j) + 0.5)
+    return QgsPointXY(point), float(ms.mapUnitsPerPixel())
+
+
+def _geometry_kind(layer):
+    try:
+        return int(getattr(layer.geometryType(), 'value', layer.geometryType()))
+    except Exception:
+        return -1
+
+
+def identify(layer, point, map_crs, map_units_per_pixel, tolerances, max_features, index_cache):
+    """Features of ``layer`` hit at ``point`` (in ``map_crs``), nearest first.
+
+    Args:
+        tolerances: pixels per geometry type ``{0: point, 1: line, 2: polygon}``
+        max_features: FEATURE_COUNT for this layer
+    """
+    tolerance_px = max(0.5, float(tolerances.get(_geometry_kind(layer), 0)))
+    radius = tolerance_px * map_units_per_pixel
+    search = QgsRectangle(point.x() - radius, point.y() - radius, point.x() + radius, point.y() + radius)
+    center = QgsGeometry.fromPointXY(point)
+    if layer.crs().isValid() and map_crs.isValid() and layer.crs() != map_crs:
+        transform = QgsCoordinateTransform(map_crs, layer.crs(), QgsProject.instance())
+        search = transform.transformBoundingBox(search)
+        center.transform(transform)
+
+    ids = index_cache.index_for(layer).intersects(search)
+    if not ids:
+        return []
+    search_geom = QgsGeometry.fromRect(search)
+    hits = []
+    for feature in layer.getFeatures(QgsFeatureRequest().setFilterFids(ids)):
+        geom = feature.geometry()
+        if geom is None or geom.isEmpty() or not geom.intersects(search_geom):
+            continue
+        hits.append((geom.distance(center), feature))
+    hits.sort(key=lambda h: h[0])
+    return [f for _, f in hits[:max(1, int(max_features))]]
+
+
+def _xml_name(value):
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', str(value)) or '_'
+    return name if re.match(r'[A-Za-z_]', name) else '_' + name
+
+
+def _value_text(value):
+    if value is None:
+        return ''
+    try:
+        from qgis.PyQt.QtCore import QVariant
+        if isinstance(value, QVariant) and value.isNull():
+            return ''
+    except Exception:
+        pass
+    return str(value)
+
+
+def to_html(results):
+    """``[(layer, [features])]`` as an HTML page with one table per layer."""
+    parts = ['<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>GetFeatureInfo</title></head><body>']
+    for layer, features in results:
+        parts.append(f'<h3>{html.escape(layer.name())}</h3>')
+        if not features:
+            parts.append('<p>No features</p>')
+            continue
+        names = [f.name() for f in layer.fields()]
+        parts.append('<table border="1"><tr>' + ''.join(f'<th>{html.escape(n)}</th>' for n in names) + '</tr>')
+        for feature in features:
+            cells = ''.join(f'<td>{html.escape(_value_text(v))}</td>' for v in feature.attributes())
+            parts.append(f'<tr>{cells}</tr>')
+        parts.append('</table>')
+    parts.append('</body></html>')
+    return '\n'.join(parts)
+
+
+def to_json(results):
+    """``[(layer, [features])]`` as one GeoJSON FeatureCollection (WGS84 geometries).
+
+    Every feature carries ``layer`` (name) and ``layer_id`` members.
+    """
+    collection = {'type': 'FeatureCollection', 'features': []}
+    for layer, features in results:
+        if not features:
+            continue
+        exporter = QgsJsonExporter(layer)
+        exporter.setSourceCrs(layer.crs())
+        exported = json.loads(exporter.exportFeatures(features))
+        for feature in exported.get('features', []):
+            feature['id'] = f"{layer.name()}.{feature.get('id')}"
+            feature['layer'] = layer.name()
+            feature['layer_id'] = layer.id()
+            collection['features'].append(feature)
+    return json.dumps(collection, ensure_ascii=False)
+
+
+def to_gml(results):
+    """``[(layer, [features])]`` as GML 2 in the msGMLOutput layout (layer CRS geometries)."""
+    from qgis.PyQt.QtXml import QDomDocument
+    from qgis.core import QgsOgcUtils
+
+    doc = QDomDocument()
+    root = doc.createElement('msGMLOutput')
+    root.setAttribute('xmlns:gml', 'http://www.opengis.net/gml')
+    root.setAttribute('xmlns:xsi', 'http://www.w3.org/2001/XMLSchema-instance')
+    doc.appendChild(root)
+    for layer, features in results:
+        lname = _xml_name(layer.name())
+        layer_el = doc.createElement(f'{lname}_layer')
+        name_el = doc.createElement('gml:name')
+        name_el.appendChild(doc.createTextNode(layer.name()))
+        layer_el.appendChild(name_el)
+        srs = layer.crs().authid() if layer.crs().isValid() else ''
+        names = [f.name() for f in layer.fields()]
+        for feature in features:
+            feature_el = doc.createElement(f'{lname}_feature')
+            feature_el.setAttribute('fid', f'{lname}.{feature.id()}')
+            geom = feature.geometry()
+            if geom is not None and not geom.isEmpty():
+                box = geom.boundingBox()
+                bounded = doc.createElement('gml:boundedBy')
+                bounded.appendChild(QgsOgcUtils.rectangleToGMLBox(box, doc))
+                feature_el.appendChild(bounded)
+                geom_el = doc.createElement('geometry')
+                gml = QgsOgcUtils.geometryToGML(geom, doc)
+                if srs:
+                    gml.setAttribute('srsName', srs)
+                geom_el.appendChild(gml)
+                feature_el.appendChild(geom_el)
+            for name, value in zip(names, feature.attributes()):
+                attr_el = doc.createElement(_xml_name(name))
+                attr_el.appendChild(doc.createTextNode(_value_text(value)))
+                feature_el.appendChild(attr_el)
+            layer_el.appendChild(feature_el)
+        root.appendChild(layer_el)
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + doc.toString(2)
+
+
+def render(kind, results):
+    return {'html': to_html, 'json': to_json, 'gml': to_gml}[kind](results)
+
+
+def is_queryable(layer):
+    return isinstance(layer, QgsVectorLayer) and layer.isValid() and layer.isSpatial()
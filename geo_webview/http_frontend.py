@@ -0,0 +1,691 @@
+# -*- coding: utf-8 -*-
+"""Non-blocking HTTP front end for the embedded geo_webview server.
+
+A single ``selectors`` loop owns the listening socket and every client
+connection: it accepts, reads and splits request heads, and writes
+responses without blocking. Only the request handler itself (rendering,
+feature serialization, ...) runs on the worker pool, so idle keep-alive
+connections and slow clients cost no worker threads.
+
+Handlers receive an :class:`HTTPConnection` and keep using the familiar
+socket-like ``sendall``/``sendfile``/``close`` API; writes are queued and
+flushed by the loop. File bodies are written with ``os.sendfile`` so they
+never pass through the Python heap.
+"""
+import collections
+import errno
+import os
+import selectors
+import socket
+import threading
+import time
+
+from . import http_server
+
+
+# errno values meaning "sendfile cannot be used for this fd pair"
+_SENDFILE_UNSUPPORTED = {getattr(errno, name) for name in
+                         ('EINVAL', 'ENOSYS', 'ENOTSOCK', 'EOPNOTSUPP', 'ENOTSUP', 'EOVERFLOW')
+                         if hasattr(errno, name)}
+
+
+class _FileSegment:
+    """Queued file body: ``remaining`` bytes of ``fd`` starting at ``offset``.
+
+    The segment owns ``fd`` (a duplicate of the caller's descriptor) and
+    closes it once written or when the connection is dropped.
+    """
+
+    __slots__ = ('fd', 'offset', 'remaining', 'use_sendfile')
+
+    def __init__(self, fd, offset, count):
+        self.fd = fd
+        self.offset = offset
+        self.remaining = count
+        self.use_sendfile = hasattr(os, 'sendfile')
+
+    def __len__(self):
+        return self.remaining
+
+    def close(self):
+        fd, self.fd = self.fd, -1
+        if fd >= 0:
+            try:
+                os.close(fd)
+            except Exception:
+                pass
+
+
+class HTTPConnection:
+    """Client connection state shared between the loop and a handler.
+
+    ``sendall`` may be called from a worker thread; the bytes are queued
+    and the loop is woken up to write them. A worker that gets more than
+    the frontend's ``outbox_high_water`` bytes ahead of the client blocks
+    until the loop has drained the backlog. ``close`` requests that the
+    loop drop the connection. The response helpers in ``http_server``
+    consult ``keep_alive`` to decide which ``Connection`` header to emit.
+    ``peer_closed`` becomes True as soon as the loop reads EOF from the
+    client, also while a handler is still running.
+    """
+
+    def __init__(self, frontend, sock, addr, keepalive_timeout, max_requests):
+        self.sock = sock
+        self.addr = addr
+        self.keepalive_timeout = float(keepalive_timeout)
+        self.max_requests = int(max_requests)
+        self.keep_alive = False
+        self.requests_served = 0
+        self.responses_sent = 0
+        self.closed = False
+        self.peer_closed = False
+
+        self._frontend = frontend
+        # preallocated receive buffer filled with recv_into; _inlen bytes are
+        # valid and the first _scanned of them are known not to end a head
+        self._inbuf = bytearray(frontend.initial_buffer_size)
+        self._inlen = 0
+        self._scanned = 0
+        self.request = None
+        self._outbox = collections.deque()
+        self._out_lock = threading.Lock()
+        # signalled when queued bytes are written or the connection is dropped
+        self._out_cond = threading.Condition(self._out_lock)
+        # in-memory bytes queued in _outbox (file segments are not counted)
+        self._out_bytes = 0
+        # 'reading' -> 'processing' (handler running) -> 'flushing' -> 'reading'
+        self._state = 'reading'
+        self._request_done = False
+        self._responses_before = 0
+        self._events = 0
+        self.deadline = None
+        # set while output is queued; pushed back whenever the client accepts bytes
+        self.write_deadline = None
+
+    def remaining_requests(self):
+        return max(0, self.max_requests - self.requests_served)
+
+    def sendall(self, data):
+        if self.closed:
+            raise OSError('connection closed')
+        if not data:
+            return
+        data = bytes(data)
+        limit = self._frontend.outbox_high_water
+        with self._out_cond:
+            # never block the loop itself (503/431 answers are sent from it)
+            if limit > 0 and threading.get_ident() != self._frontend._loop_ident:
+                while self._out_bytes >= limit and not self.closed:
+                    self._out_cond.wait(0.5)
+            if self.closed:
+                raise OSError('connection closed')
+            self._outbox.append(data)
+            self._out_bytes += len(data)
+        self._frontend._wake(self)
+
+    def sendfile(self, file, offset=0, count=None):
+        """Queue ``count`` bytes of ``file`` (from ``offset``) for zero-copy sending.
+
+        Mirrors ``socket.sendfile``: the caller keeps ownership of ``file``
+        and may close it right away, the queued segment uses a duplicated
+        descriptor.
+        """
+        if self.closed:
+            raise OSError('connection closed')
+        fd = file.fileno()
+        if count is None:
+            count = os.fstat(fd).st_size - offset
+        if count <= 0:
+            return
+        segment = _FileSegment(os.dup(fd), offset, count)
+        with self._out_lock:
+            # checked under the lock so a concurrent drop cannot leak the fd
+            if self.closed:
+                segment.close()
+                raise OSError('connection closed')
+            self._outbox.append(segment)
+        self._frontend._stat('file_responses')
+        self._frontend._wake(self)
+
+    def settimeout(self, value):
+        # Timeouts are enforced by the event loop.
+        pass
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.keep_alive = False
+        self.closed = True
+        self._frontend._wake(self)
+
+
+class HTTPFrontend:
+    """selectors-based accept/read/write loop.
+
+    Args:
+        listen_sock: bound and listening server socket
+        handler: ``handler(conn, request)`` run on ``executor`` with a parsed
+            :class:`http_server.HTTPRequest`
+        executor: worker pool for request handlers
+        keepalive_timeout: idle seconds before a kept-alive connection is closed
+        max_requests: maximum requests served per connection
+        header_timeout: seconds allowed to receive a complete request head
+        max_header_size: maximum request head size in bytes
+        on_stat: optional ``on_stat(key)`` counter callback
+        classify: optional ``classify(request)`` returning an admission class
+            name; unknown or failing classification counts as ``'static'``
+        admission_limits: ``{class: max queued+running requests}``; a class
+            without a positive limit is unbounded
+        max_queue_wait: seconds a request may wait for a worker before it
+            is answered 503 instead of being handled
+        retry_after: ``Retry-After`` seconds sent with 503 responses
+        write_timeout: seconds a connection with queued output may go
+            without accepting any bytes before it is dropped
+        outbox_high_water: queued bytes above which ``sendall`` on a worker
+            thread waits for the loop to drain the connection (0 = unbounded)
+    """
+
+    # Stop reading from a connection whose pipelined input exceeds this
+    # while a request is still being handled.
+    MAX_PIPELINE_BUFFER = 64 * 1024
+    RECV_CHUNK = 4096
+    # read size for the non-sendfile file fallback
+    FILE_CHUNK = 64 * 1024
+
+    def __init__(self, listen_sock, handler, executor,
+                 keepalive_timeout=None, max_requests=None,
+                 header_timeout=10.0, max_header_size=None, on_stat=None,
+                 classify=None, admission_limits=None, max_queue_wait=None, retry_after=None,
+                 write_timeout=None, outbox_high_water=None):
+        self._listen_sock = listen_sock
+        self._handler = handler
+        self._executor = executor
+        self.keepalive_timeout = float(http_server.KEEPALIVE_TIMEOUT_S if keepalive_timeout is None else keepalive_timeout)
+        self.max_requests = int(http_server.KEEPALIVE_MAX_REQUESTS if max_requests is None else max_requests)
+        self.header_timeout = float(header_timeout)
+        self.max_header_size = int(http_server.MAX_REQUEST_HEAD if max_header_size is None else max_header_size)
+        self.initial_buffer_size = min(16384, self.max_header_size)
+        self._on_stat = on_stat
+        self._classify = classify
+        self.admission_limits = dict(http_server.ADMISSION_LIMITS if admission_limits is None else admission_limits)
+        self.max_queue_wait = float(http_server.ADMISSION_MAX_WAIT_S if max_queue_wait is None else max_queue_wait)
+        self.retry_after = int(http_server.RETRY_AFTER_S if retry_after is None else retry_after)
+        self.write_timeout = float(http_server.WRITE_TIMEOUT_S if write_timeout is None else write_timeout)
+        self.outbox_high_water = int(http_server.OUTBOX_HIGH_WATER_BYTES if outbox_high_water is None else outbox_high_water)
+        self._loop_ident = None
+        # per-class counters: admitted (queued + running), running, shed
+        self._admit_lock = threading.Lock()
+        self._admitted = collections.Counter()
+        self._running_by_class = collections.Counter()
+        self._shed = collections.Counter()
+
+        self._selector = selectors.DefaultSelector()
+        self._conns = {}
+        self._running = False
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+
+    # ------------------------------------------------------------------
+    # public API
+    # ------------------------------------------------------------------
+    def serve_forever(self):
+        """Run the loop until :meth:`stop` is called (blocks the caller)."""
+        self._running = True
+        self._loop_ident = threading.get_ident()
+        self._listen_sock.setblocking(False)
+        self._selector.register(self._listen_sock, selectors.EVENT_READ, None)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        last_sweep = time.monotonic()
+        try:
+            while self._running:
+                for key, mask in self._selector.select(timeout=0.5):
+                    if key.fileobj is self._listen_sock:
+                        self._accept()
+                    elif key.fileobj is self._wake_r:
+                        self._drain_wakeups()
+                    else:
+                        conn = key.data
+                        if mask & selectors.EVENT_READ:
+                            self._on_readable(conn)
+                        if mask & selectors.EVENT_WRITE and not conn.closed:
+                            self._flush(conn)
+                now = time.monotonic()
+                if now - last_sweep >= 0.5:
+                    last_sweep = now
+                    self._sweep_timeouts(now)
+        finally:
+            self._shutdown()
+
+    def stop(self):
+        """Ask the loop to exit; safe to call from any thread."""
+        self._running = False
+        try:
+            self._wake_w.send(b'\0')
+        except Exception:
+            pass
+
+    def open_connections(self):
+        return len(self._conns)
+
+    def requests_in_flight(self):
+        return sum(1 for c in list(self._conns.values()) if c._state == 'processing')
+
+    def admission_stats(self):
+        """Per-class queue depth, running count, limit and shed count."""
+        with self._admit_lock:
+            classes = set(self.admission_limits) | set(self._admitted) | set(self._shed)
+            return {
+                cls: {
+                    'queued': self._admitted[cls] - self._running_by_class[cls],
+                    'running': self._running_by_class[cls],
+                    'limit': self.admission_limits.get(cls, 0),
+                    'shed': self._shed[cls],
+                }
+                for cls in sorted(classes)
+            }
+
+    # ------------------------------------------------------------------
+    # loop internals
+    # ------------------------------------------------------------------
+    def _stat(self, key):
+        if self._on_stat is not None:
+            try:
+                self._on_stat(key)
+            except Exception:
+                pass
+
+    def _wake(self, conn):
+        with self._pending_lock:
+            self._pending.add(conn)
+        try:
+            self._wake_w.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            # wake pipe already full: the loop will pick the connection up
+            pass
+        except Exception:
+            pass
+
+    def _drain_wakeups(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        except Exception:
+            pass
+        with self._pending_lock:
+            pending = list(self._pending)
+            self._pending.clear()
+        for conn in pending:
+            if not self._is_live(conn):
+                continue
+            if conn.closed:
+                self._drop(conn)
+                continue
+            if conn._outbox:
+                self._flush(conn)
+            if conn._request_done and not conn.closed:
+                conn._request_done = False
+                self._finish_request(conn)
+
+    def _is_live(self, conn):
+        try:
+            return self._conns.get(conn.sock.fileno()) is conn
+        except Exception:
+            return False
+
+    def _accept(self):
+        while True:
+            try:
+                sock, addr = self._listen_sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            try:
+                sock.setblocking(False)
+                http_server.enable_tcp_nodelay(sock)
+                conn = HTTPConnection(self, sock, addr, self.keepalive_timeout, self.max_requests)
+                conn.deadline = time.monotonic() + self.header_timeout
+                self._conns[sock.fileno()] = conn
+                self._set_interest(conn)
+                self._stat('connections_accepted')
+            except Exception:
+                try:
+                    sock.close()
+                except Exception:
+                    pass
+
+    def _on_readable(self, conn):
+        buf = conn._inbuf
+        if len(buf) - conn._inlen < self.RECV_CHUNK:
+            # grow for pipelined input; a single head is bounded by max_header_size
+            buf.extend(bytes(len(buf)))
+        try:
+            with memoryview(buf) as view:
+                n = conn.sock.recv_into(view[conn._inlen:])
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            n = 0
+        if not n:
+            conn.peer_closed = True
+            if conn._state == 'reading':
+                self._drop(conn)
+            else:
+                # keep the connection until the handler finishes; stop reading.
+                # Renders poll peer_closed and cancel themselves (render_control).
+                self._stat('client_disconnects')
+                self._set_interest(conn)
+            return
+        if conn._state == 'reading' and conn._inlen == 0:
+            # first bytes of a new request: bound the time to a full head
+            conn.deadline = time.monotonic() + self.header_timeout
+        conn._inlen += n
+        if conn._state == 'reading':
+            self._dispatch(conn)
+        else:
+            self._set_interest(conn)
+
+    def _dispatch(self, conn):
+        """Parse the next complete request head on ``conn`` and hand it to the pool."""
+        buf = conn._inbuf
+        end = buf.find(b'\r\n\r\n', max(0, conn._scanned - 3), conn._inlen)
+        if end < 0:
+            conn._scanned = conn._inlen
+            if conn._inlen >= self.max_header_size:
+                self._reject(conn, http_server.HTTPRequestError(
+                    431, 'Request Header Fields Too Large', 'Request head too large.'))
+            return
+        end += 4
+        if end > self.max_header_size:
+            self._reject(conn, http_server.HTTPRequestError(
+                431, 'Request Header Fields Too Large', 'Request head too large.'))
+            return
+        try:
+            with memoryview(buf) as view:
+                request = http_server.parse_request_head(view[:end])
+        except http_server.HTTPRequestError as e:
+            self._reject(conn, e)
+            return
+        except Exception:
+            self._drop(conn)
+            return
+        # compact: move pipelined bytes to the front without reallocating
+        rest = conn._inlen - end
+        if rest:
+            buf[:rest] = buf[end:conn._inlen]
+        conn._inlen = rest
+        conn._scanned = 0
+
+        conn._state = 'processing'
+        conn.deadline = None
+        conn.requests_served += 1
+        conn.keep_alive = False
+        conn.request = request
+        conn._responses_before = conn.responses_sent
+        self._stat('requests_total')
+        if conn.requests_served > 1:
+            self._stat('requests_reused')
+        cls = self._request_class(request)
+        if not self._admit(cls):
+            self._shed_request(conn, cls, f'Server busy: {cls} queue is full.')
+            return
+        self._set_interest(conn)
+        try:
+            self._executor.submit(self._run_handler, conn, request, cls, time.monotonic())
+        except Exception:
+            self._release(cls, False)
+            self._drop(conn)
+
+    def _request_class(self, request):
+        if self._classify is None:
+            return 'static'
+        try:
+            return self._classify(request) or 'static'
+        except Exception:
+            return 'static'
+
+    def _admit(self, cls):
+        limit = self.admission_limits.get(cls, 0)
+        with self._admit_lock:
+            if limit > 0 and self._admitted[cls] >= limit:
+                self._shed[cls] += 1
+                return False
+            self._admitted[cls] += 1
+            return True
+
+    def _release(self, cls, started):
+        with self._admit_lock:
+            self._admitted[cls] -= 1
+            if started:
+                self._running_by_class[cls] -= 1
+
+    def _shed_request(self, conn, cls, message):
+        """Answer 503 + Retry-After from the loop without running the handler."""
+        self._stat('requests_shed')
+        conn._state = 'flushing'
+        try:
+            conn.keep_alive = conn.request.keep_alive_requested and conn.remaining_requests() > 0
+        except Exception:
+            conn.keep_alive = False
+        http_server.send_service_unavailable(conn, message, self.retry_after)
+        self._after_write(conn)
+
+    def _reject(self, conn, error):
+        """Answer an unparseable request from the loop and close afterwards."""
+        self._stat('requests_rejected')
+        conn._inlen = 0
+        conn._state = 'flushing'
+        conn.keep_alive = False
+        http_server.send_http_response(conn, error.status_code, error.reason, error.message)
+        self._after_write(conn)
+
+    def _run_handler(self, conn, request, cls, admitted_at):
+        # worker thread
+        with self._admit_lock:
+            self._running_by_class[cls] += 1
+        try:
+            waited = time.monotonic() - admitted_at
+            if self.max_queue_wait > 0 and waited > self.max_queue_wait:
+                # the client has most likely given up; do not start the work
+                with self._admit_lock:
+                    self._shed[cls] += 1
+                self._stat('requests_shed')
+                try:
+                    conn.keep_alive = request.keep_alive_requested and conn.remaining_requests() > 0
+                except Exception:
+                    conn.keep_alive = False
+                http_server.send_service_unavailable(
+                    conn, f'Server busy: request waited {waited:.1f}s in the {cls} queue.', self.retry_after)
+            else:
+                self._handler(conn, request)
+        except Exception:
+            pass
+        finally:
+            self._release(cls, True)
+            conn._request_done = True
+            self._wake(conn)
+
+    def _finish_request(self, conn):
+        # response fully queued: decide whether the connection survives
+        if (not conn.keep_alive or conn.peer_closed
+                or conn.responses_sent == conn._responses_before):
+            conn.keep_alive = False
+        elif conn.remaining_requests() <= 0:
+            self._stat('max_requests_reached')
+            conn.keep_alive = False
+        conn._state = 'flushing'
+        self._after_write(conn)
+
+    def _flush(self, conn):
+        while True:
+            with conn._out_lock:
+                if not conn._outbox:
+                    break
+                data = conn._outbox.popleft()
+            if isinstance(data, _FileSegment):
+                before = data.remaining
+                try:
+                    done = self._send_file_segment(conn, data)
+                except OSError:
+                    data.close()
+                    self._drop(conn)
+                    return
+                if data.remaining != before:
+                    conn.write_deadline = None
+                if not done:
+                    with conn._out_lock:
+                        conn._outbox.appendleft(data)
+                    break
+                data.close()
+                continue
+            try:
+                sent = conn.sock.send(data)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError:
+                self._drop(conn)
+                return
+            if sent:
+                conn.write_deadline = None
+            with conn._out_cond:
+                conn._out_bytes -= sent
+                if sent < len(data):
+                    conn._outbox.appendleft(data[sent:])
+                if sent:
+                    conn._out_cond.notify_all()
+            if sent < len(data):
+                break
+        self._after_write(conn)
+
+    def _send_file_segment(self, conn, seg):
+        """Write as much of ``seg`` as the socket accepts; True once complete.
+
+        Uses ``os.sendfile`` where available and falls back to positioned
+        chunk reads for platforms or descriptors that do not support it.
+        """
+        while seg.remaining > 0:
+            if seg.use_sendfile:
+                try:
+                    sent = os.sendfile(conn.sock.fileno(), seg.fd, seg.offset, seg.remaining)
+                except (BlockingIOError, InterruptedError):
+                    return False
+                except OSError as e:
+                    if e.errno in _SENDFILE_UNSUPPORTED:
+                        seg.use_sendfile = False
+                        continue
+                    raise
+            else:
+                os.lseek(seg.fd, seg.offset, os.SEEK_SET)
+                chunk = os.read(seg.fd, min(seg.remaining, self.FILE_CHUNK))
+                if not chunk:
+                    raise OSError(errno.EIO, 'file shrank while sending')
+                try:
+                    sent = conn.sock.send(chunk)
+                except (BlockingIOError, InterruptedError):
+                    return False
+            if not sent:
+                if seg.use_sendfile:
+                    raise OSError(errno.EIO, 'file shrank while sending')
+                return False
+            seg.offset += sent
+            seg.remaining -= sent
+        return True
+
+    def _after_write(self, conn):
+        if not conn._outbox:
+            conn.write_deadline = None
+        elif conn.write_deadline is None and self.write_timeout > 0:
+            conn.write_deadline = time.monotonic() + self.write_timeout
+        if conn._outbox or conn._state != 'flushing':
+            self._set_interest(conn)
+            return
+        if not conn.keep_alive:
+            self._drop(conn)
+            return
+        conn._state = 'reading'
+        conn.request = None
+        conn.deadline = time.monotonic() + (self.header_timeout if conn._inlen else conn.keepalive_timeout)
+        self._set_interest(conn)
+        if conn._inlen:
+            self._dispatch(conn)
+
+    def _set_interest(self, conn):
+        events = 0
+        if not conn.peer_closed and (conn._state == 'reading' or conn._inlen < self.MAX_PIPELINE_BUFFER):
+            events |= selectors.EVENT_READ
+        if conn._outbox:
+            events |= selectors.EVENT_WRITE
+        if events == conn._events:
+            return
+        try:
+            if conn._events == 0:
+                self._selector.register(conn.sock, events, conn)
+            elif events == 0:
+                self._selector.unregister(conn.sock)
+            else:
+                self._selector.modify(conn.sock, events, conn)
+            conn._events = events
+        except Exception:
+            self._drop(conn)
+
+    def _sweep_timeouts(self, now):
+        for conn in list(self._conns.values()):
+            if conn._state == 'reading' and conn.deadline is not None and now > conn.deadline:
+                self._drop(conn)
+            elif conn.write_deadline is not None and now > conn.write_deadline:
+                # the client stopped reading our response
+                self._stat('write_timeouts')
+                self._drop(conn)
+
+    def _drop(self, conn):
+        try:
+            fd = conn.sock.fileno()
+        except Exception:
+            fd = -1
+        if self._conns.get(fd) is conn:
+            del self._conns[fd]
+        if conn._events:
+            try:
+                self._selector.unregister(conn.sock)
+            except Exception:
+                pass
+            conn._events = 0
+        conn.closed = True
+        conn.keep_alive = False
+        with conn._out_cond:
+            for item in conn._outbox:
+                if isinstance(item, _FileSegment):
+                    item.close()
+            conn._outbox.clear()
+            conn._out_bytes = 0
+            conn.write_deadline = None
+            # release workers blocked in sendall; they see ``closed``
+            conn._out_cond.notify_all()
+        try:
+            conn.sock.close()
+        except Exception:
+            pass
+
+    def _shutdown(self):
+        self._running = False
+        for conn in list(self._conns.values()):
+            self._drop(conn)
+        for sock in (self._listen_sock, self._wake_r, self._wake_w):
+            try:
+                self._selector.unregister(sock)
+            except Exception:
+                pass
+            try:
+                sock.close()
+            except Exception:
+                pass
+        try:
+            self._selector.close()
+        except Exception:
+            pass
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Precompiled request routing table for the embedded HTTP server.
+
+Routes are registered once at server start with their handler already
+resolved, and looked up per request in a fixed order: exact paths (dict),
+compiled regex patterns, then path prefixes (longest first), then the
+fallback. Every dispatch is timed per route; extra timing hooks can be
+attached for logging or profiling.
+"""
+import re
+import threading
+import time
+
+
+class Route:
+    """A routing table entry.
+
+    Attributes:
+        name: route name used for timing statistics
+        handler: ``handler(conn, request)``
+        admission: admission class name, or ``admission(request)`` returning one
+        label: prefix of the 500 message when the handler raises
+    """
+
+    __slots__ = ('name', 'handler', 'admission', 'label')
+
+    def __init__(self, name, handler, admission='static', label=None):
+        self.name = name
+        self.handler = handler
+        self.admission = admission
+        self.label = label or name
+
+    def admission_class(self, request):
+        if callable(self.admission):
+            return self.admission(request)
+        return self.admission
+
+
+class Router:
+    """Exact / regex / prefix routing table with per-route timing.
+
+    Args:
+        on_error: optional ``on_error(route, conn, request, exc)`` called when
+            a handler raises; by default a 500 response is sent
+    """
+
+    def __init__(self, on_error=None):
+        self._exact = {}
+        self._patterns = []
+        self._prefixes = []
+        self._fallback = None
+        self._on_error = on_error
+        self._hooks = []
+        self._timing_lock = threading.Lock()
+        # name -> [count, total_s, max_s, errors]
+        self._timings = {}
+
+    # ------------------------------------------------------------------
+    # registration (server start)
+    # ------------------------------------------------------------------
+    def add_exact(self, paths, route):
+        if isinstance(paths, str):
+            paths = (paths,)
+        for path in paths:
+            self._exact[path] = route
+        return route
+
+    def add_pattern(self, pattern, route):
+        self._patterns.append((re.compile(pattern, re.IGNORECASE), route))
+        return route
+
+    def add_prefix(self, prefix, route):
+        self._prefixes.append((prefix, route))
+        self._prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+        return route
+
+    def set_fallback(self, route):
+        self._fallback = route
+        return route
+
+    def add_timing_hook(self, hook):
+        """Register ``hook(route_name, elapsed_s, request)`` run after each dispatch."""
+        self._hooks.append(hook)
+
+    # ------------------------------------------------------------------
+    # lookup / dispatch (per request)
+    # ------------------------------------------------------------------
+    def resolve(self, path):
+        """Return the :class:`Route` for ``path`` (the fallback when nothing matches)."""
+        route = self._exact.get(path)
+        if route is not None:
+            return route
+        for regex, route in self._patterns:
+            if regex.match(path):
+                return route
+        for prefix, route in self._prefixes:
+            if path.startswith(prefix):
+                return route
+        return self._fallback
+
+    def admission_class(self, request):
+        route = self.resolve(request.path)
+        if route is None:
+            return 'static'
+        return route.admission_class(request)
+
+    def dispatch(self, conn, request):
+        """Run the matching handler; returns False when no route (and no fallback) matched."""
+        route = self.resolve(request.path)
+        if route is None:
+            return False
+        start = time.perf_counter()
+        failed = False
+        try:
+            route.handler(conn, request)
+        except Exception as e:
+            failed = True
+            if self._on_error is not None:
+                self._on_error(route, conn, request, e)
+            else:
+                from . import http_server
+                http_server.send_http_response(conn, 500, "Internal Server Error", f"{route.label} failed: {e}")
+        finally:
+            elapsed = time.perf_counter() - start
+            self._record(route.name, elapsed, failed)
+            for hook in self._hooks:
+                try:
+                    hook(route.name, elapsed, request)
+                except Exception:
+                    pass
+        return True
+
+    def _record(self, name, elapsed, failed):
+        with self._timing_lock:
+            entry = self._timings.get(name)
+            if entry is None:
+                entry = self._timings[name] = [0, 0.0, 0.0, 0]
+            entry[0] += 1
+            entry[1] += elapsed
+            if elapsed > entry[2]:
+                entry[2] = elapsed
+            if failed:
+                entry[3] += 1
+
+    def route_stats(self):
+        """Per-route count, mean/max milliseconds and error count."""
+        with self._timing_lock:
+            items = [(name, list(entry)) for name, entry in self._timings.items()]
+        return {
+            name: {
+                'count': count,
+                'mean_ms': round(total * 1000.0 / count, 2) if count else 0.0,
+                'max_ms': round(peak * 1000.0, 2),
+                'errors': errors,
+            }
+            for name, (count, total, peak, errors) in sorted(items)
+        }
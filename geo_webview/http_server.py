@@ -6,58 +6,669 @@ plugin's internal socket-based HTTP servers. Keeping these utilities
 centralized makes future extensions (middleware, logging, CORS, etc.)
 easier.
 """
+import collections
+import email.utils
+import hashlib
+import os
 import socket
+import threading
+import urllib.parse
+import zlib
 
 
-def read_http_request(conn, max_size=8192):
-    """Read raw HTTP request bytes from a connected socket.
+def _env_float(name, default):
+    try:
+        v = os.environ.get(name)
+        return float(v) if v not in (None, '') else float(default)
+    except Exception:
+        return float(default)
+
+
+def _env_int(name, default):
+    try:
+        v = os.environ.get(name)
+        return int(v) if v not in (None, '') else int(default)
+    except Exception:
+        return int(default)
+
+
+# HTTP/1.1 persistent connection defaults (overridable via environment)
+KEEPALIVE_TIMEOUT_S = _env_float('QMAP_KEEPALIVE_TIMEOUT_S', 5.0)
+KEEPALIVE_MAX_REQUESTS = _env_int('QMAP_KEEPALIVE_MAX_REQUESTS', 100)
+# A connection with queued output that accepts no bytes for this long is
+# dropped; a handler writing more than OUTBOX_HIGH_WATER_BYTES ahead of the
+# client blocks in sendall until the loop has drained the backlog.
+WRITE_TIMEOUT_S = _env_float('QMAP_WRITE_TIMEOUT_S', 30.0)
+OUTBOX_HIGH_WATER_BYTES = _env_int('QMAP_OUTBOX_HIGH_WATER_BYTES', 1024 * 1024)
+
+# Content-Encoding negotiation: text payloads at least this large are sent
+# gzip/deflate-compressed when the client accepts it.
+COMPRESS_MIN_BYTES = _env_int('QMAP_COMPRESS_MIN_BYTES', 1024)
+COMPRESS_LEVEL = _env_int('QMAP_COMPRESS_LEVEL', 6)
+# Byte budget of the digest-keyed store of precompressed cacheable bodies
+PRECOMPRESSED_CACHE_BYTES = _env_int('QMAP_PRECOMPRESSED_CACHE_BYTES', 16 * 1024 * 1024)
+
+# Request head limits: total head bytes, number of header fields and the
+# length of a single header line.
+MAX_REQUEST_HEAD = _env_int('QMAP_MAX_REQUEST_HEAD', 16384)
+MAX_HEADER_COUNT = 100
+MAX_HEADER_LINE = 8190
+
+# Listen backlog and admission control. Requests are classified as
+# 'render' (WMS GetMap/GetMapBatch, WMTS/XYZ tiles), 'feature' (WFS, WMS
+# GetFeatureInfo/GetLegendGraphic) or 'static'
+# (capabilities, pages, static files); each class may have at most this many
+# requests queued or running before new ones are answered 503 + Retry-After.
+# A request that waited longer than ADMISSION_MAX_WAIT_S for a worker is
+# shed the same way instead of being processed for a client that gave up.
+LISTEN_BACKLOG = _env_int('QMAP_LISTEN_BACKLOG', 128)
+ADMISSION_LIMITS = {
+    'render': _env_int('QMAP_ADMIT_RENDER', 64),
+    'feature': _env_int('QMAP_ADMIT_FEATURE', 32),
+    'static': _env_int('QMAP_ADMIT_STATIC', 256),
+}
+ADMISSION_MAX_WAIT_S = _env_float('QMAP_ADMIT_MAX_WAIT_S', 20.0)
+RETRY_AFTER_S = _env_int('QMAP_RETRY_AFTER_S', 2)
+
+# Routes slower than this are logged by the router timing hook (0 = off)
+SLOW_REQUEST_MS = _env_float('QMAP_SLOW_REQUEST_MS', 0)
+
+# Cache-Control sent with validated (ETag/Last-Modified) responses unless a
+# handler passes its own value: clients keep the body but revalidate.
+DEFAULT_CACHE_CONTROL = 'no-cache'
+
+
+class HTTPRequestError(Exception):
+    """Raised when a request head cannot be accepted."""
+
+    def __init__(self, status_code, reason, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.reason = reason
+        self.message = message
+
+
+class HTTPHeaders(dict):
+    """Case-insensitive header mapping (names are stored lower-cased).
+
+    Repeated fields are folded into one comma-separated value.
+    """
+
+    def __getitem__(self, name):
+        return dict.__getitem__(self, name.lower())
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name.lower())
+
+    def get(self, name, default=None):
+        return dict.get(self, name.lower(), default)
+
+
+class HTTPRequest:
+    """A parsed request head, shared by the router and all service handlers.
+
+    Attributes:
+        method: upper-cased request method
+        target: request target as sent by the client
+        version: protocol version string (e.g. ``HTTP/1.1``)
+        path: path component of ``target`` (not percent-decoded)
+        query: raw query string
+        params: ``urllib.parse.parse_qs`` result (values decoded exactly once)
+        headers: :class:`HTTPHeaders`
+        head_text: the request head decoded as ISO-8859-1
+    """
+
+    __slots__ = ('method', 'target', 'version', 'path', 'query', 'params', 'headers', 'head_text')
+
+    def __init__(self, method, target, version, path, query, params, headers, head_text=''):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.path = path
+        self.query = query
+        self.params = params
+        self.headers = headers
+        self.head_text = head_text
+
+    @property
+    def host(self):
+        return self.headers.get('host')
+
+    @property
+    def keep_alive_requested(self):
+        return wants_keep_alive(self.version, self.headers.get('connection'))
+
+
+def parse_request_head(head, max_headers=MAX_HEADER_COUNT, max_line=MAX_HEADER_LINE):
+    """Parse a request head (bytes-like, ending with CRLFCRLF) once.
+
+    The head is decoded a single time and split into lines a single time;
+    query values are percent-decoded by ``parse_qs`` only.
+
+    Raises:
+        HTTPRequestError: malformed request line or header limits exceeded
+    """
+    text = str(head, 'iso-8859-1')
+    lines = text.split('\r\n')
+
+    parts = lines[0].split()
+    if len(parts) != 3 or not parts[2].upper().startswith('HTTP/'):
+        raise HTTPRequestError(400, 'Bad Request', 'Malformed HTTP request line.')
+    method, target, version = parts
+
+    fields = {}
+    count = 0
+    for line in lines[1:]:
+        if not line:
+            continue
+        if len(line) > max_line:
+            raise HTTPRequestError(431, 'Request Header Fields Too Large', 'Header line too long.')
+        count += 1
+        if count > max_headers:
+            raise HTTPRequestError(431, 'Request Header Fields Too Large', 'Too many header fields.')
+        name, sep, value = line.partition(':')
+        if not sep or not name or name[-1] in ' \t':
+            raise HTTPRequestError(400, 'Bad Request', 'Malformed header field.')
+        name = name.lower()
+        value = value.strip()
+        prev = fields.get(name)
+        fields[name] = value if prev is None else prev + ', ' + value
+    headers = HTTPHeaders(fields)
+
+    split = urllib.parse.urlsplit(target)
+    params = urllib.parse.parse_qs(split.query) if split.query else {}
+    return HTTPRequest(method.upper(), target, version, split.path or '/', split.query, params, headers, text)
+
+
+def enable_tcp_nodelay(sock):
+    """Disable Nagle's algorithm so small headers are not delayed."""
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except Exception:
+        pass
+
+
+def wants_keep_alive(http_version, connection_header):
+    """Decide whether the client asked for a persistent connection.
+
+    HTTP/1.1 defaults to keep-alive unless ``Connection: close`` is sent;
+    HTTP/1.0 only keeps the connection when ``Connection: keep-alive`` is
+    explicitly requested.
+    """
+    tokens = [t.strip().lower() for t in (connection_header or '').split(',') if t.strip()]
+    if 'close' in tokens:
+        return False
+    if str(http_version).upper() == 'HTTP/1.0':
+        return 'keep-alive' in tokens
+    return True
+
+
+def _connection_header_lines(conn):
+    """Return the Connection/Keep-Alive header lines for ``conn``."""
+    if getattr(conn, 'keep_alive', False):
+        try:
+            timeout = int(getattr(conn, 'keepalive_timeout', KEEPALIVE_TIMEOUT_S))
+            remaining = conn.remaining_requests()
+            return ["Connection: keep-alive", f"Keep-Alive: timeout={timeout}, max={remaining}"]
+        except Exception:
+            return ["Connection: keep-alive"]
+    return ["Connection: close"]
+
+
+def _mark_response_sent(conn):
+    try:
+        conn.responses_sent += 1
+    except Exception:
+        pass
+
+
+def read_http_request(conn, max_size=MAX_REQUEST_HEAD, buffer=None):
+    """Read raw HTTP request head bytes from a blocking socket.
+
+    Reads into a preallocated ``bytearray`` with ``recv_into`` so the
+    buffer is never re-copied while it fills.
 
     Args:
-        conn: socket-like object with recv
+        conn: socket-like object with recv_into
         max_size: maximum bytes to read (prevents unbounded memory use)
+        buffer: optional ``bytearray`` of at least ``max_size`` bytes reused
+            across calls (e.g. one per connection)
 
     Returns:
         bytes: raw request bytes (may be empty on error/timeout)
     """
     try:
-        data = b''
-        while b'\r\n\r\n' not in data and len(data) < max_size:
-            chunk = conn.recv(1024)
-            if not chunk:
+        buf = buffer if buffer is not None and len(buffer) >= max_size else bytearray(max_size)
+        view = memoryview(buf)
+        length = 0
+        while length < max_size:
+            n = conn.recv_into(view[length:])
+            if not n:
                 break
-            data += chunk
-        return data
+            # only rescan the tail that could complete the terminator
+            if buf.find(b'\r\n\r\n', max(0, length - 3), length + n) >= 0:
+                length += n
+                break
+            length += n
+        return bytes(view[:length])
     except Exception:
         return b''
 
 
-def send_http_response(conn, status_code, reason, body, content_type="text/plain; charset=utf-8"):
+_COMPRESSIBLE_PREFIXES = ('text/', 'application/json', 'application/geo+json',
+                          'application/javascript', 'application/xml')
+
+_compression_lock = threading.Lock()
+_compression_stats = {
+    'responses_compressed': 0,
+    'bytes_before': 0,
+    'bytes_after': 0,
+    'precompressed_hits': 0,
+    'precompressed_misses': 0,
+}
+
+
+def _bump_compression(**amounts):
+    with _compression_lock:
+        for key, amount in amounts.items():
+            _compression_stats[key] = _compression_stats.get(key, 0) + amount
+
+
+def compression_stats():
+    """Return a snapshot of Content-Encoding counters."""
+    with _compression_lock:
+        stats = dict(_compression_stats)
+    with _precompressed_lock:
+        stats['precompressed_entries'] = len(_precompressed)
+        stats['precompressed_bytes'] = _precompressed_bytes[0]
+    return stats
+
+
+def is_compressible(content_type):
+    ct = (content_type or '').split(';', 1)[0].strip().lower()
+    return ct.startswith(_COMPRESSIBLE_PREFIXES) or ct.endswith('+xml')
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick ``'gzip'``, ``'deflate'`` or None from an Accept-Encoding value.
+
+    q-values are honoured (``q=0`` excludes a coding); gzip wins ties.
+    """
+    if not accept_encoding:
+        return None
+    prefs = {}
+    for item in accept_encoding.split(','):
+        token, _, qpart = item.partition(';')
+        token = token.strip().lower()
+        if token == 'x-gzip':
+            token = 'gzip'
+        q = 1.0
+        name, _, value = qpart.strip().partition('=')
+        if name.strip().lower() == 'q':
+            try:
+                q = float(value)
+            except ValueError:
+                q = 0.0
+        if token:
+            prefs[token] = q
+    best, best_q = None, 0.0
+    for coding in ('gzip', 'deflate'):
+        q = prefs.get(coding, prefs.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress_body(data, coding, level=None):
+    """Compress ``data`` with zlib as HTTP ``gzip`` or ``deflate`` (zlib-wrapped)."""
+    wbits = 31 if coding == 'gzip' else 15
+    comp = zlib.compressobj(COMPRESS_LEVEL if level is None else level, zlib.DEFLATED, wbits)
+    return comp.compress(data) + comp.flush()
+
+
+class PrecompressedBody:
+    """Response body that memoizes its gzip/deflate variants.
+
+    Each variant is compressed at most once, so a cached body served many
+    times is never compressed twice.
+    """
+
+    __slots__ = ('data', '_variants', '_lock', '_etag')
+
+    def __init__(self, data, digest=None):
+        self.data = data.encode('utf-8') if isinstance(data, str) else bytes(data or b'')
+        self._variants = {}
+        self._lock = threading.Lock()
+        self._etag = digest.hex()[:20] if digest else None
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def etag(self):
+        """Strong validator derived from the SHA-1 of the raw body."""
+        if self._etag is None:
+            self._etag = hashlib.sha1(self.data).hexdigest()[:20]
+        return self._etag
+
+    def encoded(self, coding):
+        if not coding:
+            return self.data
+        variant = self._variants.get(coding)
+        if variant is None:
+            with self._lock:
+                variant = self._variants.get(coding)
+                if variant is None:
+                    variant = compress_body(self.data, coding)
+                    self._variants[coding] = variant
+                    _bump_compression(precompressed_misses=1)
+                    return variant
+        _bump_compression(precompressed_hits=1)
+        return variant
+
+
+# sha1(body) -> PrecompressedBody, LRU by approximate bytes (raw size x2)
+_precompressed = collections.OrderedDict()
+_precompressed_lock = threading.Lock()
+_precompressed_bytes = [0]
+
+
+def precompressed(data):
+    """Return the shared :class:`PrecompressedBody` for identical bytes.
+
+    Used for cacheable responses (capabilities, static scripts) that are
+    regenerated per request but usually byte-identical.
+    """
+    if isinstance(data, PrecompressedBody):
+        return data
+    raw = data.encode('utf-8') if isinstance(data, str) else bytes(data or b'')
+    digest = hashlib.sha1(raw).digest()
+    with _precompressed_lock:
+        body = _precompressed.get(digest)
+        if body is not None:
+            _precompressed.move_to_end(digest)
+            return body
+        body = PrecompressedBody(raw, digest)
+        _precompressed[digest] = body
+        _precompressed_bytes[0] += 2 * len(raw)
+        while _precompressed_bytes[0] > PRECOMPRESSED_CACHE_BYTES and len(_precompressed) > 1:
+            _, old = _precompressed.popitem(last=False)
+            _precompressed_bytes[0] -= 2 * len(old.data)
+        return body
+
+
+def _request_header(conn, name):
+    request = getattr(conn, 'request', None)
+    if request is None:
+        return None
+    try:
+        return request.headers.get(name)
+    except Exception:
+        return None
+
+
+def format_http_date(timestamp):
+    """Format a POSIX timestamp as an IMF-fixdate (``Last-Modified`` etc.)."""
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+
+def parse_http_date(value):
+    """Parse an HTTP date into a POSIX timestamp, or None when invalid."""
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except Exception:
+        return None
+
+
+def _etag_value(etag, coding=None):
+    """Quoted ETag header value; compressed variants get a coding suffix."""
+    return f'"{etag}-{coding}"' if coding else f'"{etag}"'
+
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of an If-None-Match value against ``etag``.
+
+    Accepts ``*``, lists and ``W/`` prefixes, and the ``-gzip``/``-deflate``
+    suffixes this module appends to compressed variants.
+    """
+    if not if_none_match or not etag:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if candidate[:2] in ('W/', 'w/'):
+            candidate = candidate[2:]
+        candidate = candidate.strip('"')
+        for suffix in ('-gzip', '-deflate'):
+            if candidate.endswith(suffix):
+                candidate = candidate[:-len(suffix)]
+                break
+        if candidate == etag:
+            return True
+    return False
+
+
+def is_not_modified(conn, etag=None, last_modified=None):
+    """Return True when the current request's validators match.
+
+    If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2);
+    only GET and HEAD are eligible.
+    """
+    request = getattr(conn, 'request', None)
+    if request is None or getattr(request, 'method', 'GET') not in ('GET', 'HEAD'):
+        return False
+    inm = _request_header(conn, 'if-none-match')
+    if inm is not None:
+        return etag_matches(inm, etag)
+    ims = _request_header(conn, 'if-modified-since')
+    if ims and last_modified is not None:
+        since = parse_http_date(ims)
+        return since is not None and int(last_modified) <= since
+    return False
+
+
+def _validator_header_lines(etag, last_modified, cache_control, coding=None):
+    lines = []
+    if etag:
+        lines.append(f"ETag: {_etag_value(etag, coding)}")
+    if last_modified is not None:
+        lines.append(f"Last-Modified: {format_http_date(last_modified)}")
+    if cache_control:
+        lines.append(f"Cache-Control: {cache_control}")
+    return lines
+
+
+def _send_not_modified(conn, etag, last_modified, cache_control, content_type, extra_headers=None):
+    extra = list(extra_headers or ())
+    coding = None
+    if is_compressible(content_type):
+        extra.append("Vary: Accept-Encoding")
+        coding = negotiate_encoding(_request_header(conn, 'accept-encoding'))
+    header_lines = [
+        "HTTP/1.1 304 Not Modified",
+        "Access-Control-Allow-Origin: *",
+    ] + extra + _validator_header_lines(etag, last_modified, cache_control or DEFAULT_CACHE_CONTROL, coding) \
+        + _connection_header_lines(conn) + ["", ""]
+    conn.sendall("\r\n".join(header_lines).encode('utf-8'))
+    _mark_response_sent(conn)
+
+
+def check_not_modified(conn, etag=None, last_modified=None, cache_control=None, content_type=None,
+                       extra_headers=None):
+    """Answer a matching conditional GET/HEAD with 304 before any work.
+
+    Handlers call this with validators they can compute cheaply (identity
+    hash, cache key) ahead of disk reads and rendering. ``extra_headers``
+    (e.g. ``Vary``) are repeated on the 304 as on the full response.
+
+    Returns:
+        bool: True when a 304 was sent and the handler must stop
+    """
+    try:
+        if not is_not_modified(conn, etag, last_modified):
+            return False
+        _send_not_modified(conn, etag, last_modified, cache_control, content_type, extra_headers)
+        return True
+    except Exception:
+        return False
+
+
+def _response_head(conn, status_code, reason, content_length, content_type, extra):
+    header_lines = [
+        f"HTTP/1.1 {status_code} {reason}",
+        f"Content-Length: {content_length}",
+        f"Content-Type: {content_type}",
+        "Access-Control-Allow-Origin: *",
+    ] + extra + _connection_header_lines(conn) + [
+        "",
+        "",
+    ]
+    return "\r\n".join(header_lines).encode('utf-8')
+
+
+def _is_head(conn):
+    request = getattr(conn, 'request', None)
+    return getattr(request, 'method', None) == 'HEAD'
+
+
+def _send_response(conn, status_code, reason, body, content_type, cacheable=False,
+                   etag=None, last_modified=None, cache_control=None, extra_headers=None):
+    """Build headers, negotiate Content-Encoding and queue the response.
+
+    Successful responses carry ``etag``/``last_modified`` validators
+    (cacheable bodies get a content-digest ETag automatically) and are
+    downgraded to 304 when the request's validators match. Error responses
+    are marked ``no-store``. HEAD requests receive the headers only.
+    """
+    if isinstance(body, PrecompressedBody):
+        raw = body.data
+    elif isinstance(body, str):
+        raw = body.encode('utf-8')
+    else:
+        raw = body or b''
+
+    if status_code == 200:
+        if cacheable and etag is None:
+            if not isinstance(body, PrecompressedBody):
+                body = precompressed(raw)
+            etag = body.etag
+        if etag or last_modified is not None:
+            if cache_control is None:
+                cache_control = DEFAULT_CACHE_CONTROL
+            if is_not_modified(conn, etag, last_modified):
+                _send_not_modified(conn, etag, last_modified, cache_control, content_type, extra_headers)
+                return
+    else:
+        etag = last_modified = None
+        if status_code >= 400 and cache_control is None:
+            cache_control = 'no-store'
+
+    extra = list(extra_headers or ())
+    payload = raw
+    coding = None
+    if is_compressible(content_type):
+        extra.append("Vary: Accept-Encoding")
+        if len(raw) >= COMPRESS_MIN_BYTES:
+            coding = negotiate_encoding(_request_header(conn, 'accept-encoding'))
+            if coding:
+                if cacheable and not isinstance(body, PrecompressedBody):
+                    body = precompressed(raw)
+                if isinstance(body, PrecompressedBody):
+                    payload = body.encoded(coding)
+                else:
+                    payload = compress_body(raw, coding)
+                extra.append(f"Content-Encoding: {coding}")
+                _bump_compression(responses_compressed=1, bytes_before=len(raw), bytes_after=len(payload))
+
+    header = _response_head(conn, status_code, reason, len(payload), content_type,
+                            extra + _validator_header_lines(etag, last_modified, cache_control, coding))
+    conn.sendall(header if _is_head(conn) else header + payload)
+    _mark_response_sent(conn)
+
+
+def send_file_response(conn, path, content_type, etag=None, last_modified=None, cache_control=None,
+                       extra_headers=None):
+    """Send a file as a 200 response without loading it into memory.
+
+    The header is queued with ``sendall`` and the body handed to
+    ``conn.sendfile`` (the front end writes it with ``os.sendfile``; plain
+    sockets use ``socket.sendfile``). Connections without ``sendfile``
+    fall back to reading the file. ``last_modified`` defaults to the file
+    mtime; validators are checked first so a 304 never reads the body.
+
+    Returns:
+        bool: False when the file could not be opened (nothing was sent)
+    """
+    try:
+        fh = open(path, 'rb')
+    except OSError:
+        return False
+    with fh:
+        try:
+            st = os.fstat(fh.fileno())
+            if last_modified is None:
+                last_modified = int(st.st_mtime)
+            if cache_control is None:
+                cache_control = DEFAULT_CACHE_CONTROL
+            if is_not_modified(conn, etag, last_modified):
+                _send_not_modified(conn, etag, last_modified, cache_control, content_type, extra_headers)
+                return True
+            header = _response_head(conn, 200, 'OK', st.st_size, content_type,
+                                    list(extra_headers or ()) + _validator_header_lines(etag, last_modified, cache_control))
+            sender = getattr(conn, 'sendfile', None)
+            if _is_head(conn):
+                conn.sendall(header)
+            elif sender is not None:
+                conn.sendall(header)
+                sender(fh, 0, st.st_size)
+            else:
+                conn.sendall(header + fh.read(st.st_size))
+            _mark_response_sent(conn)
+        except Exception:
+            try:
+                conn.close()
+            except Exception:
+                pass
+    return True
+
+
+def send_http_response(conn, status_code, reason, body, content_type="text/plain; charset=utf-8", cacheable=False,
+                       etag=None, last_modified=None, cache_control=None):
     """Send a minimal HTTP response (text or bytes).
 
+    Text payloads are compressed when the client accepts gzip/deflate and
+    the body is at least ``COMPRESS_MIN_BYTES``.
+
     Args:
         conn: socket-like object with sendall
         status_code: integer HTTP status code
         reason: status reason phrase
-        body: str or bytes body
+        body: str, bytes or :class:`PrecompressedBody`
         content_type: Content-Type header value
+        cacheable: body is likely to be served again byte-identical; keep
+            its compressed variants in the shared precompressed store and
+            derive an ETag from its digest
+        etag: strong validator (unquoted) for a 200 response
+        last_modified: POSIX timestamp for ``Last-Modified``
+        cache_control: Cache-Control value (``no-cache`` when validated)
     """
     try:
-        if isinstance(body, str):
-            body_bytes = body.encode('utf-8')
-        else:
-            body_bytes = body or b''
+        _send_response(conn, status_code, reason, body, content_type, cacheable,
+                       etag, last_modified, cache_control)
+    except Exception:
+        try:
+            conn.close()
+        except Exception:
+            pass
 
-        header_lines = [
-            f"HTTP/1.1 {status_code} {reason}",
-            f"Content-Length: {len(body_bytes)}",
-            f"Content-Type: {content_type}",
-            "Access-Control-Allow-Origin: *",
-            "Connection: close",
-            "",
-            "",
-        ]
-        header = "\r\n".join(header_lines).encode('utf-8')
-        conn.sendall(header + body_bytes)
+
+def send_service_unavailable(conn, message, retry_after=None):
+    """Send ``503 Service Unavailable`` with a ``Retry-After`` header (load shedding)."""
+    seconds = RETRY_AFTER_S if retry_after is None else retry_after
+    try:
+        _send_response(conn, 503, "Service Unavailable", message, "text/plain; charset=utf-8",
+                       extra_headers=[f"Retry-After: {max(0, int(seconds))}"])
     except Exception:
         try:
             conn.close()
@@ -65,21 +676,11 @@ def send_http_response(conn, status_code, reason, body, content_type="text/plain
             pass
 
 
-def send_xml_response(conn, xml_content):
+def send_xml_response(conn, xml_content, cacheable=False, etag=None, cache_control=None):
     """Send a 200 OK XML response encoded as UTF-8."""
     try:
-        xml_bytes = xml_content.encode('utf-8')
-        header_lines = [
-            "HTTP/1.1 200 OK",
-            f"Content-Length: {len(xml_bytes)}",
-            "Content-Type: text/xml; charset=utf-8",
-            "Access-Control-Allow-Origin: *",
-            "Connection: close",
-            "",
-            "",
-        ]
-        header = "\r\n".join(header_lines).encode('utf-8')
-        conn.sendall(header + xml_bytes)
+        _send_response(conn, 200, "OK", xml_content, "text/xml; charset=utf-8", cacheable,
+                       etag, None, cache_control)
     except Exception:
         try:
             conn.close()
@@ -87,20 +688,12 @@ def send_xml_response(conn, xml_content):
             pass
 
 
-def send_binary_response(conn, status_code, reason, data, content_type):
+def send_binary_response(conn, status_code, reason, data, content_type, cacheable=False,
+                         etag=None, last_modified=None, cache_control=None, extra_headers=None):
     """Send a binary HTTP response (images, etc.)."""
     try:
-        header_lines = [
-            f"HTTP/1.1 {status_code} {reason}",
-            f"Content-Length: {len(data)}",
-            f"Content-Type: {content_type}",
-            "Access-Control-Allow-Origin: *",
-            "Connection: close",
-            "",
-            "",
-        ]
-        header = "\r\n".join(header_lines).encode('utf-8')
-        conn.sendall(header + data)
+        _send_response(conn, status_code, reason, data, content_type, cacheable,
+                       etag, last_modified, cache_control, extra_headers)
     except Exception:
         try:
             conn.close()
@@ -108,6 +701,48 @@ def send_binary_response(conn, status_code, reason, data, content_type):
             pass
 
 
+class StreamingResponse:
+    """200-style response whose body is queued piece by piece as it is produced.
+
+    HTTP/1.1 clients get ``Transfer-Encoding: chunked`` (the connection
+    can be kept alive); HTTP/1.0 clients get a body delimited by closing
+    the connection. HEAD requests receive the head only. The head is sent
+    by the constructor; call :meth:`write` for each piece and
+    :meth:`close` once at the end.
+    """
+
+    def __init__(self, conn, status_code, reason, content_type, extra_headers=None):
+        self._conn = conn
+        self._head_only = _is_head(conn)
+        request = getattr(conn, 'request', None)
+        self._chunked = str(getattr(request, 'version', 'HTTP/1.1')).upper() != 'HTTP/1.0'
+        if not self._chunked:
+            conn.keep_alive = False
+        header_lines = [
+            f"HTTP/1.1 {status_code} {reason}",
+            f"Content-Type: {content_type}",
+            "Access-Control-Allow-Origin: *",
+            "Cache-Control: no-store",
+        ]
+        if self._chunked:
+            header_lines.append("Transfer-Encoding: chunked")
+        header_lines += list(extra_headers or ()) + _connection_header_lines(conn) + ["", ""]
+        conn.sendall("\r\n".join(header_lines).encode('utf-8'))
+        _mark_response_sent(conn)
+
+    def write(self, data):
+        if self._head_only or not data:
+            return
+        if self._chunked:
+            self._conn.sendall(b'%x\r\n' % len(data) + bytes(data) + b'\r\n')
+        else:
+            self._conn.sendall(data)
+
+    def close(self):
+        if not self._head_only and self._chunked:
+            self._conn.sendall(b'0\r\n\r\n')
+
+
 def send_wms_error_response(conn, error_code, error_message):
         """Send an OWS-style ExceptionReport XML response for WMS errors.
 
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""Output image formats for WMS GetMap and WMTS/XYZ tiles.
+
+Formats are identified by their file extension (``png``, ``png8``,
+``jpg``, ``webp``), which is also the extension of the tile cache files,
+so every format has its own cache namespace. ``png8`` is a palette PNG
+(``image/png; mode=8bit``, see :mod:`png_quantize`) served as
+``image/png``. ``normalize`` maps WMS ``FORMAT`` values, WMTS
+``{Format}`` tokens and MIME types to that key; ``encode`` turns a
+rendered ``QImage`` into bytes.
+
+WebP is only offered when the Qt image plugins of the QGIS installation
+can write it (``qt5-image-formats-plugins`` / ``qtimageformats``).
+"""
+import os
+
+from . import png_quantize
+
+
+def _env_quality(name, default):
+    try:
+        v = os.environ.get(name)
+        return max(1, min(100, int(v))) if v not in (None, '') else default
+    except Exception:
+        return default
+
+
+# Lossy encoder quality (1-100)
+JPEG_QUALITY = _env_quality('QMAP_JPEG_QUALITY', 85)
+WEBP_QUALITY = _env_quality('QMAP_WEBP_QUALITY', 80)
+
+DEFAULT_FORMAT = 'png'
+
+# extension -> (advertised format name, Qt image writer format)
+FORMATS = {
+    'png': ('image/png', 'PNG'),
+    'png8': ('image/png; mode=8bit', 'PNG'),
+    'jpg': ('image/jpeg', 'JPEG'),
+    'webp': ('image/webp', 'WEBP'),
+}
+
+_ALIASES = {
+    'png': 'png', 'image/png': 'png',
+    'png8': 'png8', 'image/png8': 'png8', 'image/png;mode=8bit': 'png8',
+    'jpg': 'jpg', 'jpeg': 'jpg', 'image/jpeg': 'jpg', 'image/jpg': 'jpg',
+    'webp': 'webp', 'image/webp': 'webp',
+}
+
+# Accept negotiation: order among equally acceptable types (smallest first;
+# JPEG last because it drops transparency)
+_NEGOTIATION_ORDER = ('webp', 'png8', 'png', 'jpg')
+
+
+def normalize(value):
+    """Format key for a FORMAT value, MIME type or extension; None when unknown.
+
+    ``image/png; mode=8bit`` selects ``png8``; other MIME parameters are
+    ignored.
+    """
+    if not value:
+        return None
+    v = str(value).strip().lower().replace(' ', '')
+    if v in _ALIASES:
+        return _ALIASES[v]
+    return _ALIASES.get(v.split(';', 1)[0])
+
+
+def mime_type(fmt):
+    """Content-Type of format key ``fmt`` (PNG for unknown keys)."""
+    return FORMATS.get(fmt, FORMATS[DEFAULT_FORMAT])[0].split(';', 1)[0]
+
+
+_available = None
+
+
+def available():
+    """Format keys the Qt image writers of this installation can encode."""
+    global _available
+    if _available is None:
+        try:
+            from qgis.PyQt.QtGui import QImageWriter
+            writers = {bytes(f).decode('ascii', 'ignore').lower()
+                       for f in QImageWriter.supportedImageFormats()}
+        except Exception:
+            writers = {'png', 'jpeg'}
+        _available = tuple(fmt for fmt, (_, writer) in FORMATS.items()
+                           if writer == 'PNG' or writer.lower() in writers)
+    return _available
+
+
+def mime_types():
+    """Advertised names of :func:`available` formats (for GetCapabilities)."""
+    return [FORMATS[fmt][0] for fmt in available()]
+
+
+def negotiate(accept, default=DEFAULT_FORMAT):
+    """Pick a tile format from an HTTP ``Accept`` header.
+
+    Only formats the client names explicitly (``image/webp``,
+    ``image/jpeg``, ...) are candidates; wildcards just keep the default
+    acceptable, so ``*/*`` or a missing header yields ``default``. The
+    highest q-value wins, ties go to the smaller encoding.
+    """
+    if not accept:
+        return default
+    explicit = {}
+    for item in str(accept).split(','):
+        parts = item.strip().split(';')
+        fmt = _ALIASES.get(parts[0].strip().lower()) if '/' in parts[0] else None
+        if fmt is None or fmt not in available():
+            continue
+        q = 1.0
+        for p in parts[1:]:
+            name, _, value = p.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        explicit[fmt] = max(q, explicit.get(fmt, 0.0))
+    candidates = [(q, -_NEGOTIATION_ORDER.index(fmt), fmt) for fmt, q in explicit.items() if q > 0]
+    if not candidates:
+        return default
+    return max(candidates)[2]
+
+
+def png_quality(level):
+    """Qt writer quality selecting zlib ``level`` (0-9) for PNG output.
+
+    Qt's PNG writer uses ``(100 - quality) * 9 / 91`` as the zlib level.
+    """
+    level = max(0, min(9, int(level)))
+    return 100 - (level * 91 + 8) // 9
+
+
+def encode(image, fmt=DEFAULT_FORMAT, quality=None, compression=None):
+    """Encode a ``QImage`` as ``fmt``; returns bytes or None on failure.
+
+    JPEG has no alpha channel, so transparent images are flattened onto
+    white first (Qt would otherwise turn transparent pixels black). PNG8
+    falls back to a 32-bit PNG when the image cannot be quantized.
+    ``compression`` is the zlib level (0-9) of PNG/PNG8 output; None keeps
+    Qt's default.
+    """
+    from qgis.core import QgsMessageLog, Qgis
+    try:
+        from qgis.PyQt.QtCore import QByteArray, QBuffer, QIODevice, Qt
+        from qgis.PyQt.QtGui import QImage, QPainter
+
+        if fmt not in FORMATS:
+            fmt = DEFAULT_FORMAT
+        writer = FORMATS[fmt][1]
+        if quality is None:
+            if writer == 'PNG' and compression is not None:
+                quality = png_quality(compression)
+            else:
+                quality = {'jpg': JPEG_QUALITY, 'webp': WEBP_QUALITY}.get(fmt, -1)
+
+        if fmt == 'png8':
+            indexed = png_quantize.quantize(image)
+            if indexed is not None:
+                image = indexed
+        elif fmt == 'jpg' and image.hasAlphaChannel():
+            flat = QImage(image.size(), QImage.Format_RGB32)
+            flat.fill(Qt.white)
+            painter = QPainter(flat)
+            painter.drawImage(0, 0, image)
+            painter.end()
+            image = flat
+
+        byte_array = QByteArray()
+        buffer = QBuffer(byte_array)
+        # QIODevice.WriteOnly may be namespaced differently in Qt6/PyQt6.
+        write_mode = getattr(QIODevice, 'WriteOnly', None)
+        if write_mode is None:
+            om = getattr(QIODevice, 'OpenMode', None) or getattr(QIODevice, 'OpenModeFlag', None)
+            if om is not None and hasattr(om, 'WriteOnly'):
+                write_mode = getattr(om, 'WriteOnly')
+        if write_mode is None:
+            write_mode = 1
+        buffer.open(write_mode)
+        ok = image.save(buffer, writer, int(quality))
+        buffer.close()
+        if not ok:
+            QgsMessageLog.logMessage(f"❌ Failed to encode image as {writer}", "geo_webview", Qgis.Warning)
+            return None
+        return bytes(byte_array)
+    except Exception as e:
+        QgsMessageLog.logMessage(f"❌ Error encoding {fmt} image: {e}", "geo_webview", Qgis.Critical)
+        return None
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""WMS GetLegendGraphic: symbol swatches rendered once into a per-style sprite atlas.
+
+A layer's legend entries come from the renderer described by the
+layer's style QML, so named STYLEs need no style switch (vector layers:
+``legendSymbolItems()`` of a renderer loaded from the ``renderer-v2``
+element; raster layers: ``legendSymbologyItems()`` of a renderer created
+from the ``pipe/rasterrenderer`` element on the layer's provider). Every swatch is drawn once into a single atlas image: a grid
+of equal cells with a 1 px gap. ``LegendAtlas`` keeps that image, its PNG and the position
+of every entry. Atlases are cached by layer, style name and a digest
+of the style QML (the style identity), together with the swatch size.
+A style change alters the QML, so a stale atlas is never reused. The
+WMS service also drops a layer's entries when its style changes.
+
+A PNG legend is composed from the atlas (swatch plus label per row).
+The JSON legend returns the atlas as a data URI plus the position of
+every entry, so web clients can draw it as CSS or canvas sprites.
+"""
+import base64
+import hashlib
+import json
+import math
+
+from qgis.core import QgsRasterLayer, QgsReadWriteContext, QgsSymbolLayerUtils, QgsVectorLayer
+from qgis.PyQt.QtCore import QSize, Qt
+from qgis.PyQt.QtGui import QColor, QFont, QFontMetrics, QImage, QPainter
+from qgis.PyQt.QtXml import QDomDocument
+
+from . import image_formats
+
+PAD = 1  # gap between atlas cells
+ROW_GAP = 2  # vertical gap between rows of a composed legend
+TEXT_GAP = 6  # swatch to label
+
+
+class LegendAtlas:
+    """Swatches of one layer style packed into one image.
+
+    Attributes:
+        image: QImage atlas (ARGB32)
+        png: encoded atlas
+        entries: ``[{'label', 'rule_key', 'level', 'x', 'y', 'w', 'h'}]``;
+            entries without a symbol (rule-based headers) have no x/y/w/h
+    """
+
+    def __init__(self, image, png, entries, layer_name, identity):
+        self.image = image
+        self.png = png
+        self.entries = entries
+        self.layer_name = layer_name
+        self.identity = identity
+
+    def nbytes(self):
+        return len(self.png) + (self.image.sizeInBytes() if hasattr(self.image, 'sizeInBytes') else self.image.byteCount())
+
+
+def style_identity(qml):
+    return hashlib.sha1((qml or '').encode('utf-8')).hexdigest()[:12]
+
+
+def _vector_items(qml):
+    """``[(label, rule_key, level, symbol|None)]`` from the renderer in ``qml``."""
+    from qgis.core import QgsFeatureRenderer
+
+    doc = QDomDocument()
+    doc.setContent(qml)
+    element = doc.documentElement().firstChildElement('renderer-v2')
+    if element.isNull():
+        return []
+    renderer = QgsFeatureRenderer.load(element, QgsReadWriteContext())
+    if renderer is None:
+        return []
+    items = []
+    for item in renderer.legendSymbolItems():
+        symbol = item.symbol()
+        items.append((item.label() or '', item.ruleKey() or '', int(item.level()),
+                      symbol.clone() if symbol is not None else None))
+    return items
+
+
+# rasterrenderer type -> qgis.core class with a static create(element, input)
+_RASTER_RENDERERS = {
+    'singlebandgray': 'QgsSingleBandGrayRenderer',
+    'singlebandpseudocolor': 'QgsSingleBandPseudoColorRenderer',
+    'singlecolor': 'QgsSingleColorRenderer',
+    'paletted': 'QgsPalettedRasterRenderer',
+    'multibandcolor': 'QgsMultiBandColorRenderer',
+    'hillshade': 'QgsHillshadeRenderer',
+    'contour': 'QgsRasterContourRenderer',
+}
+
+
+def _raster_items(layer, qml):
+    """``[(label, '', 0, QColor)]`` from the raster renderer in ``qml`` (on ``layer``'s provider)."""
+    import qgis.core
+
+    doc = QDomDocument()
+    doc.setContent(qml)
+    element = doc.documentElement().firstChildElement('pipe').firstChildElement('rasterrenderer')
+    if element.isNull():
+        return []
+    renderer_class = getattr(qgis.core, _RASTER_RENDERERS.get(element.attribute('type'), ''), None)
+    if renderer_class is None:
+        return []
+    renderer = renderer_class.create(element, layer.dataProvider())
+    if renderer is None:
+        return []
+    return [(label or '', '', 0, QColor(color)) for label, color in renderer.legendSymbologyItems()]
+
+
+def _swatch(item, size):
+    """QImage of one swatch (a symbol preview or a color chip)."""
+    _, _, _, symbol = item
+    if isinstance(symbol, QColor):
+        image = QImage(size, QImage.Format_ARGB32)
+        image.fill(symbol)
+        return image
+    return QgsSymbolLayerUtils.symbolPreviewImage(symbol, size)
+
+
+def build_atlas(layer, qml, symbol_width, symbol_height):
+    """Render the legend swatches of ``layer`` (style ``qml``) into a ``LegendAtlas``."""
+    if isinstance(layer, QgsVectorLayer):
+        items = _vector_items(qml)
+    elif isinstance(layer, QgsRasterLayer):
+        items = _raster_items(layer, qml)
+    else:
+        items = []
+
+    drawable = [item for item in items if item[3] is not None]
+    columns = max(1, int(math.ceil(math.sqrt(len(drawable))))) if drawable else 1
+    rows = max(1, int(math.ceil(len(drawable) / float(columns)))) if drawable else 1
+    cell_w, cell_h = symbol_width + PAD, symbol_height + PAD
+    image = QImage(columns * cell_w, rows * cell_h, QImage.Format_ARGB32)
+    image.fill(Qt.transparent)
+
+    entries = []
+    size = QSize(symbol_width, symbol_height)
+    painter = QPainter(image)
+    try:
+        n = 0
+        for item in items:
+            label, rule_key, level, symbol = item
+            entry = {'label': label, 'rule_key': rule_key, 'level': level}
+            if symbol is not None:
+                x, y = (n % columns) * cell_w, (n // columns) * cell_h
+                swatch = _swatch(item, size)
+                if swatch is not None and not swatch.isNull():
+                    painter.drawImage(x, y, swatch)
+                entry.update({'x': x, 'y': y, 'w': symbol_width, 'h': symbol_height})
+                n += 1
+            entries.append(entry)
+    finally:
+        painter.end()
+
+    png = image_formats.encode(image, 'png') or b''
+    return LegendAtlas(image, png, entries, layer.name(), style_identity(qml))
+
+
+def _font():
+    font = QFont()
+    font.setPixelSize(12)
+    return font
+
+
+def compose(atlases, transparent=False):
+    """Legend image: per layer a title row, then one row (swatch + label) per entry."""
+    font = _font()
+    title_font = QFont(font)
+    title_font.setBold(True)
+    metrics, title_metrics = QFontMetrics(font), QFontMetrics(title_font)
+
+    def _text_width(m, text):
+        return m.horizontalAdvance(text) if hasattr(m, 'horizontalAdvance') else m.width(text)
+
+    rows = []  # (kind, payload, height)
+    width = 1
+    for atlas in atlases:
+        rows.append(('title', atlas.layer_name, title_metrics.height()))
+        width = max(width, _text_width(title_metrics, atlas.layer_name))
+        for entry in atlas.entries:
+            indent = 12 * entry.get('level', 0)
+            swatch_w = entry.get('w', 0)
+            height = max(entry.get('h', 0), metrics.height())
+            rows.append(('entry', (atlas, entry, indent), height))
+            width = max(width, indent + swatch_w + TEXT_GAP + _text_width(metrics, entry['label']))
+    height = max(1, sum(h + ROW_GAP for _, _, h in rows))
+    width += 2 * ROW_GAP
+
+    image = QImage(width, height, QImage.Format_ARGB32)
+    image.fill(Qt.transparent if transparent else Qt.white)
+    painter = QPainter(image)
+    try:
+        painter.setPen(QColor(0, 0, 0))
+        y = 0
+        for kind, payload, h in rows:
+            if kind == 'title':
+                painter.setFont(title_font)
+                painter.drawText(ROW_GAP, y, width, h, int(Qt.AlignLeft | Qt.AlignVCenter), payload)
+            else:
+                atlas, entry, indent = payload
+                x = ROW_GAP + indent
+                if 'x' in entry:
+                    painter.drawImage(x, y + (h - entry['h']) // 2, atlas.image,
+                                      entry['x'], entry['y'], entry['w'], entry['h'])
+                    x += entry['w'] + TEXT_GAP
+                painter.setFont(font)
+                painter.drawText(x, y, width - x, h, int(Qt.AlignLeft | Qt.AlignVCenter), entry['label'])
+            y += h + ROW_GAP
+    finally:
+        painter.end()
+    return image
+
+
+def to_json(atlases, layers):
+    """JSON legend: per layer the atlas as a PNG data URI and the entry positions."""
+    result = {'layers': []}
+    for atlas, layer in zip(atlases, layers):
+        result['layers'].append({
+            'layer': atlas.layer_name,
+            'layer_id': layer.id(),
+            'style_identity': atlas.identity,
+            'sprite': 'data:image/png;base64,' + base64.b64encode(atlas.png).decode('ascii'),
+            'symbols': atlas.entries,
+        })
+    return json.dumps(result, ensure_ascii=False)
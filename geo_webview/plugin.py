@@ -314,6 +314,15 @@ class GeoWebView:
             except Exception:
                 pass
 
+        # 大きなラスタのオーバービュー作成（メニューのみ）
+        self.add_action(
+            icon_path,
+            text=self.tr(u'Build raster overviews'),
+            callback=self.server_manager.build_raster_overviews,
+            add_to_toolbar=False,
+            status_tip=self.tr(u'Build missing overviews (pyramids) of large project rasters in the background'),
+            parent=self.iface.mainWindow())
+
         # HTTPサーバーを起動
         self.server_manager.start_http_server()
 
@@ -588,6 +597,7 @@ class GeoWebView:
         """プラグインのアンロード時の処理"""
         # HTTPサーバーを停止
         self.server_manager.stop_http_server()
+        self.server_manager.release_raster_overviews()
         
         # パネルを削除
         if self.panel is not None:
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Palette quantization of rendered images for PNG8 output.
+
+Vector-styled map tiles rarely use more than a few hundred distinct
+colours, so a 256-entry palette (with per-entry alpha, written by Qt as
+PLTE + tRNS) is usually visually lossless and much smaller than 32-bit
+RGBA. Images with at most 256 colours are converted exactly; others are
+reduced with a weighted median cut over the image's unique colours.
+
+Everything works on the ``QImage`` buffer through NumPy; there are no
+per-pixel Python loops. NumPy is optional: without it :func:`quantize`
+returns None and callers keep the 32-bit image.
+"""
+import os
+
+
+def _env_colors():
+    try:
+        v = os.environ.get('QMAP_PNG8_COLORS')
+        return max(2, min(256, int(v))) if v not in (None, '') else 256
+    except Exception:
+        return 256
+
+
+# Palette size of PNG8 output
+PNG8_COLORS = _env_colors()
+
+
+def _numpy():
+    try:
+        import numpy
+        return numpy
+    except Exception:
+        return None
+
+
+def _median_cut(np, channels, counts, max_colors):
+    """Split the colour set into at most ``max_colors`` boxes.
+
+    Args:
+        channels: (n, 4) int array of unique colours (a, r, g, b)
+        counts: (n,) pixel count of each colour
+
+    Returns:
+        (labels, palette): box number of every unique colour and the
+        (k, 4) count-weighted mean colour of every box
+    """
+    def _score(idx):
+        if len(idx) < 2:
+            return 0, 0
+        spans = np.ptp(channels[idx], axis=0)
+        axis = int(spans.argmax())
+        # prefer wide boxes that cover many pixels
+        return int(spans[axis]) * int(counts[idx].sum()), axis
+
+    boxes = [np.arange(len(channels))]
+    scores = [_score(boxes[0])]
+    while len(boxes) < max_colors:
+        i = max(range(len(boxes)), key=lambda k: scores[k][0])
+        if scores[i][0] <= 0:
+            break
+        idx = boxes[i]
+        axis = scores[i][1]
+        idx = idx[np.argsort(channels[idx, axis], kind='stable')]
+        cum = np.cumsum(counts[idx])
+        cut = int(np.searchsorted(cum, cum[-1] / 2.0))
+        cut = min(max(cut, 1), len(idx) - 1)
+        low, high = idx[:cut], idx[cut:]
+        boxes[i], scores[i] = low, _score(low)
+        boxes.append(high)
+        scores.append(_score(high))
+
+    labels = np.empty(len(channels), dtype=np.intp)
+    for n, idx in enumerate(boxes):
+        labels[idx] = n
+    weight = np.bincount(labels, weights=counts, minlength=len(boxes))
+    palette = np.stack([np.bincount(labels, weights=channels[:, c] * counts, minlength=len(boxes))
+                        for c in range(4)], axis=1) / weight[:, None]
+    return labels, np.clip(np.rint(palette), 0, 255).astype(np.int64)
+
+
+def quantize(image, max_colors=None):
+    """Return an 8-bit indexed copy of ``image`` (None without NumPy or on failure).
+
+    Fully transparent pixels share one palette entry; other colours keep
+    their alpha in the palette.
+    """
+    np = _numpy()
+    if np is None or image is None or image.isNull():
+        return None
+    try:
+        from qgis.PyQt.QtGui import QImage
+
+        max_colors = PNG8_COLORS if max_colors is None else max(2, min(256, int(max_colors)))
+        src = image.convertToFormat(QImage.Format_ARGB32)
+        w, h = src.width(), src.height()
+        bpl = src.bytesPerLine()
+        ptr = src.constBits()
+        ptr.setsize(h * bpl)
+        # Format_ARGB32 pixels are native-endian 0xAARRGGBB words, i.e. QRgb
+        pixels = np.frombuffer(ptr, dtype=np.uint32).reshape(h, bpl // 4)[:, :w].ravel()
+        pixels = np.where((pixels >> 24) == 0, np.uint32(0), pixels)
+
+        colors, inverse, counts = np.unique(pixels, return_inverse=True, return_counts=True)
+        if len(colors) <= max_colors:
+            palette = colors.astype(np.int64)
+            index = inverse
+        else:
+            channels = np.stack([(colors >> s) & 0xFF for s in (24, 16, 8, 0)], axis=1).astype(np.int64)
+            labels, boxes = _median_cut(np, channels, counts, max_colors)
+            palette = (boxes[:, 0] << 24) | (boxes[:, 1] << 16) | (boxes[:, 2] << 8) | boxes[:, 3]
+            index = labels[inverse]
+
+        out = QImage(w, h, QImage.Format_Indexed8)
+        out.setColorTable([int(c) for c in palette])
+        out_bpl = out.bytesPerLine()
+        buf = out.bits()
+        buf.setsize(h * out_bpl)
+        dst = np.ndarray(shape=(h, out_bpl), dtype=np.uint8, buffer=buf)
+        dst[:, :w] = index.reshape(h, w)
+        return out
+    except Exception as e:
+        try:
+            from qgis.core import QgsMessageLog, Qgis
+            QgsMessageLog.logMessage(f"⚠️ PNG8 quantization failed: {e}", "geo_webview", Qgis.Warning)
+        except Exception:
+            pass
+        return None
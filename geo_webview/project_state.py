@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Project-level map state shared by the OWS services.
+
+The *identity* of the map is a deterministic description of the visible
+layers (in layer-tree order) and the style each one currently uses. It
+changes whenever the rendered output of an unparameterized request could
+change because of a layer/style switch, and is used as a cache and
+coalescing key component by WMTS, WMS and the render caches.
+"""
+import hashlib
+import json
+
+
+def extract_style_id(layer_obj):
+    """Return the current style name of ``layer_obj`` ('' when unavailable).
+
+    Only the style manager's ``currentStyle`` is consulted (no fallbacks).
+    """
+    try:
+        if layer_obj is None:
+            return ''
+        sm_attr = getattr(layer_obj, 'styleManager', None)
+        sm = None
+        if callable(sm_attr):
+            try:
+                sm = sm_attr()
+            except Exception:
+                sm = None
+        else:
+            sm = sm_attr
+        if sm is None:
+            return ''
+        val = getattr(sm, 'currentStyle', None)
+        if val is None:
+            return ''
+        if callable(val):
+            try:
+                v = val()
+            except Exception:
+                v = None
+        else:
+            v = val
+        return str(v) if v else ''
+    except Exception:
+        return ''
+
+
+def identity_info():
+    """Return ``(identity_short, identity_raw)`` for the current project.
+
+    identity_raw is a compact, key-sorted JSON of the visible layers with
+    their style ids; identity_short is the first 12 hex chars of its sha1.
+    """
+    from qgis.core import QgsProject
+    layers = []
+    root = QgsProject.instance().layerTreeRoot()
+    for lnode in root.findLayers():
+        try:
+            if not lnode.isVisible():
+                continue
+            layer_obj = lnode.layer()
+            if layer_obj is None:
+                continue
+            layers.append({'id': layer_obj.id(), 'style_id': extract_style_id(layer_obj)})
+        except Exception:
+            continue
+    identity_raw = json.dumps({'layers': layers}, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    identity_short = hashlib.sha1(identity_raw.encode('utf-8')).hexdigest()[:12]
+    return identity_short, identity_raw
+
+
+def identity_short():
+    """Short identity only (see :func:`identity_info`); '' on failure."""
+    try:
+        return identity_info()[0]
+    except Exception:
+        return ''
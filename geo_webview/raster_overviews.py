@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""Overview (pyramid) builder for large project rasters.
+
+A GeoTIFF without overviews is read at full resolution for every
+low-zoom render: GDAL has to read and resample every source pixel the
+render covers. This module finds local GDAL raster layers of the project
+that have neither internal nor external overviews and builds external
+``.ovr`` overviews for them with the ``QgsRasterDataProvider`` pyramid
+API in a ``QgsTask``, i.e. in the background with progress and a cancel
+button in the QGIS task manager, while the server keeps serving.
+
+The task opens its own ``QgsRasterLayer`` on each file, so the layers the
+server renders are not touched from the worker thread. When it finishes,
+the project layers are reloaded (on the main thread) to pick the
+overviews up.
+
+The report (layers still lacking overviews and the estimated speedup) is
+refreshed on the main thread on project changes and when a build ends,
+and is shown in ``/server-stats`` as ``raster_overviews``.
+"""
+import math
+import os
+import threading
+import time
+
+from qgis.core import QgsTask
+
+
+def _env_int(name, default):
+    try:
+        v = os.environ.get(name)
+        return int(v) if v not in (None, '') else default
+    except Exception:
+        return default
+
+
+# rasters whose longer side is below this many pixels are not worth it
+MIN_SIDE = max(256, _env_int('QMAP_PYRAMID_MIN_SIDE', 4096))
+# GDAL overview resampling (NEAREST, AVERAGE, GAUSS, CUBIC, MODE, ...)
+RESAMPLING = (os.environ.get('QMAP_PYRAMID_RESAMPLING') or 'AVERAGE').strip().upper()
+# render size used for the speedup estimate (a 4x4 metatile is ~1024 px)
+ESTIMATE_SIDE = 1024
+
+
+def _source_path(layer):
+    """Local file behind a GDAL raster layer, or None."""
+    try:
+        if layer.providerType() != 'gdal':
+            return None
+        path = layer.source().split('|', 1)[0]
+        return path if os.path.isfile(path) else None
+    except Exception:
+        return None
+
+
+def estimated_speedup(width, height, side=ESTIMATE_SIDE):
+    """Pixels read without overviews / with them, for a render of ``side`` px covering the raster.
+
+    Without overviews every source pixel is read; with power-of-two
+    overviews GDAL reads the coarsest level that is still at least as
+    detailed as the output.
+    """
+    longest = max(int(width), int(height))
+    if longest <= side:
+        return 1.0
+    factor = 2 ** int(math.floor(math.log2(longest / float(side))))
+    return float(factor * factor)
+
+
+def _has_overviews(provider):
+    try:
+        return bool(provider.hasPyramids())
+    except Exception:
+        return False
+
+
+def _pyramid_format():
+    try:
+        from qgis.core import Qgis
+        return Qgis.RasterPyramidFormat.GeoTiff
+    except Exception:
+        from qgis.core import QgsRaster
+        return QgsRaster.PyramidsGTiff
+
+
+def _mark_build(pyramid):
+    if hasattr(pyramid, 'setBuild'):
+        pyramid.setBuild(True)
+    else:
+        pyramid.build = True
+
+
+def survey(project=None):
+    """Describe the project's local GDAL rasters (call on the main thread).
+
+    Returns:
+        list: dicts with layer_id, name, path, width, height, has_overviews,
+        candidate (large, no overviews, writable directory), reason and
+        est_speedup
+    """
+    from qgis.core import QgsProject, QgsRasterLayer
+
+    project = project or QgsProject.instance()
+    rows = []
+    for layer in project.mapLayers().values():
+        if not isinstance(layer, QgsRasterLayer) or not layer.isValid():
+            continue
+        path = _source_path(layer)
+        if path is None:
+            continue
+        width, height = int(layer.width()), int(layer.height())
+        has_ovr = _has_overviews(layer.dataProvider())
+        reason = ''
+        if has_ovr:
+            reason = 'has overviews'
+        elif max(width, height) < MIN_SIDE:
+            reason = f'smaller than {MIN_SIDE} px'
+        elif not os.access(os.path.dirname(path) or '.', os.W_OK):
+            reason = 'directory not writable'
+        rows.append({
+            'layer_id': layer.id(),
+            'name': layer.name(),
+            'path': path,
+            'width': width,
+            'height': height,
+            'has_overviews': has_ovr,
+            'candidate': not reason,
+            'reason': reason,
+            'est_speedup': estimated_speedup(width, height) if not has_ovr else 1.0,
+        })
+    return rows
+
+
+class RasterOverviewManager:
+    """Owns the survey report and the running build task."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._report = []
+        self._task = None
+        self._progress = {}
+        self._last_results = []
+        self._surveyed_at = None
+
+    # -- report -------------------------------------------------------
+    def refresh(self, *args):
+        """Re-survey the project (signal slot; main thread)."""
+        try:
+            rows = survey()
+        except Exception as e:
+            rows = []
+            self._log(f"⚠️ Raster overview survey failed: {e}", warning=True)
+        with self._lock:
+            self._report = rows
+            self._surveyed_at = time.time()
+        return rows
+
+    def missing(self):
+        with self._lock:
+            return [dict(r) for r in self._report if not r['has_overviews']]
+
+    def stats(self):
+        with self._lock:
+            report = [dict(r) for r in self._report]
+            progress = dict(self._progress)
+            results = list(self._last_results)
+            running = self._task is not None
+            surveyed_at = self._surveyed_at
+        missing = [r for r in report if not r['has_overviews']]
+        return {
+            'rasters': len(report),
+            'missing_overviews': [
+                {k: r[k] for k in ('name', 'width', 'height', 'candidate', 'reason', 'est_speedup')}
+                for r in missing
+            ],
+            'building': running,
+            'progress': progress,
+            'last_build': results,
+            'min_side': MIN_SIDE,
+            'resampling': RESAMPLING,
+            'surveyed_at': surveyed_at,
+        }
+
+    # -- build --------------------------------------------------------
+    def is_running(self):
+        with self._lock:
+            return self._task is not None
+
+    def start_build(self, layer_ids=None):
+        """Queue a background build for the candidate layers (main thread).
+
+        Returns:
+            list: rows that will be built (empty when nothing to do or a build is running)
+        """
+        from qgis.core import QgsApplication
+
+        if self.is_running():
+            return []
+        rows = [r for r in self.refresh() if r['candidate']
+                and (layer_ids is None or r['layer_id'] in layer_ids)]
+        if not rows:
+            return []
+        task = OverviewBuildTask(rows, RESAMPLING, self)
+        with self._lock:
+            self._task = task
+            self._progress = {'layer': None, 'done': 0, 'total': len(rows), 'percent': 0.0}
+        QgsApplication.taskManager().addTask(task)
+        return rows
+
+    def cancel(self):
+        with self._lock:
+            task = self._task
+        if task is not None:
+            task.cancel()
+
+    def _set_progress(self, **values):
+        with self._lock:
+            self._progress.update(values)
+
+    def _finished(self, task, results):
+        """Main thread: reload the layers that got overviews and re-survey."""
+        from qgis.core import QgsProject
+
+        project = QgsProject.instance()
+        for result in results:
+            if not result.get('ok'):
+                continue
+            layer = project.mapLayer(result['layer_id'])
+            if layer is None:
+                continue
+            try:
+                layer.dataProvider().reloadData()
+                layer.triggerRepaint()
+            except Exception:
+                pass
+        with self._lock:
+            if self._task is task:
+                self._task = None
+            self._last_results = results
+        rows = self.refresh()
+        still = [r['name'] for r in rows if not r['has_overviews']]
+        built = [r['name'] for r in results if r.get('ok')]
+        self._log(f"🗻 Raster overviews built for {len(built)} layer(s): {', '.join(built) or '-'}; "
+                  f"still without overviews: {', '.join(still) or 'none'}")
+
+    @staticmethod
+    def _log(message, warning=False):
+        try:
+            from qgis.core import QgsMessageLog, Qgis
+            QgsMessageLog.logMessage(message, "geo_webview", Qgis.Warning if warning else Qgis.Info)
+        except Exception:
+            pass
+
+
+class OverviewBuildTask(QgsTask):
+    """QgsTask building external overviews for ``rows`` one layer at a time."""
+
+    def __init__(self, rows, resampling, manager):
+        super().__init__('geo_webview: build raster overviews', QgsTask.CanCancel)
+        self.rows = rows
+        self.resampling = resampling
+        self.manager = manager
+        self.results = []
+        self._feedback = None
+
+    def cancel(self):
+        feedback = self._feedback
+        if feedback is not None:
+            feedback.cancel()
+        super().cancel()
+
+    def run(self):
+        from qgis.core import QgsRasterBlockFeedback, QgsRasterLayer
+
+        total = len(self.rows)
+        for n, row in enumerate(self.rows):
+            if self.isCanceled():
+                break
+            started = time.monotonic()
+            self.manager._set_progress(layer=row['name'], done=n, percent=100.0 * n / total)
+            result = {'layer_id': row['layer_id'], 'name': row['name'], 'ok': False, 'error': ''}
+            try:
+                # private layer: the provider of the served layer is never used here
+                layer = QgsRasterLayer(row['path'], row['name'], 'gdal')
+                provider = layer.dataProvider() if layer.isValid() else None
+                if provider is None:
+                    raise RuntimeError('cannot open raster')
+                pyramids = provider.buildPyramidList([])
+                for pyramid in pyramids:
+                    _mark_build(pyramid)
+
+                feedback = QgsRasterBlockFeedback()
+                feedback.progressChanged.connect(
+                    lambda p, n=n: self.setProgress(100.0 * (n + float(p) / 100.0) / total))
+                self._feedback = feedback
+                error = provider.buildPyramids(pyramids, self.resampling, _pyramid_format(), [], feedback)
+                self._feedback = None
+                if feedback.isCanceled() or self.isCanceled():
+                    result['error'] = 'cancelled'
+                elif error:
+                    result['error'] = str(error)
+                else:
+                    result['ok'] = True
+            except Exception as e:
+                result['error'] = str(e)
+            result['seconds'] = round(time.monotonic() - started, 1)
+            self.results.append(result)
+            self.setProgress(100.0 * (n + 1) / total)
+        self.manager._set_progress(layer=None, done=sum(1 for r in self.results if r['ok']),
+                                   percent=self.progress())
+        return not self.isCanceled()
+
+    def finished(self, result):
+        self.manager._finished(self, self.results)
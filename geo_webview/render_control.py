@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""Render job waiting and cancellation on client disconnect.
+
+Map renders run on worker threads and wait for their
+``QgsMapRendererParallelJob`` in a local event loop. While waiting, the
+loop polls the active *cancel check*: when every client interested in the
+result has closed its connection (the HTTP front end marks a connection
+``peer_closed`` as soon as it reads EOF on it), the job is cancelled and
+the worker is freed instead of finishing an image nobody will receive.
+
+The cancel check is installed per thread with :func:`cancel_scope` so
+render code deep in the WMS pipeline does not need an extra argument.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from . import render_slots
+
+
+def _env_flag(name, default):
+    v = os.environ.get(name)
+    if v in (None, ''):
+        return default
+    return str(v).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _env_int(name, default):
+    try:
+        v = os.environ.get(name)
+        return int(v) if v not in (None, '') else default
+    except Exception:
+        return default
+
+
+# Cancel renders whose clients have all disconnected
+CANCEL_ON_DISCONNECT = _env_flag('QMAP_CANCEL_ON_DISCONNECT', True)
+# WMTS/XYZ tiles: keep rendering into the tile cache even when the client is gone
+WMTS_FINISH_ON_DISCONNECT = _env_flag('QMAP_WMTS_FINISH_ON_DISCONNECT', False)
+# how often a waiting render checks for disconnects (milliseconds)
+CANCEL_POLL_MS = max(10, _env_int('QMAP_CANCEL_POLL_MS', 100))
+
+
+class CancelScope:
+    """Cancel check installed for the renders of the current thread.
+
+    ``cancelled`` is set once a render in the scope has been cancelled so
+    callers can skip sending or caching a partial result.
+    """
+
+    __slots__ = ('check', 'cancelled')
+
+    def __init__(self, check):
+        self.check = check
+        self.cancelled = False
+
+    def should_cancel(self):
+        if self.check is None or not CANCEL_ON_DISCONNECT:
+            return False
+        try:
+            return bool(self.check())
+        except Exception:
+            return False
+
+    def __enter__(self):
+        stack = getattr(_local, 'scopes', None)
+        if stack is None:
+            stack = _local.scopes = []
+        stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.scopes.pop()
+        return False
+
+
+_local = threading.local()
+
+
+def cancel_scope(check):
+    """Context manager installing ``check()`` (True = give up) for this thread."""
+    return CancelScope(check)
+
+
+def current_scope():
+    """Innermost active :class:`CancelScope` of this thread, or None."""
+    stack = getattr(_local, 'scopes', None)
+    return stack[-1] if stack else None
+
+
+def disconnect_watch(conn):
+    """Return ``watch()`` telling whether the client of ``conn`` went away.
+
+    None when ``conn`` cannot report it (e.g. an internal capture buffer).
+    """
+    if conn is None or not hasattr(conn, 'peer_closed'):
+        return None
+    return lambda: bool(conn.peer_closed or getattr(conn, 'closed', False))
+
+
+# ----------------------------------------------------------------------
+# statistics
+# ----------------------------------------------------------------------
+_stats_lock = threading.Lock()
+_stats = {'completed': 0, 'completed_s': 0.0, 'cancelled': 0, 'cancelled_s': 0.0,
+          'saved_s': 0.0, 'timeouts': 0}
+
+
+def _record(kind, elapsed):
+    with _stats_lock:
+        if kind == 'completed':
+            _stats['completed'] += 1
+            _stats['completed_s'] += elapsed
+        elif kind == 'cancelled':
+            _stats['cancelled'] += 1
+            _stats['cancelled_s'] += elapsed
+            # remaining time of an average completed render
+            if _stats['completed']:
+                mean = _stats['completed_s'] / _stats['completed']
+                _stats['saved_s'] += max(0.0, mean - elapsed)
+        elif kind == 'timeout':
+            _stats['timeouts'] += 1
+
+
+_stages = {}  # name -> [count, total_s, max_s]
+
+
+def record_stage(name, elapsed):
+    """Record the duration of a render-pipeline stage (e.g. settings construction)."""
+    with _stats_lock:
+        entry = _stages.get(name)
+        if entry is None:
+            entry = _stages[name] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += elapsed
+        if elapsed > entry[2]:
+            entry[2] = elapsed
+
+
+def stage_stats():
+    """Per-stage count and mean/max milliseconds (``render`` is the job itself)."""
+    with _stats_lock:
+        items = [(name, list(entry)) for name, entry in _stages.items()]
+    return {
+        name: {
+            'count': count,
+            'mean_ms': round(total * 1000.0 / count, 3) if count else 0.0,
+            'max_ms': round(peak * 1000.0, 3),
+        }
+        for name, (count, total, peak) in sorted(items)
+    }
+
+
+def stats():
+    """Completed/cancelled render counts and the estimated render seconds saved."""
+    with _stats_lock:
+        s = dict(_stats)
+    return {
+        'enabled': CANCEL_ON_DISCONNECT,
+        'wmts_finish_on_disconnect': WMTS_FINISH_ON_DISCONNECT,
+        'completed': s['completed'],
+        'cancelled': s['cancelled'],
+        'timeouts': s['timeouts'],
+        'mean_render_s': round(s['completed_s'] / s['completed'], 3) if s['completed'] else 0.0,
+        'cancelled_after_s': round(s['cancelled_s'], 3),
+        'est_seconds_saved': round(s['saved_s'], 3),
+    }
+
+
+# ----------------------------------------------------------------------
+# waiting for a render job
+# ----------------------------------------------------------------------
+def wait_for_job(job, timeout_s):
+    """Start ``job`` and wait for it, honouring the thread's cancel scope.
+
+    The job first takes its slots from the process-wide render budget
+    (:mod:`render_slots`); the queue wait is recorded as the
+    ``render_queue`` stage and does not count against ``timeout_s``.
+
+    Returns:
+        str: 'finished', 'cancelled' (all clients disconnected) or 'timeout'
+    """
+    scope = current_scope()
+    should_cancel = None
+    if scope is not None and scope.check is not None and CANCEL_ON_DISCONNECT:
+        should_cancel = scope.should_cancel
+    outcome, waited, slots = render_slots.scheduler().acquire(
+        render_slots.job_cost(job), render_slots.current_priority(), should_cancel)
+    record_stage('render_queue', waited)
+    if outcome == 'cancelled':
+        scope.cancelled = True
+        _record('cancelled', waited)
+        return 'cancelled'
+    if outcome != 'granted':
+        _record('timeout', waited)
+        return 'timeout'
+    try:
+        return _run_job(job, timeout_s, scope)
+    finally:
+        render_slots.scheduler().release(slots)
+
+
+class _StyleLock:
+    """Reader/writer lock guarding the styles of the live project layers.
+
+    Starting a job with layer style overrides applies the override QML to
+    the live layers while the layer renderers are created (they copy what
+    they need) and restores it afterwards, so such a start is the writer.
+    Every other job start and every read of a live layer's style
+    (``exportNamedStyle``) is a reader: readers run together, but never
+    while an override is applied. A waiting writer blocks new readers so
+    a steady stream of renders cannot starve it.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def reading(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+_style_lock = _StyleLock()
+
+
+def live_style_read():
+    """Context manager to hold while reading a live layer's style.
+
+    Without it an export can run while an override job is starting and
+    return the override QML (e.g. request LABELS) instead of the layer's own.
+    """
+    return _style_lock.reading()
+
+
+def _has_style_overrides(job):
+    try:
+        return bool(job.mapSettings().layerStyleOverrides())
+    except Exception:
+        return False
+
+
+def _run_job(job, timeout_s, scope):
+    from qgis.PyQt.QtCore import QEventLoop, QTimer
+
+    loop = QEventLoop()
+    job.finished.connect(loop.quit)
+    started = time.monotonic()
+    # only the start is guarded; the layer renderers then run in parallel
+    with (_style_lock.writing() if _has_style_overrides(job) else _style_lock.reading()):
+        job.start()
+
+    timer = QTimer()
+    timer.timeout.connect(loop.quit)
+    timer.setSingleShot(True)
+    try:
+        timer.start(int(float(timeout_s) * 1000))
+    except Exception:
+        timer.start(30000)
+
+    outcome = {'cancelled': False}
+    poll = None
+    if scope is not None and scope.check is not None and CANCEL_ON_DISCONNECT:
+        def _poll():
+            if job.isActive() and scope.should_cancel():
+                outcome['cancelled'] = True
+                loop.quit()
+        poll = QTimer()
+        poll.timeout.connect(_poll)
+        poll.start(CANCEL_POLL_MS)
+
+    # the job may already be done (tiny renders) before the loop starts
+    if job.isActive():
+        # Qt5 had exec_(), Qt6 uses exec(). Support both.
+        if hasattr(loop, 'exec_'):
+            loop.exec_()
+        else:
+            loop.exec()
+
+    if poll is not None:
+        poll.stop()
+    timer.stop()
+    elapsed = time.monotonic() - started
+
+    if job.isActive():
+        job.cancel()
+        if outcome['cancelled']:
+            scope.cancelled = True
+            _record('cancelled', elapsed)
+            return 'cancelled'
+        _record('timeout', elapsed)
+        return 'timeout'
+    _record('completed', elapsed)
+    record_stage('render', elapsed)
+    return 'finished'
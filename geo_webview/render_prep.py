@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""Per-request render preparation: layer pre-filtering and zoom-band simplification.
+
+Runs on the private ``QgsMapSettings`` of a request once its extent,
+output size and CRS are final, just before the render job is created:
+
+* the effective scale (``QgsMapSettings.scale()``) is computed once;
+* layers outside their scale-based visibility range, and layers whose
+  extent does not reach the (buffered) visible extent, are removed, so
+  the job neither prepares renderers for them nor takes render slots
+  for them;
+* the request gets the simplification of the zoom band the scale falls
+  in as the simplify method of its map settings
+  (``QgsMapSettings.setSimplifyMethod``), which becomes the vector
+  simplify method of the render context of every line and polygon
+  layer. The job-wide method replaces the layers' own settings, so it
+  is only applied when it simplifies more than every kept line/polygon
+  layer already does; otherwise the request keeps the layer settings.
+  Nothing on the project layers changes and no style override is
+  involved, so these jobs start like any other. Local optimization is
+  off, so providers that can simplify (PostGIS, GeoPackage, ...) do it
+  before sending features.
+
+Bands come from ``QMAP_SIMPLIFY_BANDS``: comma-separated
+``min_scale:tolerance_px:algorithm`` entries (algorithm ``distance``,
+``snaptogrid`` or ``visvalingam``), matched from the largest
+``min_scale`` down. Scales below every band keep the layer's own
+settings. ``QMAP_SIMPLIFY_BANDS=off`` disables the band simplification,
+``QMAP_RENDER_PREP=0`` the whole stage.
+"""
+import os
+import threading
+import time
+
+from . import render_control
+
+
+def _env_flag(name, default):
+    v = os.environ.get(name)
+    if v in (None, ''):
+        return default
+    return str(v).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _env_float(name, default):
+    try:
+        v = os.environ.get(name)
+        return float(v) if v not in (None, '') else default
+    except Exception:
+        return default
+
+
+# algorithm name -> QgsVectorSimplifyMethod.SimplifyAlgorithm value
+ALGORITHMS = {'distance': 0, 'snaptogrid': 1, 'visvalingam': 2}
+_ALGORITHM_ENUMS = {'distance': 'Distance', 'snaptogrid': 'SnapToGrid', 'visvalingam': 'Visvalingam'}
+
+# ~z8 and below: coarse; ~z9-z12: snap to grid; z13+: layer settings
+DEFAULT_BANDS = '2000000:2:distance,100000:1:snaptogrid'
+
+
+def parse_bands(spec):
+    """``[(min_scale, tolerance_px, algorithm), ...]`` sorted from the coarsest band."""
+    bands = []
+    if not spec or str(spec).strip().lower() in ('0', 'off', 'none', 'false'):
+        return bands
+    for item in str(spec).split(','):
+        parts = [p.strip() for p in item.split(':')]
+        if len(parts) != 3:
+            continue
+        try:
+            min_scale, tol = float(parts[0]), float(parts[1])
+        except ValueError:
+            continue
+        algorithm = parts[2].lower()
+        if algorithm in ALGORITHMS and min_scale > 0 and tol > 0:
+            bands.append((min_scale, tol, algorithm))
+    return sorted(bands, reverse=True)
+
+
+ENABLED = _env_flag('QMAP_RENDER_PREP', True)
+BANDS = parse_bands(os.environ.get('QMAP_SIMPLIFY_BANDS', DEFAULT_BANDS))
+# pixels added around the visible extent before testing layer extents
+# (symbols and labels of features just outside can reach into the image)
+EXTENT_BUFFER_PX = max(0.0, _env_float('QMAP_PREP_EXTENT_BUFFER_PX', 64.0))
+
+
+def band_for_scale(scale, bands=None):
+    """Band ``(min_scale, tolerance_px, algorithm)`` covering ``scale``, or None."""
+    for band in (BANDS if bands is None else bands):
+        if scale >= band[0]:
+            return band
+    return None
+
+
+_stats_lock = threading.Lock()
+_stats = {'prepared': 0, 'layers_in': 0, 'dropped_scale': 0, 'dropped_extent': 0,
+          'simplified': 0, 'band_skipped': 0}
+_band_hits = {}
+
+
+def stats():
+    with _stats_lock:
+        s = dict(_stats)
+        s['bands'] = dict(_band_hits)
+    s['enabled'] = ENABLED
+    s['band_config'] = [f'{int(m)}:{t:g}:{a}' for m, t, a in BANDS]
+    return s
+
+
+def _int(value):
+    """int() of a QGIS enum/flag value (sip enums, QFlags and Python enums)."""
+    return int(getattr(value, 'value', value))
+
+
+def _in_scale_range(layer, scale):
+    try:
+        return not layer.hasScaleBasedVisibility() or layer.isInScaleRange(scale)
+    except Exception:
+        return True
+
+
+def _reaches_extent(map_settings, layer, visible):
+    try:
+        extent = layer.extent()
+        if extent.isNull() or extent.isEmpty():
+            return True  # unknown (or a single point); let the renderer decide
+        return map_settings.layerExtentToOutputExtent(layer, extent).intersects(visible)
+    except Exception:
+        return True
+
+
+def _simplifiable(layer):
+    from qgis.core import QgsVectorLayer
+    if not isinstance(layer, QgsVectorLayer):
+        return False
+    try:
+        if layer.isEditable():
+            return False  # QGIS never simplifies layers with an edit buffer
+        # 0 = point geometry
+        return _int(layer.geometryType()) in (1, 2)
+    except Exception:
+        return False
+
+
+def _coarser_than_layer(layer, tolerance, algorithm):
+    """False when the layer's own settings already simplify at least as much."""
+    try:
+        method = layer.simplifyMethod()
+        return not (_int(method.simplifyHints()) & 1
+                    and float(method.threshold()) >= tolerance
+                    and _int(method.simplifyAlgorithm()) == ALGORITHMS[algorithm]
+                    and not method.forceLocalOptimization())
+    except Exception:
+        return True
+
+
+def simplify_method(tolerance, algorithm):
+    """``QgsVectorSimplifyMethod`` of a band (geometry simplification, provider-side)."""
+    from qgis.core import QgsVectorSimplifyMethod
+
+    method = QgsVectorSimplifyMethod()
+    method.setSimplifyHints(QgsVectorSimplifyMethod.GeometrySimplification)
+    method.setSimplifyAlgorithm(getattr(QgsVectorSimplifyMethod, _ALGORITHM_ENUMS[algorithm]))
+    method.setThreshold(float(tolerance))
+    method.setForceLocalOptimization(False)
+    method.setMaximumScale(1)
+    return method
+
+
+def prepare(map_settings):
+    """Filter the layers of ``map_settings`` and apply the band simplification.
+
+    Returns:
+        dict: scale, band, kept/dropped layer counts and the number of
+        line/polygon layers simplified by the band (0 when the band was
+        skipped because a layer's own settings are already coarser)
+    """
+    info = {'scale': None, 'band': None, 'layers': 0, 'dropped_scale': 0,
+            'dropped_extent': 0, 'simplified': 0, 'band_skipped': False}
+    if not ENABLED or map_settings is None:
+        return info
+    started = time.perf_counter()
+    try:
+        layers = list(map_settings.layers())
+        scale = float(map_settings.scale())
+        info['scale'] = scale
+        visible = map_settings.visibleExtent()
+        buffer = EXTENT_BUFFER_PX * float(map_settings.mapUnitsPerPixel())
+        if buffer > 0:
+            visible = visible.buffered(buffer)
+
+        kept = []
+        for layer in layers:
+            if not _in_scale_range(layer, scale):
+                info['dropped_scale'] += 1
+            elif not _reaches_extent(map_settings, layer, visible):
+                info['dropped_extent'] += 1
+            else:
+                kept.append(layer)
+        if len(kept) != len(layers):
+            map_settings.setLayers(kept)
+        info['layers'] = len(kept)
+
+        band = band_for_scale(scale)
+        if band is not None:
+            _, tolerance, algorithm = band
+            info['band'] = f'{int(band[0])}:{tolerance:g}:{algorithm}'
+            targets = [layer for layer in kept if _simplifiable(layer)]
+            # setSimplifyMethod applies to the whole job: a layer that already
+            # simplifies more must not be made finer, so all or nothing
+            if targets and all(_coarser_than_layer(layer, tolerance, algorithm) for layer in targets):
+                map_settings.setSimplifyMethod(simplify_method(tolerance, algorithm))
+                info['simplified'] = len(targets)
+            elif targets:
+                info['band_skipped'] = True
+    except Exception as e:
+        try:
+            from qgis.core import QgsMessageLog, Qgis
+            QgsMessageLog.logMessage(f"⚠️ Render preparation failed: {e}", "geo_webview", Qgis.Warning)
+        except Exception:
+            pass
+    render_control.record_stage('render_prep', time.perf_counter() - started)
+
+    with _stats_lock:
+        _stats['prepared'] += 1
+        _stats['layers_in'] += info['layers'] + info['dropped_scale'] + info['dropped_extent']
+        _stats['dropped_scale'] += info['dropped_scale']
+        _stats['dropped_extent'] += info['dropped_extent']
+        _stats['simplified'] += info['simplified']
+        if info['band_skipped']:
+            _stats['band_skipped'] += 1
+        band_name = info['band'] or 'layer-settings'
+        _band_hits[band_name] = _band_hits.get(band_name, 0) + 1
+    return info
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""Process-wide render slot budget shared by WMS, WMTS/XYZ and prewarm.
+
+Every map render (``render_control.wait_for_job``) takes slots from one
+budget before starting its job and returns them when the job is done.
+A ``QgsMapRendererParallelJob`` renders its layers concurrently on Qt's
+global thread pool, so a job costs one slot per layer it can run at
+once: ``min(layers, QThreadPool.globalInstance().maxThreadCount())``,
+capped to the whole budget. The budget is ``QMAP_MAX_RENDER_WORKERS``
+(default: CPU count - 1).
+
+Renders waiting for slots are served in arrival order, except that
+background renders (prewarm, entered with :func:`background`) only start
+while no foreground render is queued. A render waiting for slots gives up
+when its clients disconnect (the thread's cancel scope) or after
+``QMAP_RENDER_QUEUE_TIMEOUT_S``.
+"""
+import os
+import threading
+import time
+
+
+def _env_int(name, default):
+    try:
+        v = os.environ.get(name)
+        return int(v) if v not in (None, '') else default
+    except Exception:
+        return default
+
+
+def default_budget():
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+# seconds a render may wait for slots before giving up
+QUEUE_TIMEOUT_S = max(1, _env_int('QMAP_RENDER_QUEUE_TIMEOUT_S', 30))
+
+FOREGROUND = 'foreground'
+BACKGROUND = 'background'
+
+_local = threading.local()
+
+
+class background:
+    """Context manager marking the renders of this thread as background work."""
+
+    def __enter__(self):
+        self._previous = getattr(_local, 'priority', None)
+        _local.priority = BACKGROUND
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.priority = self._previous
+        return False
+
+
+def current_priority():
+    return getattr(_local, 'priority', None) or FOREGROUND
+
+
+class RenderScheduler:
+    """Weighted semaphore over render threads with foreground priority."""
+
+    def __init__(self, budget):
+        self.budget = max(1, int(budget))
+        self._cond = threading.Condition()
+        self._in_use = 0
+        self._active = 0
+        self._queue = []  # tickets in arrival order: [priority, cost]
+        self._peak_in_use = 0
+        self._peak_queued = 0
+        self._granted = 0
+        self._timeouts = 0
+        self._abandoned = 0
+        self._wait_s = 0.0
+        self._max_wait_s = 0.0
+
+    def configure(self, budget):
+        with self._cond:
+            self.budget = max(1, int(budget))
+            self._cond.notify_all()
+
+    def _can_start(self, ticket):
+        priority, cost = ticket
+        if self._in_use + min(cost, self.budget) > self.budget:
+            return False
+        if priority == BACKGROUND:
+            # any queued foreground render, then earlier background renders
+            if any(other[0] == FOREGROUND for other in self._queue):
+                return False
+        for other in self._queue:
+            if other is ticket:
+                return True
+            if other[0] == priority:
+                return False
+        return True
+
+    def acquire(self, cost, priority=FOREGROUND, should_cancel=None, timeout_s=None):
+        """Wait for ``cost`` slots.
+
+        Returns:
+            tuple: (outcome, waited_s, slots) with outcome 'granted',
+            'cancelled' or 'timeout'; pass ``slots`` to :meth:`release`
+        """
+        cost = max(1, min(int(cost), self.budget))
+        timeout_s = QUEUE_TIMEOUT_S if timeout_s is None else timeout_s
+        poll_s = 0.1 if should_cancel is not None else None
+        started = time.monotonic()
+        ticket = [priority, cost]
+        with self._cond:
+            self._queue.append(ticket)
+            self._peak_queued = max(self._peak_queued, len(self._queue))
+            try:
+                while not self._can_start(ticket):
+                    remaining = timeout_s - (time.monotonic() - started)
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        return 'timeout', time.monotonic() - started, 0
+                    if should_cancel is not None and should_cancel():
+                        self._abandoned += 1
+                        return 'cancelled', time.monotonic() - started, 0
+                    self._cond.wait(remaining if poll_s is None else min(poll_s, remaining))
+                ticket[1] = cost = min(cost, self.budget)
+                self._in_use += cost
+                self._active += 1
+                self._peak_in_use = max(self._peak_in_use, self._in_use)
+                waited = time.monotonic() - started
+                self._granted += 1
+                self._wait_s += waited
+                self._max_wait_s = max(self._max_wait_s, waited)
+                return 'granted', waited, cost
+            finally:
+                self._queue.remove(ticket)
+                # the head of the queue may have changed
+                self._cond.notify_all()
+
+    def release(self, slots):
+        with self._cond:
+            self._in_use = max(0, self._in_use - slots)
+            self._active = max(0, self._active - 1)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            queued_fg = sum(1 for t in self._queue if t[0] == FOREGROUND)
+            return {
+                'budget': self.budget,
+                'slots_in_use': self._in_use,
+                'active_renders': self._active,
+                'queued': len(self._queue),
+                'queued_foreground': queued_fg,
+                'queued_background': len(self._queue) - queued_fg,
+                'peak_slots_in_use': self._peak_in_use,
+                'peak_queued': self._peak_queued,
+                'granted': self._granted,
+                'queue_timeouts': self._timeouts,
+                'abandoned': self._abandoned,
+                'mean_wait_ms': round(self._wait_s * 1000.0 / self._granted, 3) if self._granted else 0.0,
+                'max_wait_ms': round(self._max_wait_s * 1000.0, 3),
+                'queue_timeout_s': QUEUE_TIMEOUT_S,
+            }
+
+
+_scheduler = RenderScheduler(_env_int('QMAP_MAX_RENDER_WORKERS', default_budget()))
+
+
+def scheduler():
+    return _scheduler
+
+
+def configure(budget):
+    """Set the render slot budget (``max_render_workers``)."""
+    _scheduler.configure(budget)
+
+
+def job_cost(job):
+    """Threads a ``QgsMapRendererParallelJob`` can occupy at once."""
+    try:
+        layers = len(job.mapSettings().layers())
+    except Exception:
+        layers = 1
+    try:
+        from qgis.PyQt.QtCore import QThreadPool
+        pool = int(QThreadPool.globalInstance().maxThreadCount())
+    except Exception:
+        pool = layers
+    return max(1, min(max(1, layers), max(1, pool)))
+
+
+def stats():
+    return _scheduler.stats()
@@ -9,6 +9,12 @@ import os
 import re
 import concurrent.futures
 from qgis.core import QgsProject, QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsPointXY, QgsMessageLog, Qgis
+from . import encode_pool
+from . import image_formats
+from . import render_control
+from . import render_prep
+from . import render_slots
+from . import single_flight
 # lazy import http_server inside methods to avoid circular import during QGIS plugin init
 
 class GeoWebViewServerManager:
@@ -121,6 +127,20 @@ class GeoWebViewServerManager:
         except Exception:
             # 初期化が失敗してもサーバは動作を続けられるように None を許容
             self.wfs_service = None
+
+        # オーバービュー（ピラミッド）未作成の大きなラスタの検出と作成
+        self.raster_overviews = None
+        try:
+            from .raster_overviews import RasterOverviewManager
+            self.raster_overviews = RasterOverviewManager()
+            project = QgsProject.instance()
+            for sname in ('readProject', 'layersAdded', 'layersRemoved', 'cleared'):
+                sig = getattr(project, sname, None)
+                if sig and hasattr(sig, 'connect'):
+                    sig.connect(self.raster_overviews.refresh)
+            self.raster_overviews.refresh()
+        except Exception:
+            pass
         
         # HTTPサーバー関連の状態
         self.http_server = None
@@ -128,8 +148,34 @@ class GeoWebViewServerManager:
         self.server_port = 8089  # デフォルトポート
         self.preferred_port = 8089  # ユーザー指定の優先ポート
         self._http_running = False
+        self._frontend = None
+        self._router = None
         self._last_request_text = ""
+        # 静的ファイルキャッシュ {path: (mtime_ns, size, http_server.PrecompressedBody)}
+        self._static_cache = {}
         
+        # HTTP/1.1 Keep-Alive 設定（環境変数 QMAP_KEEPALIVE_TIMEOUT_S / QMAP_KEEPALIVE_MAX_REQUESTS）
+        from . import http_server
+        self.keepalive_timeout_s = http_server.KEEPALIVE_TIMEOUT_S
+        self.keepalive_max_requests = http_server.KEEPALIVE_MAX_REQUESTS
+        # 受付キューと負荷制御（QMAP_LISTEN_BACKLOG / QMAP_ADMIT_* / QMAP_RETRY_AFTER_S）
+        self.listen_backlog = http_server.LISTEN_BACKLOG
+        self.admission_limits = dict(http_server.ADMISSION_LIMITS)
+        self.admission_max_wait_s = http_server.ADMISSION_MAX_WAIT_S
+        self.retry_after_s = http_server.RETRY_AFTER_S
+
+        # 接続・リクエスト統計（/server-stats で参照可能）
+        self._stats_lock = threading.Lock()
+        self._server_stats = {
+            'connections_accepted': 0,
+            'requests_total': 0,
+            'requests_reused': 0,
+            'max_requests_reached': 0,
+            'file_responses': 0,
+            'requests_shed': 0,
+            'write_timeouts': 0,
+        }
+
         # HTTP並列処理用スレッドプール（PCのCPU性能に応じて自動調整）
         optimal_workers = self._calculate_optimal_workers()
         self._http_executor = concurrent.futures.ThreadPoolExecutor(
@@ -153,6 +199,50 @@ class GeoWebViewServerManager:
         except Exception:
             return int(default)
 
+    def _bump_stat(self, key, amount=1):
+        """サーバー統計カウンタを加算（スレッドセーフ）"""
+        try:
+            with self._stats_lock:
+                self._server_stats[key] = self._server_stats.get(key, 0) + amount
+        except Exception:
+            pass
+
+    def get_server_stats(self):
+        """接続再利用などのサーバー統計を辞書で返す"""
+        with self._stats_lock:
+            stats = dict(self._server_stats)
+        accepted = stats.get('connections_accepted', 0)
+        stats['requests_per_connection'] = round(stats.get('requests_total', 0) / accepted, 2) if accepted else 0.0
+        frontend = self._frontend
+        stats['connections_open'] = frontend.open_connections() if frontend is not None else 0
+        stats['requests_in_flight'] = frontend.requests_in_flight() if frontend is not None else 0
+        stats['keepalive_timeout_s'] = self.keepalive_timeout_s
+        stats['keepalive_max_requests'] = self.keepalive_max_requests
+        stats['listen_backlog'] = self.listen_backlog
+        stats['admission'] = frontend.admission_stats() if frontend is not None else {}
+        stats['routes'] = self._router.route_stats() if self._router is not None else {}
+        stats['coalescing'] = single_flight.stats()
+        stats['render_cancel'] = render_control.stats()
+        stats['render_stages'] = render_control.stage_stats()
+        stats['encode'] = encode_pool.stats()
+        stats['render_slots'] = render_slots.stats()
+        stats['render_prep'] = render_prep.stats()
+        if self.wms_service is not None:
+            stats['getmap_cache'] = self.wms_service.getmap_cache.stats()
+            stats['settings_templates'] = self.wms_service.settings_templates.stats()
+            stats['theme_cache'] = self.wms_service.theme_cache.stats()
+            stats['style_cache'] = self.wms_service.style_cache.stats()
+            stats['featureinfo_index'] = self.wms_service.feature_index.stats()
+            stats['legend_cache'] = self.wms_service.legend_cache.stats()
+        if self.raster_overviews is not None:
+            stats['raster_overviews'] = self.raster_overviews.stats()
+        try:
+            from . import http_server
+            stats['compression'] = http_server.compression_stats()
+        except Exception:
+            pass
+        return stats
+
     def _get_plugin_version(self):
         """metadata.txtからプラグインバージョンを取得"""
         try:
@@ -211,8 +301,27 @@ class GeoWebViewServerManager:
             server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             # bind to all interfaces so non-localhost access is possible
             server_socket.bind(('0.0.0.0', self.server_port))
-            server_socket.listen(5)
-            server_socket.settimeout(1.0)
+            # タイル一括取得時の接続バーストでバックログが溢れないよう余裕を持たせる
+            server_socket.listen(self.listen_backlog)
+
+            # accept/読み取り/書き込みはイベントループが非ブロッキングで担当し、
+            # ハンドラ（レンダリング等）のみをスレッドプールへ投入する
+            # ルーティングテーブル（ハンドラ参照は起動時に一度だけ解決）
+            self._router = self._build_router()
+
+            from .http_frontend import HTTPFrontend
+            self._frontend = HTTPFrontend(
+                server_socket,
+                self._handle_request_safe,
+                self._http_executor,
+                keepalive_timeout=self.keepalive_timeout_s,
+                max_requests=self.keepalive_max_requests,
+                on_stat=self._bump_stat,
+                classify=self._classify_request,
+                admission_limits=self.admission_limits,
+                max_queue_wait=self.admission_max_wait_s,
+                retry_after=self.retry_after_s,
+            )
 
             self.http_server = server_socket
             self._http_running = True
@@ -231,6 +340,7 @@ class GeoWebViewServerManager:
                 f"WMS HTTPサーバーが起動しました (ポート: {self.server_port})",
                 duration=3
             )
+            self._log_missing_overviews()
 
         except Exception as e:
             from qgis.core import QgsMessageLog, Qgis
@@ -248,44 +358,65 @@ class GeoWebViewServerManager:
                     pass
                 self.http_server = None
     
-    def run_server(self):
-        """サーバーを安全に実行（並列処理版）"""
+    def _log_missing_overviews(self):
+        """オーバービューの無い大きなラスタレイヤと想定される高速化倍率をログに出す"""
+        if self.raster_overviews is None:
+            return
         try:
-            while self._http_running and self.http_server:
-                try:
-                    conn, addr = self.http_server.accept()
-                except socket.timeout:
-                    continue
-                except OSError:
-                    break
+            rows = [r for r in self.raster_overviews.missing() if r['candidate']]
+            if not rows:
+                return
+            names = ', '.join(f"{r['name']} ({r['width']}x{r['height']}, ~{r['est_speedup']:g}x)" for r in rows)
+            QgsMessageLog.logMessage(
+                f"🗻 オーバービュー未作成のラスタ: {names} — 低ズームのタイル描画が遅くなります"
+                f"（プラグインメニュー「Build raster overviews」でバックグラウンド作成できます）",
+                "geo_webview", Qgis.Warning)
+        except Exception:
+            pass
 
-                # リクエストをスレッドプールで並列処理（ブラウザの6タイル同時取得に対応）
-                try:
-                    # スレッドプールが有効かチェック
-                    if hasattr(self, '_http_executor') and self._http_executor and not getattr(self._http_executor, '_shutdown', False):
-                        self._http_executor.submit(self._handle_client_connection_safe, conn, addr)
-                    else:
-                        # スレッドプールが使えない場合は接続を閉じる
-                        try:
-                            conn.close()
-                        except Exception:
-                            pass
-                except Exception as e:
-                    from qgis.core import QgsMessageLog, Qgis
-                    QgsMessageLog.logMessage(f"HTTPリクエストのスレッド投入に失敗: {e}", "geo_webview", Qgis.Critical)
-                    try:
-                        conn.close()
-                    except Exception:
-                        pass
+    def build_raster_overviews(self):
+        """オーバービュー未作成のラスタに対するバックグラウンド作成を開始（メインスレッド）"""
+        if self.raster_overviews is None:
+            return
+        if self.raster_overviews.is_running():
+            self.iface.messageBar().pushMessage(
+                "QMap Permalink", "ラスタのオーバービューを作成中です", duration=3)
+            return
+        rows = self.raster_overviews.start_build()
+        if rows:
+            self.iface.messageBar().pushMessage(
+                "QMap Permalink",
+                f"{len(rows)} レイヤのオーバービューをバックグラウンドで作成します（タスクマネージャで進捗表示・キャンセル可）",
+                duration=5)
+        else:
+            self.iface.messageBar().pushMessage(
+                "QMap Permalink", "オーバービューが必要なラスタレイヤはありません", duration=3)
+
+    def release_raster_overviews(self):
+        """プラグインのアンロード時: 作成中のタスクをキャンセルしシグナルを切断"""
+        manager, self.raster_overviews = self.raster_overviews, None
+        if manager is None:
+            return
+        manager.cancel()
+        project = QgsProject.instance()
+        for sname in ('readProject', 'layersAdded', 'layersRemoved', 'cleared'):
+            try:
+                getattr(project, sname).disconnect(manager.refresh)
+            except Exception:
+                continue
 
+    def run_server(self):
+        """イベントループを実行（停止要求までブロック）"""
+        try:
+            if self._frontend is not None:
+                self._frontend.serve_forever()
+        except Exception as e:
+            from qgis.core import QgsMessageLog, Qgis
+            QgsMessageLog.logMessage(f"HTTPイベントループでエラー: {e}", "geo_webview", Qgis.Critical)
         finally:
             self._http_running = False
-            if self.http_server:
-                try:
-                    self.http_server.close()
-                except Exception:
-                    pass
-                self.http_server = None
+            self._frontend = None
+            self.http_server = None
             from qgis.core import QgsMessageLog, Qgis
             QgsMessageLog.logMessage("HTTPサーバーが停止しました", "geo_webview", Qgis.Info)
     
@@ -294,8 +425,14 @@ class GeoWebViewServerManager:
         try:
             self._http_running = False
 
-            # ソケットを先に閉じてacceptループを終了
-            if self.http_server:
+            # イベントループに停止を要求（リスニングソケットと全接続はループ側で閉じる）
+            frontend = self._frontend
+            if frontend is not None:
+                try:
+                    frontend.stop()
+                except Exception:
+                    pass
+            elif self.http_server:
                 try:
                     self.http_server.close()
                 except Exception:
@@ -325,6 +462,11 @@ class GeoWebViewServerManager:
                     max_workers=optimal_workers,
                     thread_name_prefix='HTTP-Handler'
                 )
+            # エンコードプールも停止（次回のエンコードで再作成される）
+            try:
+                encode_pool.shutdown()
+            except Exception:
+                pass
 
             from qgis.core import QgsMessageLog, Qgis
             QgsMessageLog.logMessage("QMap Permalink HTTPサーバーが停止しました", "geo_webview", Qgis.Info)
@@ -333,582 +475,598 @@ class GeoWebViewServerManager:
             from qgis.core import QgsMessageLog, Qgis
             QgsMessageLog.logMessage(f"HTTPサーバーの停止中にエラーが発生しました: {e}", "geo_webview", Qgis.Critical)
 
-    def _handle_client_connection_safe(self, conn, addr):
-        """HTTPリクエストを安全に処理（エラーハンドリング付き）"""
+    def _handle_request_safe(self, conn, request):
+        """フロントエンドが解析済みのHTTPリクエスト（http_server.HTTPRequest）を安全に処理
+
+        エラーハンドリング付き、ワーカースレッドで実行。
+        """
         try:
-            self._handle_client_connection(conn, addr)
+            self._handle_http_request(conn, request)
         except Exception as e:
             from qgis.core import QgsMessageLog, Qgis
             QgsMessageLog.logMessage(f"HTTPリクエスト処理中にエラー: {e}", "geo_webview", Qgis.Warning)
-        finally:
             try:
                 conn.close()
             except Exception:
                 pass
-    
-    def _handle_client_connection(self, conn, addr):
-        """HTTPリクエストを解析してWMSリクエストを処理"""
-        # 初期タイムアウト設定（リクエスト読み取り用）
-        conn.settimeout(10.0)
-        
-        with conn:
-            from . import http_server
-            request_bytes = http_server.read_http_request(conn)
-            if not request_bytes:
-                return
 
-            request_text = request_bytes.decode('iso-8859-1', errors='replace')
-            self._last_request_text = request_text
+    def _build_router(self):
+        """ルーティングテーブルを構築（サーバー起動時に一度だけ）
 
+        完全一致は dict、タイルパスはコンパイル済み正規表現、その他は
+        プレフィックス表で解決する。サービスのハンドラ参照もここで確定し、
+        リクエスト毎の遅延 import や存在チェックを行わない。
+        """
+        from .http_router import Router, Route
+        router = Router(on_error=self._on_route_error)
+
+        wms_handler = self.wms_service.handle_wms_request if self.wms_service else self._service_unavailable('WMS')
+        wmts_service = self._resolve_wmts_service()
+        wmts_handler = wmts_service.handle_wmts_request if wmts_service else self._service_unavailable('WMTS')
+        wfs_service = self._resolve_wfs_service()
+        wfs_handler = wfs_service.handle_wfs_request if wfs_service else self._service_unavailable('WFS')
+
+        wms = Route('wms', wms_handler, self._ows_admission, 'WMS processing')
+        wmts = Route('wmts', wmts_handler, self._ows_admission, 'WMTS processing')
+        wmts_tile = Route('wmts-tile', wmts_handler, 'render', 'WMTS processing')
+        wfs = Route('wfs', wfs_handler, 'feature', 'WFS processing')
+
+        router.add_exact('/wms', wms)
+        router.add_exact('/qgis-map', Route('qgis-map', self._route_permalink_page, 'static', 'OpenLayers HTML page generation'))
+        router.add_exact(('/maplibre-style', '/maplibre/style'), Route('maplibre-style', self._handle_maplibre_style, 'static', 'maplibre-style'))
+        router.add_exact('/maplibre', Route('maplibre', self._handle_maplibre_page, 'static', 'MapLibre HTML page generation'))
+        router.add_exact('/wmts', wmts)
+        router.add_exact('/wfs-layers', Route('wfs-layers', self._route_wfs_layers, 'static', 'wfs-layers'))
+        router.add_exact('/wfs', wfs)
+        router.add_exact('/server-stats', Route('server-stats', self._handle_server_stats, 'static', 'server-stats'))
+        router.add_exact('/debug-bookmarks', Route('debug-bookmarks', self._route_debug_bookmarks, 'static', 'debug-bookmarks'))
+        router.add_exact(self.STATIC_FILES, Route('static', self._handle_static_file, 'static', 'static file'))
+
+        # タイル: /wmts/{z}/{x}/{y}.png, /xyz/{z}/{x}/{y}.png,
+        # /wmts/{Style}/{TileMatrixSet}/{TileMatrix}/{TileRow}/{TileCol}.{fmt},
+        # /xyz/{z}/{x}/{y}（拡張子なし: Accept ヘッダで形式を選択）
+        router.add_pattern(r'^/(?:wmts|xyz)/\d+/\d+/\d+\.(?:png|png8|jpg|jpeg|webp)$', wmts_tile)
+        router.add_pattern(r'^/wmts/[^/]+/[^/]+/\d+/\d+/\d+\.(?:png|png8|jpg|jpeg|webp)$', wmts_tile)
+        router.add_pattern(r'^/xyz/\d+/\d+/\d+$', wmts_tile)
+        router.add_prefix('/wmts', wmts)
+        router.add_prefix('/xyz', wmts)
+        router.add_prefix('/wfs', wfs)
+        router.set_fallback(Route('fallback', lambda conn, request: self._handle_unrouted(conn, request, wfs_handler), 'static', 'request'))
+
+        from . import http_server
+        if http_server.SLOW_REQUEST_MS > 0:
+            router.add_timing_hook(self._log_slow_request)
+        return router
+
+    def _log_slow_request(self, route_name, elapsed, request):
+        """ルートのタイミングフック: QMAP_SLOW_REQUEST_MS を超えたリクエストをログ出力"""
+        from . import http_server
+        elapsed_ms = elapsed * 1000.0
+        if elapsed_ms >= http_server.SLOW_REQUEST_MS:
             from qgis.core import QgsMessageLog, Qgis
+            QgsMessageLog.logMessage(
+                f"🐢 Slow request [{route_name}] {elapsed_ms:.0f}ms: {request.target[:200]}",
+                "geo_webview", Qgis.Info
+            )
+
+    def _resolve_wmts_service(self):
+        if getattr(self, 'wmts_service', None) is None:
             try:
-                request_line = request_text.splitlines()[0]
-            except IndexError:
-                from . import http_server
-                http_server.send_http_response(conn, 400, "Bad Request", "Invalid HTTP request line.")
-                return
+                from .wmts_service import GeoWebViewWMTSService
+                self.wmts_service = GeoWebViewWMTSService(self)
+            except Exception:
+                import traceback
+                from qgis.core import QgsMessageLog, Qgis
+                QgsMessageLog.logMessage(
+                    f"Lazy WMTS service creation failed: {traceback.format_exc()}",
+                    "geo_webview",
+                    Qgis.Warning
+                )
+                self.wmts_service = None
+        return self.wmts_service
 
-            parts = request_line.split()
-            if len(parts) < 3:
-                from . import http_server
-                http_server.send_http_response(conn, 400, "Bad Request", "Malformed HTTP request line.")
-                return
+    def _resolve_wfs_service(self):
+        if getattr(self, 'wfs_service', None) is None:
+            try:
+                from .wfs_service import GeoWebViewWFSService
+                self.wfs_service = GeoWebViewWFSService(self.iface, self.server_port)
+            except Exception:
+                self.wfs_service = None
+        return self.wfs_service
 
-            method, target, _ = parts
+    def _service_unavailable(self, name):
+        def handler(conn, request):
+            from . import http_server
+            http_server.send_http_response(conn, 501, 'Not Implemented', f'{name} service not available')
+        return handler
 
-            if method.upper() != 'GET':
-                from . import http_server
-                http_server.send_http_response(conn, 405, "Method Not Allowed", "Only GET is supported.")
-                return
+    def _on_route_error(self, route, conn, request, exc):
+        from qgis.core import QgsMessageLog, Qgis
+        import traceback
+        QgsMessageLog.logMessage(f"❌ {route.label} error ({request.path}): {exc}", "geo_webview", Qgis.Critical)
+        QgsMessageLog.logMessage(f"❌ Error traceback: {traceback.format_exc()}", "geo_webview", Qgis.Critical)
+        from . import http_server
+        http_server.send_http_response(conn, 500, "Internal Server Error", f"{route.label} failed: {str(exc)}")
 
-            parsed_url = urllib.parse.urlparse(target)
-            params = urllib.parse.parse_qs(parsed_url.query)
-            # Manually unquote parameter values to handle UTF-8 encoding issues
-            for key in params:
-                params[key] = [urllib.parse.unquote_plus(val) for val in params[key]]
-            # Extract Host header for use in generated URLs (used for OnlineResource)
-            host = None
-            for line in request_text.splitlines():
-                if line.lower().startswith('host:'):
-                    host = line.split(':', 1)[1].strip()
-                    break
+    @staticmethod
+    def _ows_admission(request):
+        """/wms・/wmts の受付クラス
 
-            # ブラウザで読み込まれるページURL（/qgis-map）を受け取ったときだけ
-            # パネルのナビゲート欄に表示するためにemitする。
-            try:
-                if parsed_url.path in ('/qgis-map', '/maplibre'):
-                    server_port = None
-                    try:
-                        server_port = self.http_server.getsockname()[1] if self.http_server else self.server_port
-                    except Exception:
-                        server_port = self.server_port
+        GetCapabilities は static、GetFeatureInfo・GetLegendGraphic は feature
+        （地図描画を伴わないため render の枠を消費させない）、それ以外
+        （GetMap・GetMapBatch・GetTile・パーマリンク画像）は render。
+        """
+        req = ''
+        for key, values in request.params.items():
+            if key.upper() == 'REQUEST':
+                req = (values[0] if values else '').upper()
+                break
+        if req == 'GETCAPABILITIES' or (not req and request.path != '/wms'):
+            return 'static'
+        if req in ('GETFEATUREINFO', 'GETLEGENDGRAPHIC'):
+            return 'feature'
+        return 'render'
+
+    def _classify_request(self, request):
+        """受付制御用のリクエスト分類（'render' / 'feature' / 'static'）
+
+        イベントループ上で呼ばれるため、ルーティングテーブルの解決だけで判定する。
+        """
+        router = self._router
+        if router is None:
+            return 'static'
+        return router.admission_class(request)
+
+    def _handle_http_request(self, conn, request):
+        """解析済みHTTPリクエスト（http_server.HTTPRequest）をルーティングテーブルで振り分け"""
+        from . import http_server
+        self._last_request_text = request.head_text
+
+        if request.method not in ('GET', 'HEAD'):
+            http_server.send_http_response(conn, 405, "Method Not Allowed", "Only GET and HEAD are supported.")
+            return
 
-                    if not host:
-                        host = f'localhost:{server_port}'
+        try:
+            conn.keep_alive = request.keep_alive_requested and conn.remaining_requests() > 0
+        except Exception:
+            pass
 
-                    # target が absolute URI の場合はそのまま使う
-                    if target.startswith('http://') or target.startswith('https://'):
-                        full_url = target
-                    else:
-                        full_url = f'http://{host}{target}'
+        router = self._router
+        if router is None:
+            router = self._router = self._build_router()
+        router.dispatch(conn, request)
 
-                    # Emit the full URL for UI if signal available
-                    if hasattr(self, 'navigation_signals') and self.navigation_signals:
-                        try:
-                            if hasattr(self.navigation_signals, 'request_origin_changed'):
-                                self.navigation_signals.request_origin_changed.emit(full_url)
-                        except Exception:
-                            pass
+    def _emit_request_origin(self, request):
+        """ブラウザで読み込まれるページURL（/qgis-map, /maplibre）をパネルのナビゲート欄に表示するためにemitする。"""
+        try:
+            host = request.host
+            target = request.target
+            if not host:
+                try:
+                    server_port = self.http_server.getsockname()[1] if self.http_server else self.server_port
+                except Exception:
+                    server_port = self.server_port
+                host = f'localhost:{server_port}'
 
-                    # main_plugin にも保持（パネル未作成時のフォールバック）
-                    try:
-                        if hasattr(self, 'main_plugin'):
-                            setattr(self.main_plugin, '_last_request_origin', full_url)
-                    except Exception:
-                        pass
+            # target が absolute URI の場合はそのまま使う
+            if target.startswith('http://') or target.startswith('https://'):
+                full_url = target
+            else:
+                full_url = f'http://{host}{target}'
+
+            # Emit the full URL for UI if signal available
+            if hasattr(self, 'navigation_signals') and self.navigation_signals:
+                try:
+                    if hasattr(self.navigation_signals, 'request_origin_changed'):
+                        self.navigation_signals.request_origin_changed.emit(full_url)
+                except Exception:
+                    pass
+
+            # main_plugin にも保持（パネル未作成時のフォールバック）
+            try:
+                if hasattr(self, 'main_plugin'):
+                    setattr(self.main_plugin, '_last_request_origin', full_url)
             except Exception:
                 pass
+        except Exception:
+            pass
+
+    def _route_permalink_page(self, conn, request):
+        """OpenLayersパーマリンクページ（/qgis-map、内部で/wmsを参照）"""
+        self._emit_request_origin(request)
+        self._handle_permalink_html_page(conn, request.params)
 
-            # WMSエンドポイントの処理（直接PNG画像返却）
-            if parsed_url.path == '/wms':
+    def _route_wfs_layers(self, conn, request):
+        """公開可能な WFS ベクターレイヤ一覧（/wfs-layers）"""
+        self._handle_wfs_layers(conn, request.params)
+
+    def _route_debug_bookmarks(self, conn, request):
+        if hasattr(self, '_handle_debug_bookmarks') and callable(getattr(self, '_handle_debug_bookmarks')):
+            self._handle_debug_bookmarks(conn)
+        else:
+            # Handler not implemented in this instance
+            from . import http_server
+            http_server.send_http_response(conn, 501, 'Not Implemented', 'debug-bookmarks handler not available')
+
+    def _handle_server_stats(self, conn, request):
+        """サーバー統計（接続再利用率など）を JSON で返す"""
+        from . import http_server
+        payload = json.dumps(self.get_server_stats(), ensure_ascii=False, indent=2)
+        http_server.send_http_response(conn, 200, 'OK', payload, 'application/json; charset=utf-8')
+
+    def _handle_unrouted(self, conn, request, wfs_handler):
+        """ルート未登録パス: SERVICE=WFS なら WFS へ、それ以外は 404"""
+        params = request.params
+        if 'SERVICE' in params and params.get('SERVICE', [''])[0].upper() == 'WFS':
+            wfs_handler(conn, request)
+            return
+        from qgis.core import QgsMessageLog, Qgis
+        QgsMessageLog.logMessage(f"❌ Unknown endpoint: {request.path}", "geo_webview", Qgis.Warning)
+        from . import http_server
+        # 明示的に利用可能なエンドポイント一覧に /wmts と /wfs を含める
+        http_server.send_http_response(
+            conn,
+            404,
+            "Not Found",
+            "Available endpoints: /wms (PNG image), /qgis-map (OpenLayers HTML), /maplibre (MapLibre HTML), /wmts (WMTS tiles), /wfs (WFS service)"
+        )
+
+    def _handle_maplibre_style(self, conn, request):
+        """Mapbox/MapLibre スタイル JSON（/maplibre-style）を返す"""
+        params = request.params
+        host = request.host
+        try:
+            # Determine typename (support several param names)
+            wfs_typename = None
+            for k in ('typename', 'typenames', 'TYPENAME', 'TYPENAMES', 'layer', 'layers', 'type', 'typeName'):
+                if k in params and params.get(k):
+                    wfs_typename = params.get(k)[0]
+                    break
+            
+            # If no typename specified, return a base WMTS-only style (no WFS layers)
+            if not wfs_typename:
+                # Use the same IDs as the full style path to keep UI toggles consistent
+                # 動的ホスト名を使用（外部アクセス対応）
+                base_url = f"http://{host}" if host else f"http://localhost:{self.server_port}"
+                wmts_tile_url = f"{base_url}/wmts/{{z}}/{{x}}/{{y}}.png"
+                wmts_base_style = {
+                    "version": 8,
+                    "sources": {
+                        "qmap": {
+                            "type": "raster",
+                            "tiles": [wmts_tile_url],
+                            "tileSize": 256
+                        }
+                    },
+                    "layers": [
+                        {
+                            "id": "qmap",
+                            "type": "raster",
+                            "source": "qmap",
+                            "minzoom": 0,
+                            "maxzoom": 22,
+                            "layout": {"visibility": "visible"}
+                        }
+                    ]
+                }
+                payload = json.dumps(wmts_base_style, ensure_ascii=False)
+                from . import http_server
+                http_server.send_http_response(conn, 200, 'OK', payload, 'application/json; charset=utf-8')
+                return
+
+            # Ensure WFS service exists
+            if not hasattr(self, 'wfs_service') or self.wfs_service is None:
+                from . import http_server
+                http_server.send_http_response(conn, 501, 'Not Implemented', 'WFS service not available', 'text/plain; charset=utf-8')
+                return
+
+            # Find layer and try several matching strategies
+            layer = None
+            try:
+                layer = self.wfs_service._find_layer_by_name(wfs_typename)
+            except Exception:
+                layer = None
+
+            if layer is None:
+                # Strict policy: typename must be the exact QGIS layer.id()
                 try:
-                    self.wms_service.handle_wms_request(conn, params, host)
-                except Exception as e:
-                    QgsMessageLog.logMessage(f"❌ WMS handler error: {e}", "geo_webview", Qgis.Critical)
-                    import traceback
-                    QgsMessageLog.logMessage(f"❌ Error traceback: {traceback.format_exc()}", "geo_webview", Qgis.Critical)
-                    from . import http_server
-                    http_server.send_http_response(conn, 500, "Internal Server Error", f"WMS processing failed: {str(e)}")
+                    cands = self.wfs_service._get_vector_layers()
+                except Exception:
+                    cands = []
+                cand_ids = []
+                for c in cands:
+                    try:
+                        cand_ids.append(c.id())
+                    except Exception:
+                        continue
+                body = {
+                    'error': f"Layer '{wfs_typename}' not found",
+                    'available_typenames': cand_ids
+                }
+                payload = json.dumps(body, ensure_ascii=False, indent=2)
+                from . import http_server
+                http_server.send_http_response(conn, 404, 'Not Found', payload, 'application/json; charset=utf-8')
                 return
-            
-            # OpenLayersパーマリンクエンドポイントの処理（HTMLページ生成、内部で/wmsを参照）
-            if parsed_url.path == '/qgis-map':
+
+            # Convert QGIS layer style directly to Mapbox layers using QGIS API
+            try:
+                from .maplibre.qmap_maplibre_wfs import qgis_layer_to_maplibre_style
+                # create safe source id based on the QGIS layer id (canonical)
                 try:
-                    self._handle_permalink_html_page(conn, params)
-                except Exception as e:
-                    QgsMessageLog.logMessage(f"❌ OpenLayers HTML page error: {e}", "geo_webview", Qgis.Critical)
-                    import traceback
-                    QgsMessageLog.logMessage(f"❌ Error traceback: {traceback.format_exc()}", "geo_webview", Qgis.Critical)
-                    from . import http_server
-                    http_server.send_http_response(conn, 500, "Internal Server Error", f"OpenLayers HTML page generation failed: {str(e)}")
+                    raw_id = layer.id()
+                except Exception:
+                    raw_id = str(wfs_typename)
+                # Use the QGIS layer's raw id as the canonical typename and
+                # as the MapLibre source id. Do NOT prefix with 'wfs_'.
+                # We intentionally keep the raw layer.id() (including
+                # hyphens or leading underscores) to preserve one-to-one
+                # correspondence with QGIS objects.
+                _wfs_source_id = str(raw_id)
+                mapbox_layers = qgis_layer_to_maplibre_style(raw_id, _wfs_source_id)
+                try:
+                    from qgis.core import QgsMessageLog, Qgis
+                    QgsMessageLog.logMessage(f'🎨 Converted to {len(mapbox_layers)} Mapbox layers: {[ml.get("id") for ml in mapbox_layers if isinstance(ml, dict)]}', 'QMapPermalink', Qgis.Info)
+                except Exception:
+                    pass
+            except Exception as e:
+                from . import http_server
+                http_server.send_http_response(conn, 500, 'Internal Server Error', f'Failed to convert layer style: {e}', 'text/plain; charset=utf-8')
                 return
 
-            # Dynamic MapLibre style endpoint: return a Mapbox style JSON for a given WFS typename
-            if parsed_url.path in ('/maplibre-style', '/maplibre/style'):
+            # Build MapLibre style JSON with WMTS base and WFS vector layers
+            # Build style dict
+            # Use complete URL for tile template (MapLibre requires absolute URLs)
+            # 動的ホスト名を使用（外部アクセス対応）
+            base_url = f"http://{host}" if host else f"http://localhost:{self.server_port}"
+            tile_template = f'{base_url}/wmts/{{z}}/{{x}}/{{y}}.png'
+            
+            # Ensure all mapbox_layers have explicit visibility set to 'visible'
+            # so that client-side controls can toggle them properly
+            try:
+                for ml in mapbox_layers:
+                    if isinstance(ml, dict):
+                        if 'layout' not in ml:
+                            ml['layout'] = {}
+                        if 'visibility' not in ml.get('layout', {}):
+                            ml['layout']['visibility'] = 'visible'
+            except Exception:
+                pass
+            
+            style_dict = {
+                'version': 8,
+                # use canonical QGIS layer id for the style name (must match typename)
+                'name': str(raw_id) if layer is not None else str(wfs_typename),
+                'glyphs': 'https://demotiles.maplibre.org/font/{fontstack}/{range}.pbf',
+                'sources': {
+                    'qmap': {
+                        'type': 'raster',
+                        'tiles': [tile_template],
+                        'tileSize': 256,
+                        'attribution': 'QMapPermalink WMTS'
+                    },
+                    _wfs_source_id: {
+                        'type': 'geojson',
+                        'data': f"{base_url}/wfs?SERVICE=WFS&REQUEST=GetFeature&TYPENAMES={urllib.parse.quote(str(raw_id))}&OUTPUTFORMAT=application/json&MAXFEATURES=1000"
+                    }
+                },
+                'layers': [
+                    {'id': 'qmap', 'type': 'raster', 'source': 'qmap', 'minzoom': 0, 'layout': {'visibility': 'visible'}}
+                ] + mapbox_layers
+            }
+            payload = json.dumps(style_dict, ensure_ascii=False, indent=2)
+            from . import http_server
+            http_server.send_http_response(conn, 200, 'OK', payload, 'application/json; charset=utf-8', cacheable=True)
+            return
+        except Exception as e:
+            from . import http_server
+            http_server.send_http_response(conn, 500, 'Internal Server Error', f'Error in maplibre-style handler: {e}', 'text/plain; charset=utf-8')
+
+    def _handle_maplibre_page(self, conn, request):
+        """MapLibre パーマリンク HTML ページ（/maplibre）を生成して返す"""
+        from qgis.core import QgsMessageLog, Qgis
+        params = request.params
+        self._emit_request_origin(request)
+        try:
+            # Accept multiple parameter formats:
+            # 1. lat/lon/zoom (WGS84 coordinates)
+            # 2. x/y/scale/crs/rotation (arbitrary CRS with rotation support)
+            # 3. permalink (full URL string)
+            lat = params.get('lat', [None])[0]
+            lon = params.get('lon', [None])[0]
+            zoom = params.get('zoom', [None])[0]
+            x = params.get('x', [None])[0]
+            y = params.get('y', [None])[0]
+            scale = params.get('scale', [None])[0]
+            crs = params.get('crs', [None])[0]
+            rotation = params.get('rotation', [None])[0]
+            permalink = params.get('permalink', [None])[0]
+
+            html_content = None
+
+            # Prefer QGIS-aware generator when running inside QGIS
+            try:
+                # Attempt to use the plugin's maplibre_generator which uses
+                # QGIS transformation APIs to handle arbitrary CRSs.
+                from . import maplibre_generator
+                import webbrowser
+                import os
+
+                # /maplibre-style is handled at top-level routing to avoid nested path checks
+                # Prevent maplibre_generator.open_maplibre_from_permalink from
+                # actually opening the browser: monkey-patch webbrowser.open.
+                _orig_web_open = webbrowser.open
                 try:
-                    # Determine typename (support several param names)
+                    webbrowser.open = lambda *a, **k: None
+                    # call generator which writes a temp HTML file and
+                    # returns its path
+                    temp_path = None
+                    # Determine optional WFS typename from outer params (prefer explicit param)
                     wfs_typename = None
-                    for k in ('typename', 'typenames', 'TYPENAME', 'TYPENAMES', 'layer', 'layers', 'type', 'typeName'):
-                        if k in params and params.get(k):
-                            wfs_typename = params.get(k)[0]
-                            break
-                    
-                    # If no typename specified, return a base WMTS-only style (no WFS layers)
-                    if not wfs_typename:
-                        # Use the same IDs as the full style path to keep UI toggles consistent
-                        # 動的ホスト名を使用（外部アクセス対応）
-                        base_url = f"http://{host}" if host else f"http://localhost:{self.server_port}"
-                        wmts_tile_url = f"{base_url}/wmts/{{z}}/{{x}}/{{y}}.png"
-                        wmts_base_style = {
-                            "version": 8,
-                            "sources": {
-                                "qmap": {
-                                    "type": "raster",
-                                    "tiles": [wmts_tile_url],
-                                    "tileSize": 256
-                                }
-                            },
-                            "layers": [
-                                {
-                                    "id": "qmap",
-                                    "type": "raster",
-                                    "source": "qmap",
-                                    "minzoom": 0,
-                                    "maxzoom": 22,
-                                    "layout": {"visibility": "visible"}
-                                }
-                            ]
-                        }
-                        payload = json.dumps(wmts_base_style, ensure_ascii=False)
-                        from . import http_server
-                        http_server.send_http_response(conn, 200, 'OK', payload, 'application/json; charset=utf-8')
-                        return
-
-                    # Ensure WFS service exists
-                    if not hasattr(self, 'wfs_service') or self.wfs_service is None:
-                        from . import http_server
-                        http_server.send_http_response(conn, 501, 'Not Implemented', 'WFS service not available', 'text/plain; charset=utf-8')
-                        return
-
-                    # Find layer and try several matching strategies
-                    layer = None
                     try:
-                        layer = self.wfs_service._find_layer_by_name(wfs_typename)
+                        for k in ('typename', 'typenames', 'TYPENAME', 'TYPENAMES', 'layer', 'layers', 'type', 'typeName'):
+                            if k in params and params.get(k):
+                                wfs_typename = params.get(k)[0]
+                                break
                     except Exception:
-                        layer = None
+                        wfs_typename = None
 
-                    if layer is None:
-                        # Strict policy: typename must be the exact QGIS layer.id()
+                    # If typename not provided by request, try to auto-select
+                    # from the project's /wfs-layers list (prefer layers with
+                    # a finite bbox). This uses the same project-configured
+                    # WFSLayers as the /wfs-layers endpoint.
+                    if not wfs_typename:
                         try:
-                            cands = self.wfs_service._get_vector_layers()
+                            layers_list = self._collect_wfs_layers()
+                            if layers_list:
+                                import math
+                                chosen = None
+                                for L in layers_list:
+                                    bbox = L.get('bbox', {}) or {}
+                                    try:
+                                        minx = float(bbox.get('minx'))
+                                        if math.isfinite(minx):
+                                            chosen = L
+                                            break
+                                    except Exception:
+                                        continue
+                                if not chosen:
+                                    chosen = layers_list[0]
+                                # Use the canonical typename (QGIS layer.id()) when
+                                # auto-selecting a layer. The /wfs-layers entries
+                                # expose both 'name' (UI-normalized) and 'typename'
+                                # (canonical). Prefer 'typename' to avoid generating
+                                # permalinks that reference human-friendly names.
+                                wfs_typename = chosen.get('typename') or chosen.get('id') or chosen.get('name')
+                                try:
+                                    from qgis.core import QgsMessageLog, Qgis
+                                except Exception:
+                                    pass
                         except Exception:
-                            cands = []
-                        cand_ids = []
-                        for c in cands:
-                            try:
-                                cand_ids.append(c.id())
-                            except Exception:
-                                continue
-                        body = {
-                            'error': f"Layer '{wfs_typename}' not found",
-                            'available_typenames': cand_ids
-                        }
-                        payload = json.dumps(body, ensure_ascii=False, indent=2)
-                        from . import http_server
-                        http_server.send_http_response(conn, 404, 'Not Found', payload, 'application/json; charset=utf-8')
-                        return
+                            # ignore and leave wfs_typename as None
+                            pass
 
-                    # Convert QGIS layer style directly to Mapbox layers using QGIS API
+                    # Try calling generator with provided permalink (if any) and pass typename
                     try:
-                        from .maplibre.qmap_maplibre_wfs import qgis_layer_to_maplibre_style
-                        # create safe source id based on the QGIS layer id (canonical)
+                        if permalink:
+                            temp_path = maplibre_generator.open_maplibre_from_permalink(permalink, wfs_typename)
+                        elif x is not None and y is not None:
+                            # Build synthetic permalink from x/y/scale/crs/rotation parameters
+                            # Use x/y directly (not center_x/center_y) as maplibre_generator expects
+                            p = f"http://localhost/?x={x}&y={y}"
+                            if crs is not None:
+                                p += f"&crs={crs}"
+                            if scale is not None:
+                                p += f"&scale={scale}"
+                            if rotation is not None:
+                                p += f"&rotation={rotation}"
+                            temp_path = maplibre_generator.open_maplibre_from_permalink(p, wfs_typename)
+                        elif lat is not None and lon is not None:
+                            # Build synthetic permalink from lat/lon/zoom parameters
+                            p = f"http://localhost/?lat={lat}&lon={lon}"
+                            if zoom is not None:
+                                p += f"&zoom={zoom}"
+                            temp_path = maplibre_generator.open_maplibre_from_permalink(p, wfs_typename)
+                        else:
+                            # Fallback: attempt to generate with empty permalink but pass typename
+                            temp_path = maplibre_generator.open_maplibre_from_permalink('', wfs_typename)
+                    except Exception as e:
+                        # If generator failed (e.g. couldn't parse permalink), attempt a safe fallback
                         try:
-                            raw_id = layer.id()
+                            QgsMessageLog.logMessage(f"⚠️ MapLibre generator failed: {e} - retrying with empty permalink", "geo_webview", Qgis.Warning)
                         except Exception:
-                            raw_id = str(wfs_typename)
-                        # Use the QGIS layer's raw id as the canonical typename and
-                        # as the MapLibre source id. Do NOT prefix with 'wfs_'.
-                        # We intentionally keep the raw layer.id() (including
-                        # hyphens or leading underscores) to preserve one-to-one
-                        # correspondence with QGIS objects.
-                        _wfs_source_id = str(raw_id)
-                        mapbox_layers = qgis_layer_to_maplibre_style(raw_id, _wfs_source_id)
+                            pass
                         try:
-                            from qgis.core import QgsMessageLog, Qgis
-                            QgsMessageLog.logMessage(f'🎨 Converted to {len(mapbox_layers)} Mapbox layers: {[ml.get("id") for ml in mapbox_layers if isinstance(ml, dict)]}', 'QMapPermalink', Qgis.Info)
+                            temp_path = maplibre_generator.open_maplibre_from_permalink('', None)
                         except Exception:
-                            pass
-                    except Exception as e:
-                        from . import http_server
-                        http_server.send_http_response(conn, 500, 'Internal Server Error', f'Failed to convert layer style: {e}', 'text/plain; charset=utf-8')
-                        return
-
-                    # Build MapLibre style JSON with WMTS base and WFS vector layers
-                    # Build style dict
-                    # Use complete URL for tile template (MapLibre requires absolute URLs)
-                    # 動的ホスト名を使用（外部アクセス対応）
-                    base_url = f"http://{host}" if host else f"http://localhost:{self.server_port}"
-                    tile_template = f'{base_url}/wmts/{{z}}/{{x}}/{{y}}.png'
-                    
-                    # Ensure all mapbox_layers have explicit visibility set to 'visible'
-                    # so that client-side controls can toggle them properly
+                            # re-raise original to be handled by outer exception handler
+                            raise
+
+                    # Read the generated HTML file and send it
+                    if temp_path and os.path.exists(temp_path):
+                        with open(temp_path, 'r', encoding='utf-8') as f:
+                            html_content = f.read()
+                finally:
+                    # restore original webbrowser.open regardless of outcome
                     try:
-                        for ml in mapbox_layers:
-                            if isinstance(ml, dict):
-                                if 'layout' not in ml:
-                                    ml['layout'] = {}
-                                if 'visibility' not in ml.get('layout', {}):
-                                    ml['layout']['visibility'] = 'visible'
+                        webbrowser.open = _orig_web_open
                     except Exception:
                         pass
-                    
-                    style_dict = {
-                        'version': 8,
-                        # use canonical QGIS layer id for the style name (must match typename)
-                        'name': str(raw_id) if layer is not None else str(wfs_typename),
-                        'glyphs': 'https://demotiles.maplibre.org/font/{fontstack}/{range}.pbf',
-                        'sources': {
-                            'qmap': {
-                                'type': 'raster',
-                                'tiles': [tile_template],
-                                'tileSize': 256,
-                                'attribution': 'QMapPermalink WMTS'
-                            },
-                            _wfs_source_id: {
-                                'type': 'geojson',
-                                'data': f"{base_url}/wfs?SERVICE=WFS&REQUEST=GetFeature&TYPENAMES={urllib.parse.quote(str(raw_id))}&OUTPUTFORMAT=application/json&MAXFEATURES=1000"
-                            }
-                        },
-                        'layers': [
-                            {'id': 'qmap', 'type': 'raster', 'source': 'qmap', 'minzoom': 0, 'layout': {'visibility': 'visible'}}
-                        ] + mapbox_layers
-                    }
-                    payload = json.dumps(style_dict, ensure_ascii=False, indent=2)
-                    from . import http_server
-                    http_server.send_http_response(conn, 200, 'OK', payload, 'application/json; charset=utf-8')
-                    return
-                except Exception as e:
-                    from . import http_server
-                    http_server.send_http_response(conn, 500, 'Internal Server Error', f'Error in maplibre-style handler: {e}', 'text/plain; charset=utf-8')
-                    return
-
-            # MapLibre パーマリンクエンドポイントの処理（HTMLページ生成）
-            if parsed_url.path == '/maplibre':
-                try:
-                    # Accept multiple parameter formats:
-                    # 1. lat/lon/zoom (WGS84 coordinates)
-                    # 2. x/y/scale/crs/rotation (arbitrary CRS with rotation support)
-                    # 3. permalink (full URL string)
-                    lat = params.get('lat', [None])[0]
-                    lon = params.get('lon', [None])[0]
-                    zoom = params.get('zoom', [None])[0]
-                    x = params.get('x', [None])[0]
-                    y = params.get('y', [None])[0]
-                    scale = params.get('scale', [None])[0]
-                    crs = params.get('crs', [None])[0]
-                    rotation = params.get('rotation', [None])[0]
-                    permalink = params.get('permalink', [None])[0]
-
-                    html_content = None
-
-                    # Prefer QGIS-aware generator when running inside QGIS
-                    try:
-                        # Attempt to use the plugin's maplibre_generator which uses
-                        # QGIS transformation APIs to handle arbitrary CRSs.
-                        from . import maplibre_generator
-                        import webbrowser
-                        import os
-
-                        # /maplibre-style is handled at top-level routing to avoid nested path checks
-                        # Prevent maplibre_generator.open_maplibre_from_permalink from
-                        # actually opening the browser: monkey-patch webbrowser.open.
-                        _orig_web_open = webbrowser.open
-                        try:
-                            webbrowser.open = lambda *a, **k: None
-                            # call generator which writes a temp HTML file and
-                            # returns its path
-                            temp_path = None
-                            # Determine optional WFS typename from outer params (prefer explicit param)
-                            wfs_typename = None
-                            try:
-                                for k in ('typename', 'typenames', 'TYPENAME', 'TYPENAMES', 'layer', 'layers', 'type', 'typeName'):
-                                    if k in params and params.get(k):
-                                        wfs_typename = params.get(k)[0]
-                                        break
-                            except Exception:
-                                wfs_typename = None
+            except Exception:
+                # Any failure here falls back to lightweight generator
+                html_content = None
+
+            if not html_content:
+                # We assume PyQGIS is available in this simplified unified
+                # setup. If the QGIS-aware generator failed for any
+                # reason, return an error page rather than falling back
+                # to the standalone/lightweight generator which we are
+                # removing to keep the codebase PyQGIS-centric.
+                from . import http_server
+                error_html = self._generate_error_html_page(
+                    "MapLibre HTML generation failed (QGIS-dependent generator failed)."
+                )
+                http_server.send_http_response(conn, 500, "Internal Server Error", error_html, "text/html; charset=utf-8")
+                return
 
-                            # If typename not provided by request, try to auto-select
-                            # from the project's /wfs-layers list (prefer layers with
-                            # a finite bbox). This uses the same project-configured
-                            # WFSLayers as the /wfs-layers endpoint.
-                            if not wfs_typename:
-                                try:
-                                    layers_list = self._collect_wfs_layers()
-                                    if layers_list:
-                                        import math
-                                        chosen = None
-                                        for L in layers_list:
-                                            bbox = L.get('bbox', {}) or {}
-                                            try:
-                                                minx = float(bbox.get('minx'))
-                                                if math.isfinite(minx):
-                                                    chosen = L
-                                                    break
-                                            except Exception:
-                                                continue
-                                        if not chosen:
-                                            chosen = layers_list[0]
-                                        # Use the canonical typename (QGIS layer.id()) when
-                                        # auto-selecting a layer. The /wfs-layers entries
-                                        # expose both 'name' (UI-normalized) and 'typename'
-                                        # (canonical). Prefer 'typename' to avoid generating
-                                        # permalinks that reference human-friendly names.
-                                        wfs_typename = chosen.get('typename') or chosen.get('id') or chosen.get('name')
-                                        try:
-                                            from qgis.core import QgsMessageLog, Qgis
-                                        except Exception:
-                                            pass
-                                except Exception:
-                                    # ignore and leave wfs_typename as None
-                                    pass
+            from . import http_server
+            http_server.send_http_response(conn, 200, "OK", html_content, "text/html; charset=utf-8")
+        except Exception as e:
+            QgsMessageLog.logMessage(f"❌ MapLibre HTML page error: {e}", "geo_webview", Qgis.Critical)
+            import traceback
+            QgsMessageLog.logMessage(f"❌ Error traceback: {traceback.format_exc()}", "geo_webview", Qgis.Critical)
+            from . import http_server
+            http_server.send_http_response(conn, 500, "Internal Server Error", f"MapLibre HTML page generation failed: {str(e)}")
 
-                            # Try calling generator with provided permalink (if any) and pass typename
-                            try:
-                                if permalink:
-                                    temp_path = maplibre_generator.open_maplibre_from_permalink(permalink, wfs_typename)
-                                elif x is not None and y is not None:
-                                    # Build synthetic permalink from x/y/scale/crs/rotation parameters
-                                    # Use x/y directly (not center_x/center_y) as maplibre_generator expects
-                                    p = f"http://localhost/?x={x}&y={y}"
-                                    if crs is not None:
-                                        p += f"&crs={crs}"
-                                    if scale is not None:
-                                        p += f"&scale={scale}"
-                                    if rotation is not None:
-                                        p += f"&rotation={rotation}"
-                                    temp_path = maplibre_generator.open_maplibre_from_permalink(p, wfs_typename)
-                                elif lat is not None and lon is not None:
-                                    # Build synthetic permalink from lat/lon/zoom parameters
-                                    p = f"http://localhost/?lat={lat}&lon={lon}"
-                                    if zoom is not None:
-                                        p += f"&zoom={zoom}"
-                                    temp_path = maplibre_generator.open_maplibre_from_permalink(p, wfs_typename)
-                                else:
-                                    # Fallback: attempt to generate with empty permalink but pass typename
-                                    temp_path = maplibre_generator.open_maplibre_from_permalink('', wfs_typename)
-                            except Exception as e:
-                                # If generator failed (e.g. couldn't parse permalink), attempt a safe fallback
-                                try:
-                                    QgsMessageLog.logMessage(f"⚠️ MapLibre generator failed: {e} - retrying with empty permalink", "geo_webview", Qgis.Warning)
-                                except Exception:
-                                    pass
-                                try:
-                                    temp_path = maplibre_generator.open_maplibre_from_permalink('', None)
-                                except Exception:
-                                    # re-raise original to be handled by outer exception handler
-                                    raise
-
-                            # Read the generated HTML file and send it
-                            if temp_path and os.path.exists(temp_path):
-                                with open(temp_path, 'r', encoding='utf-8') as f:
-                                    html_content = f.read()
-                        finally:
-                            # restore original webbrowser.open regardless of outcome
-                            try:
-                                webbrowser.open = _orig_web_open
-                            except Exception:
-                                pass
-                    except Exception:
-                        # Any failure here falls back to lightweight generator
-                        html_content = None
-
-                    if not html_content:
-                        # We assume PyQGIS is available in this simplified unified
-                        # setup. If the QGIS-aware generator failed for any
-                        # reason, return an error page rather than falling back
-                        # to the standalone/lightweight generator which we are
-                        # removing to keep the codebase PyQGIS-centric.
-                        from . import http_server
-                        error_html = self._generate_error_html_page(
-                            "MapLibre HTML generation failed (QGIS-dependent generator failed)."
-                        )
-                        http_server.send_http_response(conn, 500, "Internal Server Error", error_html, "text/html; charset=utf-8")
-                        return
+    # 静的ファイル配信: favicon.ico, style.json, data.geojson など。
+    # maplibre/scripts 配下の補助スクリプト（qmap_postload.js, wmts_layers.js）も探す。
+    STATIC_FILES = ("/favicon.ico", "/style.json", "/data.geojson", "/qmap_postload.js", "/wmts_layers.js")
 
-                    from . import http_server
-                    http_server.send_http_response(conn, 200, "OK", html_content, "text/html; charset=utf-8")
-                except Exception as e:
-                    QgsMessageLog.logMessage(f"❌ MapLibre HTML page error: {e}", "geo_webview", Qgis.Critical)
-                    import traceback
-                    QgsMessageLog.logMessage(f"❌ Error traceback: {traceback.format_exc()}", "geo_webview", Qgis.Critical)
-                    from . import http_server
-                    http_server.send_http_response(conn, 500, "Internal Server Error", f"MapLibre HTML page generation failed: {str(e)}")
-                return
-            
-            # WMTS/XYZ endpoint: delegate to qmap_wmts_service for GetCapabilities and tiles
-            if parsed_url.path.startswith('/wmts') or parsed_url.path.startswith('/xyz'):
-                try:
-                    # lazily create service if missing
-                    if not hasattr(self, 'wmts_service') or self.wmts_service is None:
-                        try:
-                            from .qmap_wmts_service import GeoWebViewWMTSService
-                            self.wmts_service = GeoWebViewWMTSService(self)
-                        except Exception:
-                            # Log import/instantiation failure so operator can diagnose
-                            try:
-                                import traceback
-                                from qgis.core import QgsMessageLog, Qgis
-                                QgsMessageLog.logMessage(
-                                    f"Lazy WMTS service creation failed: {traceback.format_exc()}",
-                                    "geo_webview",
-                                    Qgis.Warning
-                                )
-                            except Exception:
-                                try:
-                                    import sys, traceback
-                                    sys.stderr.write('Lazy WMTS creation failed:\n')
-                                    traceback.print_exc()
-                                except Exception:
-                                    pass
-                            self.wmts_service = None
+    def _handle_static_file(self, conn, request):
+        """既知の静的ファイルを（圧縮済みバリアントごと）キャッシュして返す"""
+        from . import http_server
+        path = request.path
 
-                    if self.wmts_service:
-                        self.wmts_service.handle_wmts_request(conn, parsed_url, params, host)
-                    else:
-                        from . import http_server
-                        http_server.send_http_response(conn, 501, 'Not Implemented', 'WMTS service not available')
-                except Exception as e:
-                    QgsMessageLog.logMessage(f"❌ WMTS delegation error: {e}", "geo_webview", Qgis.Critical)
-                    import traceback
-                    QgsMessageLog.logMessage(f"❌ Error traceback: {traceback.format_exc()}", "geo_webview", Qgis.Critical)
-                    from . import http_server
-                    http_server.send_http_response(conn, 500, "Internal Server Error", f"WMTS processing failed: {str(e)}")
-                return
+        # プラグインディレクトリからファイルを探す
+        plugin_dir = os.path.dirname(os.path.abspath(__file__))
+        fname = path.lstrip("/")
 
-            # Lightweight JSON endpoint to list publishable WFS vector layers
-            if parsed_url.path == '/wfs-layers':
-                try:
-                    self._handle_wfs_layers(conn, params)
-                except Exception as e:
-                    QgsMessageLog.logMessage(f"❌ wfs-layers handler error: {e}", "geo_webview", Qgis.Critical)
-                    import traceback
-                    QgsMessageLog.logMessage(f"❌ Error traceback: {traceback.format_exc()}", "geo_webview", Qgis.Critical)
-                    from . import http_server
-                    http_server.send_http_response(conn, 500, "Internal Server Error", f"wfs-layers failed: {str(e)}")
-                return
-            
-            # WFS endpoint: delegate to qmap_wfs_service for GetCapabilities, GetFeature, DescribeFeatureType, and GetStyles
-            if parsed_url.path.startswith('/wfs') or ('SERVICE' in params and params.get('SERVICE', [''])[0].upper() == 'WFS'):
-                try:
-                    # lazily create service if missing
-                    if not hasattr(self, 'wfs_service') or self.wfs_service is None:
-                        try:
-                            from .qmap_wfs_service import GeoWebViewWFSService
-                            self.wfs_service = GeoWebViewWFSService(self.iface, self.server_port)
-                        except Exception:
-                            self.wfs_service = None
-
-                    if self.wfs_service:
-                        # QMapPermalinkWFSService.handle_wfs_request expects (conn, params, host)
-                        # (not parsed_url). Pass parameters accordingly.
-                        try:
-                            self.wfs_service.handle_wfs_request(conn, params, host)
-                        except TypeError:
-                            # Defensive fallback for older/alternate signatures that accept parsed_url
-                            try:
-                                self.wfs_service.handle_wfs_request(conn, parsed_url, params, host)
-                            except Exception:
-                                raise
-                    else:
-                        from . import http_server
-                        http_server.send_http_response(conn, 501, 'Not Implemented', 'WFS service not available')
-                except Exception as e:
-                    QgsMessageLog.logMessage(f"❌ WFS delegation error: {e}", "geo_webview", Qgis.Critical)
-                    import traceback
-                    QgsMessageLog.logMessage(f"❌ Error traceback: {traceback.format_exc()}", "geo_webview", Qgis.Critical)
-                    from . import http_server
-                    http_server.send_http_response(conn, 500, "Internal Server Error", f"WFS processing failed: {str(e)}")
-                return
-            if parsed_url.path == '/debug-bookmarks':
-                try:
-                    if hasattr(self, '_handle_debug_bookmarks') and callable(getattr(self, '_handle_debug_bookmarks')):
-                        self._handle_debug_bookmarks(conn)
-                    else:
-                        # Handler not implemented in this instance
-                        from . import http_server
-                        http_server.send_http_response(conn, 501, 'Not Implemented', 'debug-bookmarks handler not available')
-                except Exception as e:
-                    QgsMessageLog.logMessage(f"❌ debug-bookmarks handler error: {e}", "geo_webview", Qgis.Critical)
-                    import traceback
-                    QgsMessageLog.logMessage(f"❌ Error traceback: {traceback.format_exc()}", "geo_webview", Qgis.Critical)
-                    from . import http_server
-                    http_server.send_http_response(conn, 500, "Internal Server Error", f"debug-bookmarks failed: {str(e)}")
-                return
-            
-            # --- 静的ファイル配信: favicon.ico, style.json, data.geojson など ---
-            import os
-            # Support a few well-known static assets. Also allow serving small
-            # companion scripts stored under maplibre/scripts (qmap_postload.js,
-            # wmts_layers.js) by searching that directory as a fallback.
-            static_files = ["/favicon.ico", "/style.json", "/data.geojson", "/qmap_postload.js", "/wmts_layers.js"]
-            if parsed_url.path in static_files:
-                # プラグインディレクトリからファイルを探す
-                plugin_dir = os.path.dirname(os.path.abspath(__file__))
-                fname = parsed_url.path.lstrip("/")
-
-                # Candidate locations: plugin root, then maplibre/scripts
-                candidates = [os.path.join(plugin_dir, fname), os.path.join(plugin_dir, 'maplibre', 'scripts', fname)]
-                found = None
-                for fpath in candidates:
-                    try:
-                        if os.path.exists(fpath):
-                            found = fpath
-                            break
-                    except Exception:
-                        continue
+        # Candidate locations: plugin root, then maplibre/scripts
+        candidates = [os.path.join(plugin_dir, fname), os.path.join(plugin_dir, 'maplibre', 'scripts', fname)]
+        found = None
+        for fpath in candidates:
+            try:
+                if os.path.exists(fpath):
+                    found = fpath
+                    break
+            except Exception:
+                continue
 
-                if found:
-                    # Content-Type判定
-                    if fname.endswith(".ico"):
-                        content_type = "image/x-icon"
-                    elif fname.endswith(".json"):
-                        content_type = "application/json; charset=utf-8"
-                    elif fname.endswith(".geojson"):
-                        content_type = "application/geo+json; charset=utf-8"
-                    elif fname.endswith(".js"):
-                        content_type = "application/javascript; charset=utf-8"
-                    else:
-                        content_type = "application/octet-stream"
-                    with open(found, "rb") as f:
-                        data = f.read()
-                    http_server.send_binary_response(conn, 200, "OK", data, content_type)
-                    return
-                else:
-                    http_server.send_http_response(conn, 404, "Not Found", f"File not found: {fname}", "text/plain; charset=utf-8")
-                    return
+        if found:
+            # Content-Type判定
+            if fname.endswith(".ico"):
+                content_type = "image/x-icon"
+            elif fname.endswith(".json"):
+                content_type = "application/json; charset=utf-8"
+            elif fname.endswith(".geojson"):
+                content_type = "application/geo+json; charset=utf-8"
+            elif fname.endswith(".js"):
+                content_type = "application/javascript; charset=utf-8"
+            else:
+                content_type = "application/octet-stream"
+            # ファイル内容は圧縮済みバリアントごと (mtime, size) 単位でキャッシュ
+            st = os.stat(found)
+            cached = self._static_cache.get(found)
+            if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+                body = cached[2]
+            else:
+                with open(found, "rb") as f:
+                    body = http_server.precompressed(f.read())
+                self._static_cache[found] = (st.st_mtime_ns, st.st_size, body)
+            http_server.send_binary_response(conn, 200, "OK", body, content_type,
+                                             etag=body.etag, last_modified=int(st.st_mtime))
+        else:
+            http_server.send_http_response(conn, 404, "Not Found", f"File not found: {fname}", "text/plain; charset=utf-8")
 
-            # 未対応のエンドポイントは404エラー
-            QgsMessageLog.logMessage(f"❌ Unknown endpoint: {parsed_url.path}", "geo_webview", Qgis.Warning)
-            from . import http_server
-            # 明示的に利用可能なエンドポイント一覧に /wmts と /wfs を含める
-            http_server.send_http_response(
-                conn,
-                404,
-                "Not Found",
-                "Available endpoints: /wms (PNG image), /qgis-map (OpenLayers HTML), /maplibre (MapLibre HTML), /wmts (WMTS tiles), /wfs (WFS service)"
-            )
-            return
     def _build_navigation_data_from_params(self, params):
         """クエリパラメータからナビゲーション用辞書を構築する
 
@@ -2339,8 +2497,8 @@ class GeoWebViewServerManager:
             QgsMessageLog.logMessage(f"❌ BBOX calculation error: {e}", "geo_webview", Qgis.Warning)
             return None
 
-    def _handle_wms_get_map_with_bbox(self, conn, bbox, crs, width, height, rotation=0.0):
-        """計算されたBBOXでWMS GetMapを処理"""
+    def _handle_wms_get_map_with_bbox(self, conn, bbox, crs, width, height, rotation=0.0, image_format='png'):
+        """計算されたBBOXでWMS GetMapを処理（image_format: 'png' / 'jpg' / 'webp'）"""
         from qgis.core import QgsMessageLog, Qgis
         
         try:
@@ -2367,10 +2525,30 @@ class GeoWebViewServerManager:
             # Use canvas-based rendering as the authoritative method for
             # permalink BBOX requests. Rotation handling should be applied
             # via canvas extent/rotation adjustment if needed.
-            png_data = self._generate_qgis_map_png(width, height, bbox, crs, rotation)
-            if png_data and len(png_data) > 1000:
+            scope = render_control.current_scope()
+            etag = None
+            if scope is None and self.wms_service is not None:
+                # direct client request: validators before rendering (WMTS captures set their own)
                 from . import http_server
-                http_server.send_binary_response(conn, 200, "OK", png_data, "image/png")
+                etag = self.wms_service._response_etag(('permalink', width, height, bbox, crs, rotation, image_format))
+                if http_server.check_not_modified(conn, etag, cache_control='no-cache',
+                                                  content_type=image_formats.mime_type(image_format)):
+                    return
+            if scope is None:
+                # direct client request: cancel when this client disconnects
+                with render_control.cancel_scope(render_control.disconnect_watch(conn)) as scope:
+                    png_data = self._generate_qgis_map_png(width, height, bbox, crs, rotation, image_format)
+            else:
+                png_data = self._generate_qgis_map_png(width, height, bbox, crs, rotation, image_format)
+            if not png_data and scope.cancelled:
+                # render cancelled because the client(s) disconnected
+                return
+            # tiny PNGs are treated as failed renders; lossy formats of a
+            # uniform tile are legitimately small
+            if png_data and (len(png_data) > 1000 or image_format != 'png'):
+                from . import http_server
+                http_server.send_binary_response(conn, 200, "OK", png_data, image_formats.mime_type(image_format),
+                                                 etag=etag, cache_control='no-cache' if etag else None)
                 return
             
             # 最終フォールバック: エラー画像
@@ -2444,8 +2622,8 @@ class GeoWebViewServerManager:
             QgsMessageLog.logMessage(f"❌ Error in _generate_webmap_png: {e}", "geo_webview", Qgis.Critical)
             return None
 
-    def _generate_qgis_map_png(self, width, height, bbox, crs, rotation=0.0):
-        """Generate PNG using PyQGIS independent renderer only.
+    def _generate_qgis_map_png(self, width, height, bbox, crs, rotation=0.0, image_format='png'):
+        """Generate PNG (or ``image_format``) using PyQGIS independent renderer only.
 
         This implementation avoids canvas capture and always uses the
         independent renderer (QgsMapSettings + QgsMapRendererParallelJob).
@@ -2453,7 +2631,7 @@ class GeoWebViewServerManager:
         from qgis.core import QgsMessageLog, Qgis
 
         try:
-            return self._render_map_image(width, height, bbox, crs, rotation)
+            return self._render_map_image(width, height, bbox, crs, rotation, image_format)
         except Exception as e:
             QgsMessageLog.logMessage(f"❌ Error in _generate_qgis_map_png (delegated): {e}", "geo_webview", Qgis.Critical)
             return None
@@ -2660,7 +2838,7 @@ class GeoWebViewServerManager:
             QgsMessageLog.logMessage(f"❌ Error in _capture_canvas_image: {e}", "geo_webview", Qgis.Critical)
             return None
 
-    def _render_map_image(self, width, height, bbox, crs, rotation=0.0):
+    def _render_map_image(self, width, height, bbox, crs, rotation=0.0, image_format='png'):
         """独立レンダラでPNGを生成する（rotation をサポート）
 
         Args:
@@ -2668,6 +2846,7 @@ class GeoWebViewServerManager:
             bbox: 'minx,miny,maxx,maxy' 文字列または None
             crs: CRS文字列（例: 'EPSG:3857'）
             rotation: 地図回転角度（度単位）。QgsMapSettings の回転サポートがある場合に使用されます。
+            image_format: 出力形式（'png' / 'jpg' / 'webp'）
         """
         from qgis.core import QgsMessageLog, Qgis
 
@@ -2679,7 +2858,7 @@ class GeoWebViewServerManager:
                 return None
 
             # 独立したマップレンダラーでPNG画像を生成
-            png_data = self._execute_map_rendering(map_settings)
+            png_data = self._execute_map_rendering(map_settings, image_format)
             if png_data:
                 return png_data
             else:
@@ -2692,43 +2871,35 @@ class GeoWebViewServerManager:
             QgsMessageLog.logMessage(f"❌ Traceback: {traceback.format_exc()}", "geo_webview", Qgis.Critical)
             return None
 
-    def _create_wms_map_settings(self, width, height, bbox, crs, rotation=0.0):
+    def _create_wms_map_settings(self, width, height, bbox, crs, rotation=0.0, layers_param=None):
         """WMS用の独立したマップ設定を作成 - キャンバスに依存しない
 
+        レイヤ構成・品質フラグは構築済みテンプレート（WMS サービスが保持し、
+        レイヤツリー/スタイル変更で無効化）を複製し、サイズ・範囲・CRS・回転
+        だけをリクエストごとに設定する。
+
         rotation: 回転角度（度） — map settings が回転をサポートする場合は適用します。
+        layers_param: カンマ区切りのレイヤID/名前（WMS LAYERS と同じ解決）。
+            省略時は表示中のレイヤ。
         """
-        from qgis.core import QgsMapSettings, QgsRectangle, QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsProject, QgsMessageLog, Qgis
-        
+        from qgis.core import QgsCoordinateReferenceSystem, QgsRectangle, QgsMessageLog, Qgis
+
         try:
-            # 新しいマップ設定オブジェクトを作成
-            map_settings = QgsMapSettings()
-            
-            # 1. レイヤ設定 - QGISデスクトップの表示状態を踏襲
-            canvas = self.iface.mapCanvas()
-            if canvas:
-                # アクティブなレイヤのみを取得（表示状態を踏襲）
-                visible_layers = []
-                layer_tree_root = QgsProject.instance().layerTreeRoot()
-                
-                for layer in canvas.layers():
-                    layer_tree_layer = layer_tree_root.findLayer(layer.id())
-                    if layer_tree_layer and layer_tree_layer.isVisible():
-                        visible_layers.append(layer)
-                
-                map_settings.setLayers(visible_layers)
-                map_settings.setBackgroundColor(canvas.canvasColor())
+            if layers_param and self.wms_service is not None:
+                map_settings = self.wms_service._create_map_settings_from_canvas(width, height, crs,
+                                                                                 layer_ids=layers_param)
+            elif self.wms_service is not None and hasattr(self.wms_service, 'map_settings_from_template'):
+                map_settings = self.wms_service.map_settings_from_template(('wms',), self._build_wms_map_settings_template)
             else:
-                # キャンバスが無い場合はプロジェクトの全レイヤを使用
-                from qgis.core import QgsProject
-                project = QgsProject.instance()
-                map_settings.setLayers(project.mapLayers().values())
-                QgsMessageLog.logMessage("⚠️ No canvas, using all project layers", "geo_webview", Qgis.Warning)
-            
-            # 2. 出力サイズ設定
+                map_settings = self._build_wms_map_settings_template()
+            if map_settings is None:
+                return None
+
+            # 出力サイズ設定
             from qgis.PyQt.QtCore import QSize
             map_settings.setOutputSize(QSize(width, height))
-            
-            # 3. 座標系と範囲設定 - WMSパラメータに基づく
+
+            # 座標系と範囲設定 - WMSパラメータに基づく
             if bbox and crs:
                 success = self._configure_wms_extent_and_crs(map_settings, bbox, crs)
                 if not success:
@@ -2736,6 +2907,7 @@ class GeoWebViewServerManager:
                     return None
             else:
                 # デフォルト範囲設定
+                canvas = self.iface.mapCanvas()
                 if canvas:
                     map_settings.setDestinationCrs(canvas.mapSettings().destinationCrs())
                     map_settings.setExtent(canvas.extent())
@@ -2745,17 +2917,8 @@ class GeoWebViewServerManager:
                     world_extent = QgsRectangle(-180, -90, 180, 90)
                     map_settings.setDestinationCrs(world_crs)
                     map_settings.setExtent(world_extent)
-            
-            # 4. 品質設定
-            map_settings.setFlag(QgsMapSettings.Antialiasing, True)
-            map_settings.setFlag(QgsMapSettings.UseAdvancedEffects, True)
-            map_settings.setFlag(QgsMapSettings.ForceVectorOutput, False)
-            map_settings.setFlag(QgsMapSettings.DrawEditingInfo, False)
-            
-            # 5. DPI設定
-            map_settings.setOutputDpi(96)
 
-            # 6. 回転（度） - QgsMapSettings には setRotation がある場合に適用
+            # 回転（度） - QgsMapSettings には setRotation がある場合に適用
             try:
                 # Apply rotation when caller provided a rotation value (including 0.0).
                 # This ensures ANGLE=0 and ANGLE!=0 follow the same code path.
@@ -2763,13 +2926,56 @@ class GeoWebViewServerManager:
                     map_settings.setRotation(float(rotation))
             except Exception:
                 pass
-            
+
             return map_settings
-            
+
         except Exception as e:
             QgsMessageLog.logMessage(f"❌ Error creating WMS map settings: {e}", "geo_webview", Qgis.Critical)
             return None
 
+    def _build_wms_map_settings_template(self):
+        """WMS用マップ設定のテンプレート（レイヤ・背景色・品質フラグ・DPI）を構築"""
+        from qgis.core import QgsMapSettings, QgsProject, QgsMessageLog, Qgis
+
+        try:
+            # 新しいマップ設定オブジェクトを作成
+            map_settings = QgsMapSettings()
+
+            # 1. レイヤ設定 - QGISデスクトップの表示状態を踏襲
+            canvas = self.iface.mapCanvas()
+            if canvas:
+                # アクティブなレイヤのみを取得（表示状態を踏襲）
+                visible_layers = []
+                layer_tree_root = QgsProject.instance().layerTreeRoot()
+
+                for layer in canvas.layers():
+                    layer_tree_layer = layer_tree_root.findLayer(layer.id())
+                    if layer_tree_layer and layer_tree_layer.isVisible():
+                        visible_layers.append(layer)
+
+                map_settings.setLayers(visible_layers)
+                map_settings.setBackgroundColor(canvas.canvasColor())
+            else:
+                # キャンバスが無い場合はプロジェクトの全レイヤを使用
+                project = QgsProject.instance()
+                map_settings.setLayers(project.mapLayers().values())
+                QgsMessageLog.logMessage("⚠️ No canvas, using all project layers", "geo_webview", Qgis.Warning)
+
+            # 2. 品質設定
+            map_settings.setFlag(QgsMapSettings.Antialiasing, True)
+            map_settings.setFlag(QgsMapSettings.UseAdvancedEffects, True)
+            map_settings.setFlag(QgsMapSettings.ForceVectorOutput, False)
+            map_settings.setFlag(QgsMapSettings.DrawEditingInfo, False)
+
+            # 3. DPI設定
+            map_settings.setOutputDpi(96)
+
+            return map_settings
+
+        except Exception as e:
+            QgsMessageLog.logMessage(f"❌ Error creating WMS map settings template: {e}", "geo_webview", Qgis.Critical)
+            return None
+
     def _configure_wms_extent_and_crs(self, map_settings, bbox, crs):
         """WMSパラメータに基づいて範囲と座標系を設定"""
         from qgis.core import QgsRectangle, QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsProject, QgsMessageLog, Qgis
@@ -2802,8 +3008,40 @@ class GeoWebViewServerManager:
             QgsMessageLog.logMessage(f"❌ Error configuring WMS extent/CRS: {e}", "geo_webview", Qgis.Critical)
             return False
 
-    def _execute_map_rendering(self, map_settings):
-        """独立したマップレンダラーでPNG画像を生成"""
+    def _execute_map_rendering(self, map_settings, image_format='png'):
+        """独立したマップレンダラーでPNG（または image_format の）画像を生成"""
+        image = self._execute_map_rendering_image(map_settings)
+        if image is None:
+            return None
+        return self._encode_image(image, image_format)
+
+    def render_map_qimage(self, width, height, bbox, crs, layers_param=None):
+        """BBOX/CRS を width x height で描画した QImage を返す（失敗時 None）
+
+        WMTS のメタタイル描画用。PNG への変換は呼び出し側が切り出し後に行う。
+        layers_param はカンマ区切りのレイヤID/名前（WMTS の LAYER 指定）。
+        """
+        from qgis.core import QgsMessageLog, Qgis
+        map_settings = self._create_wms_map_settings(width, height, bbox, crs, rotation=0.0,
+                                                     layers_param=layers_param)
+        if not map_settings:
+            QgsMessageLog.logMessage("❌ Failed to create WMS map settings", "geo_webview", Qgis.Warning)
+            return None
+        return self._execute_map_rendering_image(map_settings)
+
+    def _image_to_png(self, image):
+        """QImage を PNG バイト列に変換（失敗時 None）"""
+        return self._encode_image(image, 'png')
+
+    def _encode_image(self, image, image_format='png'):
+        """QImage を image_format（'png' / 'jpg' / 'webp'）のバイト列に変換（失敗時 None）
+
+        エンコードは描画とは別の encode_pool で行う（PNG は QMAP_PNG_LEVEL の圧縮レベル）。
+        """
+        return encode_pool.encode(image, image_format)
+
+    def _execute_map_rendering_image(self, map_settings):
+        """独立したマップレンダラーで描画し QImage を返す（失敗/中止時 None）"""
         from qgis.core import QgsMapRendererParallelJob, QgsMessageLog, Qgis
         
         try:
@@ -2840,12 +3078,21 @@ class GeoWebViewServerManager:
             except Exception:
                 pass
             
+            # 描画準備: 縮尺範囲外・範囲外レイヤの除外とズーム帯ごとの簡略化
+            render_prep.prepare(map_settings)
+
             # 並列レンダリングジョブを作成
             job = QgsMapRendererParallelJob(map_settings)
             
-            # レンダリング実行
-            job.start()
-            job.waitForFinished()
+            # レンダリング実行（クライアント切断時・タイムアウト時はキャンセル）
+            timeout_s = getattr(self.wms_service, 'render_timeout_s', 30)
+            outcome = render_control.wait_for_job(job, timeout_s)
+            if outcome == 'cancelled':
+                QgsMessageLog.logMessage("🛑 Rendering cancelled: client disconnected", "geo_webview", Qgis.Info)
+                return None
+            if outcome == 'timeout':
+                QgsMessageLog.logMessage(f"⚠️ Rendering timeout ({timeout_s}s)", "geo_webview", Qgis.Warning)
+                return None
             
             # レンダリング結果を取得
             image = job.renderedImage()
@@ -2853,30 +3100,7 @@ class GeoWebViewServerManager:
                 QgsMessageLog.logMessage("❌ Rendered image is null", "geo_webview", Qgis.Warning)
                 return None
             
-            # PNG形式でバイト配列に変換
-            from qgis.PyQt.QtCore import QByteArray, QBuffer, QIODevice
-            byte_array = QByteArray()
-            buffer = QBuffer(byte_array)
-            # QIODevice.WriteOnly may be namespaced differently in Qt6/PyQt6.
-            write_mode = getattr(QIODevice, 'WriteOnly', None)
-            if write_mode is None:
-                om = getattr(QIODevice, 'OpenMode', None) or getattr(QIODevice, 'OpenModeFlag', None)
-                if om is not None and hasattr(om, 'WriteOnly'):
-                    write_mode = getattr(om, 'WriteOnly')
-            if write_mode is None:
-                try:
-                    write_mode = int(1)
-                except Exception:
-                    write_mode = 1
-            buffer.open(write_mode)
-            
-            success = image.save(buffer, "PNG")
-            if not success:
-                QgsMessageLog.logMessage("❌ Failed to save rendered image as PNG", "geo_webview", Qgis.Warning)
-                return None
-            
-            png_data = byte_array.data()
-            return png_data
+            return image
             
         except Exception as e:
             QgsMessageLog.logMessage(f"❌ Error executing map rendering: {e}", "geo_webview", Qgis.Critical)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""Request coalescing ("single-flight") for identical in-flight work.
+
+When several requests need the same result at the same time (the same
+WMTS tile from two browser tabs, a prewarm and a client asking for the
+same tile, an identical GetMap or GetFeature), only the first caller —
+the leader — does the work; the others wait for its result.
+
+Groups are process-wide and looked up by name so every service shares
+the same in-flight table (e.g. WMTS requests and the prewarm pool).
+"""
+import os
+import threading
+import time
+
+from . import render_slots
+
+
+def _env_float(name, default):
+    try:
+        v = os.environ.get(name)
+        return float(v) if v not in (None, '') else default
+    except Exception:
+        return default
+
+
+# Seconds a follower waits for the leader before the stuck call is given up.
+# A leader may legitimately spend the whole render queue wait plus the
+# render timeout (and an encode) before it is done, so the default covers both.
+COALESCE_TIMEOUT_S = _env_float(
+    'QMAP_COALESCE_TIMEOUT_S',
+    render_slots.QUEUE_TIMEOUT_S + _env_float('QMAP_RENDER_TIMEOUT_S', 30.0) + 5.0)
+# followers wake up this often to check their own watch()
+WAIT_SLICE_S = 0.25
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error', 'followers', 'watches', 'unwatched')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+        # watch() callables of the callers; unwatched counts callers without one
+        self.watches = []
+        self.unwatched = 0
+
+    def add_caller(self, watch):
+        if watch is None:
+            self.unwatched += 1
+        else:
+            self.watches.append(watch)
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one execution.
+
+    Args:
+        name: group name (used in statistics)
+        timeout: seconds a follower waits for the leader; on timeout the
+            stuck call is detached and the waiting callers re-join, so one
+            of them leads a fresh execution the others share
+    """
+
+    def __init__(self, name, timeout=None):
+        self.name = name
+        self.timeout = COALESCE_TIMEOUT_S if timeout is None else float(timeout)
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {'leaders': 0, 'coalesced': 0, 'timeouts': 0, 'errors': 0, 'abandoned': 0}
+
+    def do(self, key, fn, watch=None):
+        """Return ``fn()``, sharing one execution among concurrent callers of ``key``.
+
+        A leader's exception is re-raised in its followers. ``watch()``
+        returns True once this caller no longer needs the result (client
+        disconnected); see :meth:`abandoned`. A waiting follower whose
+        ``watch()`` turns True stops waiting and gets None.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                    self._stats['leaders'] += 1
+                else:
+                    call.followers += 1
+                call.add_caller(watch)
+
+            if leader:
+                try:
+                    call.result = fn()
+                    return call.result
+                except BaseException as e:
+                    call.error = e
+                    with self._lock:
+                        self._stats['errors'] += 1
+                    raise
+                finally:
+                    with self._lock:
+                        if self._calls.get(key) is call:
+                            del self._calls[key]
+                    call.event.set()
+
+            outcome = self._wait(call, watch)
+            if outcome == 'done':
+                with self._lock:
+                    self._stats['coalesced'] += 1
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            if outcome == 'gone':
+                with self._lock:
+                    self._stats['abandoned'] += 1
+                return None
+            # the leader is stuck: detach its call so the callers re-joining
+            # now share one new execution instead of each running fn()
+            with self._lock:
+                self._stats['timeouts'] += 1
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+
+    def _wait(self, call, watch):
+        """'done', 'gone' (this caller's watch() fired) or 'timeout'."""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return 'timeout'
+            if call.event.wait(min(WAIT_SLICE_S, remaining)):
+                return 'done'
+            if watch is not None:
+                try:
+                    if watch():
+                        return 'gone'
+                except Exception:
+                    pass
+
+    def abandoned(self, key):
+        """True when every caller waiting for ``key`` reports it gave up.
+
+        Callers that passed no ``watch`` never give up, so e.g. a prewarm
+        render sharing the key is never abandoned.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None or call.unwatched or not call.watches:
+                return False
+            watches = list(call.watches)
+        for watch in watches:
+            try:
+                if not watch():
+                    return False
+            except Exception:
+                return False
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+            stats['waiting'] = sum(c.followers for c in self._calls.values())
+        stats['timeout_s'] = self.timeout
+        return stats
+
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+def group(name, timeout=None):
+    """Return the process-wide :class:`SingleFlight` group called ``name``."""
+    with _groups_lock:
+        sf = _groups.get(name)
+        if sf is None:
+            sf = _groups[name] = SingleFlight(name, timeout)
+        return sf
+
+
+def stats():
+    """Statistics of every group, keyed by group name."""
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {sf.name: sf.stats() for sf in groups}
@@ -18,6 +18,9 @@ from qgis.core import (
 from qgis.PyQt.QtCore import QUrl
 from qgis.PyQt.QtGui import QColor
 
+from .http_server import HTTPRequest
+from . import single_flight
+
 
 class GeoWebViewWFSService:
     """geo_webview用WFSサービスクラス
@@ -37,7 +40,9 @@ class GeoWebViewWFSService:
         self.server_port = server_port
         
         # レスポンスキャッシュ (Phase 1高速化)
-        self._response_cache = {}  # {cache_key: (timestamp, response_data, content_type)}
+        # {cache_key: (timestamp, http_server.PrecompressedBody, content_type)}
+        # 本文は圧縮済みバリアントを保持するため、ヒット時に再圧縮しない
+        self._response_cache = {}
         self._cache_lock = threading.Lock()
         self._cache_ttl = 300  # 5分間キャッシュ
 
@@ -82,6 +87,10 @@ class GeoWebViewWFSService:
         key_string = ':'.join(key_parts)
         return hashlib.md5(key_string.encode('utf-8')).hexdigest()
     
+    def _cache_etag(self, cache_key: str, timestamp: float) -> str:
+        """キャッシュエントリのETag（キャッシュキー + 保存時刻ms）"""
+        return f"{cache_key}-{int(timestamp * 1000):x}"
+
     def _clear_expired_cache(self):
         """期限切れキャッシュをクリア"""
         try:
@@ -102,9 +111,16 @@ class GeoWebViewWFSService:
         except Exception:
             pass
 
-    def handle_wfs_request(self, conn, params: Dict[str, list], host: Optional[str] = None) -> None:
-        """WFSエンドポイントを処理"""
+    def handle_wfs_request(self, conn, http_request: HTTPRequest) -> None:
+        """WFSエンドポイントを処理
+
+        Args:
+            conn: クライアント接続
+            http_request: フロントエンドで解析済みのリクエスト（params/host を参照）
+        """
         from qgis.core import QgsMessageLog, Qgis
+        params = http_request.params
+        host = http_request.host
 
 
         # デバッグ情報
@@ -174,7 +190,7 @@ class GeoWebViewWFSService:
                 f"  </FeatureTypeList>\n"
                 f"</WFS_Capabilities>"
             )
-            http_server.send_http_response(conn, 200, "OK", xml_content, content_type="text/xml; charset=utf-8")
+            http_server.send_http_response(conn, 200, "OK", xml_content, content_type="text/xml; charset=utf-8", cacheable=True)
             return
 
         # Build FeatureType entries
@@ -249,7 +265,7 @@ class GeoWebViewWFSService:
         )
 
         from . import http_server
-        http_server.send_http_response(conn, 200, "OK", xml_content, content_type="text/xml; charset=utf-8")
+        http_server.send_http_response(conn, 200, "OK", xml_content, content_type="text/xml; charset=utf-8", cacheable=True)
 
     def _handle_wfs_get_feature(self, conn, params: Dict[str, list]) -> None:
         """WFS GetFeatureリクエストを処理"""
@@ -299,45 +315,31 @@ class GeoWebViewWFSService:
                             f"⚡ WFS Cache HIT: {type_name} (saved ~{int((time.time()-timestamp)*1000)}ms)",
                             "geo_webview", Qgis.Info
                         )
+                        # キャッシュキー+保存時刻を強いETagとし、一致すれば304
                         from . import http_server
                         http_server.send_http_response(
                             conn, 200, "OK", cached_data, 
-                            content_type=cached_content_type
+                            content_type=cached_content_type,
+                            etag=self._cache_etag(cache_key, timestamp),
+                            last_modified=int(timestamp)
                         )
                         return
             
-            # キャッシュミス: 通常処理
-            start_time = time.time()
-
-            # 地物のクエリ
-            features = self._query_features(layer, bbox, srs_name, max_features)
+            # キャッシュミス: 通常処理（同一キーの同時リクエストは1回のクエリを共有）
+            cached_at, response_body, content_type = single_flight.group('wfs-getfeature').do(
+                cache_key,
+                lambda: self._query_and_cache_features(cache_key, layer, type_name, bbox, srs_name,
+                                                       max_features, output_format))
+            from . import http_server
 
-            # 出力フォーマットに応じたレスポンス生成（柔軟な判定）
-            of = (output_format or '').lower()
-            if 'gml' in of or of in ('gml', 'application/gml+xml'):
-                response_content = self._features_to_gml(features, layer)
-                content_type = "application/gml+xml; charset=utf-8"
-            else:
-                # default/fallback to GeoJSON
-                response_content = self._features_to_geojson(features, layer)
-                content_type = "application/json; charset=utf-8"
-            
-            # 🚀 Phase 1高速化: キャッシュに保存
-            elapsed_time = int((time.time() - start_time) * 1000)
-            with self._cache_lock:
-                self._response_cache[cache_key] = (time.time(), response_content, content_type)
-                QgsMessageLog.logMessage(
-                    f"💾 WFS Cache MISS: {type_name} ({len(features)}地物, {elapsed_time}ms) - キャッシュに保存",
-                    "geo_webview", Qgis.Info
-                )
-            
             # 期限切れキャッシュのクリーンアップ(10%の確率で実行)
             import random
             if random.random() < 0.1:
                 self._clear_expired_cache()
 
-            from . import http_server
-            http_server.send_http_response(conn, 200, "OK", response_content, content_type=content_type)
+            http_server.send_http_response(conn, 200, "OK", response_body, content_type=content_type,
+                                           etag=self._cache_etag(cache_key, cached_at),
+                                           last_modified=int(cached_at))
 
         except Exception as e:
             from qgis.core import QgsMessageLog, Qgis
@@ -351,6 +353,41 @@ class GeoWebViewWFSService:
             except Exception:
                 http_server.send_http_response(conn, 500, "Internal Server Error", f"WFS GetFeature failed: {str(e)}")
 
+    def _query_and_cache_features(self, cache_key, layer, type_name, bbox, srs_name, max_features, output_format):
+        """Query, serialize and cache a GetFeature response.
+
+        Returns:
+            (cached_at, response_body, content_type)
+        """
+        from qgis.core import QgsMessageLog, Qgis
+        start_time = time.time()
+
+        # 地物のクエリ
+        features = self._query_features(layer, bbox, srs_name, max_features)
+
+        # 出力フォーマットに応じたレスポンス生成（柔軟な判定）
+        of = (output_format or '').lower()
+        if 'gml' in of or of in ('gml', 'application/gml+xml'):
+            response_content = self._features_to_gml(features, layer)
+            content_type = "application/gml+xml; charset=utf-8"
+        else:
+            # default/fallback to GeoJSON
+            response_content = self._features_to_geojson(features, layer)
+            content_type = "application/json; charset=utf-8"
+
+        # 🚀 Phase 1高速化: キャッシュに保存
+        elapsed_time = int((time.time() - start_time) * 1000)
+        from . import http_server
+        response_body = http_server.PrecompressedBody(response_content)
+        cached_at = time.time()
+        with self._cache_lock:
+            self._response_cache[cache_key] = (cached_at, response_body, content_type)
+            QgsMessageLog.logMessage(
+                f"💾 WFS Cache MISS: {type_name} ({len(features)}地物, {elapsed_time}ms) - キャッシュに保存",
+                "geo_webview", Qgis.Info
+            )
+        return cached_at, response_body, content_type
+
     def _handle_wfs_describe_feature_type(self, conn, params: Dict[str, list]) -> None:
         """WFS DescribeFeatureTypeリクエストを処理"""
         from qgis.core import QgsMessageLog, Qgis
@@ -687,7 +724,8 @@ class GeoWebViewWFSService:
 
             geojson["features"].append(feature_json)
 
-        return json.dumps(geojson, ensure_ascii=False, indent=2)
+        # compact separators: indentation only inflates large feature collections
+        return json.dumps(geojson, ensure_ascii=False, separators=(',', ':'))
 
     def _extract_style_hint(self, layer: QgsVectorLayer, feature) -> Dict[str, Any]:
         """Extract a minimal style hint for a feature from the layer's renderer.
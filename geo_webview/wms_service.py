@@ -6,18 +6,78 @@ WMS (Web Map Service) 機能を提供する専用クラス。
 QGISキャンバスから地図画像を生成し、WMSプロトコルに対応。
 """
 
+import concurrent.futures
+import hashlib
+import json
 import math
 import os
 import multiprocessing
+import threading
+import time
 from typing import Optional, Dict, Any, Tuple
 from qgis.core import (
     QgsMapSettings, QgsMapRendererParallelJob, QgsRectangle, 
     QgsCoordinateReferenceSystem, QgsCoordinateTransform, 
     QgsProject, QgsMessageLog, Qgis
 )
-from qgis.PyQt.QtCore import QSize, QEventLoop, QTimer
+from qgis.PyQt.QtCore import QSize
 from qgis.PyQt.QtGui import QColor
 
+from .http_server import HTTPRequest
+from . import byte_cache
+from . import encode_pool
+from . import feature_info
+from . import image_formats
+from . import legend
+from . import project_state
+from . import render_control
+from . import render_prep
+from . import render_slots
+from . import single_flight
+
+
+# ids of the layers drawn by the current thread's GetMap render (see _get_map_image)
+_rendered = threading.local()
+
+
+def inverse_rotate_crop(image, rotation, width, height, smooth=True):
+    """North-up ``width`` x ``height`` center of a render made with map rotation ``rotation``.
+
+    Produces the same pixels as ``image.transformed(R(-rotation))`` followed
+    by the center crop, but paints the rotated render straight into an
+    output of the requested size, so the enlarged rotated intermediate is
+    never allocated. Returns None when the crop would not fit inside the
+    rotated bounds (the caller then uses the full-transform path).
+    """
+    from qgis.PyQt.QtCore import Qt, QRectF
+    from qgis.PyQt.QtGui import QImage, QPainter, QPolygonF, QTransform
+
+    w0 = image.width()
+    h0 = image.height()
+    inv = QTransform()
+    inv.translate(w0 / 2.0, h0 / 2.0)
+    inv.rotate(-float(rotation))
+    inv.translate(-w0 / 2.0, -h0 / 2.0)
+    # QImage.transformed() shifts its result so the rotated bounds start at 0,0
+    mat = QImage.trueMatrix(inv, w0, h0)
+    bounds = mat.map(QPolygonF(QRectF(0, 0, w0, h0))).boundingRect().toAlignedRect()
+    px_min = bounds.width() // 2 - width // 2
+    py_min = bounds.height() // 2 - height // 2
+    if px_min < 0 or py_min < 0 or px_min + width > bounds.width() or py_min + height > bounds.height():
+        return None
+
+    fmt = image.format() if image.hasAlphaChannel() else QImage.Format_ARGB32_Premultiplied
+    out = QImage(width, height, fmt)
+    out.fill(Qt.transparent)
+    painter = QPainter(out)
+    try:
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, bool(smooth))
+        painter.setTransform(mat * QTransform.fromTranslate(-px_min, -py_min))
+        painter.drawImage(0, 0, image)
+    finally:
+        painter.end()
+    return out
+
 
 class GeoWebViewWMSService:
     """geo_webview用WMSサービスクラス
@@ -43,12 +103,11 @@ class GeoWebViewWMSService:
         self.server_port = server_port
         self.force_epsg3857 = force_epsg3857
         
-        # キャッシュ: 頻繁に使用されるレイヤー設定を保持
-        self._layer_cache = {}  # {layer_id: {style_name: qml_string}}
-        self._theme_cache = {}  # {theme_name: (layers, style_overrides)}
         # -- configurable defaults (can be passed to __init__ or via env vars)
         cpu_count = os.cpu_count() or multiprocessing.cpu_count() or 1
         self.max_render_workers = int(max_render_workers) if max_render_workers is not None else int(os.environ.get('QMAP_MAX_RENDER_WORKERS', max(1, int(cpu_count) - 1)))
+        # process-wide render slot budget shared with WMTS/XYZ and prewarm
+        render_slots.configure(self.max_render_workers)
         self.max_io_workers = int(max_io_workers) if max_io_workers is not None else int(os.environ.get('QMAP_MAX_IO_WORKERS', 20))
         self.request_timeout_s = int(request_timeout_s) if request_timeout_s is not None else int(os.environ.get('QMAP_REQUEST_TIMEOUT_S', 10))
         self.retry_count = int(retry_count) if retry_count is not None else int(os.environ.get('QMAP_RETRY_COUNT', 2))
@@ -56,6 +115,285 @@ class GeoWebViewWMSService:
         self.max_image_dimension = int(max_image_dimension) if max_image_dimension is not None else int(os.environ.get('QMAP_MAX_IMAGE_DIMENSION', 4096))
         # rendering timeout in seconds (used for QgsMapRendererParallelJob wait)
         self.render_timeout_s = int(render_timeout_s) if render_timeout_s is not None else int(os.environ.get('QMAP_RENDER_TIMEOUT_S', 30))
+        # ANGLE != 0 output: 'northup' (north-up image the client rotates) or
+        # 'direct' (rotated map rendered at the requested size); ANGLE_MODE overrides
+        self.angle_mode = 'direct' if os.environ.get('QMAP_ANGLE_MODE', '').strip().lower() == 'direct' else 'northup'
+
+        # 🚀 GetMap画像キャッシュ: 同一パラメータ+同一レイヤ/スタイル状態ならPNGを再利用
+        self.getmap_cache = byte_cache.ByteBudgetLRU(
+            'wms-getmap', int(os.environ.get('QMAP_GETMAP_CACHE_BYTES', 64 * 1024 * 1024)))
+        # QgsMapSettings templates per layer composition (count-bounded: size 1 each)
+        template_count = int(os.environ.get('QMAP_SETTINGS_TEMPLATES', 32))
+        self.settings_templates = byte_cache.ByteBudgetLRU('map-settings', template_count, max_entry_bytes=1)
+        # QML of layer styles ((layer_id, style_name) -> qml; '' = current style) and
+        # resolved map themes (name -> (layers, style_overrides)), charged by QML size
+        self.style_cache = byte_cache.ByteBudgetLRU(
+            'wms-layer-styles', int(os.environ.get('QMAP_STYLE_CACHE_BYTES', 16 * 1024 * 1024)))
+        self.theme_cache = byte_cache.ByteBudgetLRU(
+            'wms-themes', int(os.environ.get('QMAP_THEME_CACHE_BYTES', 16 * 1024 * 1024)))
+        # GetLegendGraphic: swatch atlases per (layer, style, style identity, symbol size)
+        # and composed legend PNGs; keys start with the tuple of layer ids they depend on
+        self.legend_cache = byte_cache.ByteBudgetLRU(
+            'wms-legend', int(os.environ.get('QMAP_LEGEND_CACHE_BYTES', 8 * 1024 * 1024)))
+        # GetFeatureInfo: per-layer QgsSpatialIndex (charged ~96 bytes per feature)
+        index_bytes = int(os.environ.get('QMAP_FI_INDEX_BYTES', 64 * 1024 * 1024))
+        self.feature_index = feature_info.FeatureIndexCache(
+            byte_cache.ByteBudgetLRU('wms-featureinfo-index', index_bytes, max_entry_bytes=index_bytes))
+        # default hit tolerance (px) per geometry type; FI_*_TOLERANCE override per request
+        self.fi_tolerance_px = {
+            0: float(os.environ.get('QMAP_FI_POINT_TOLERANCE', 8)),
+            1: float(os.environ.get('QMAP_FI_LINE_TOLERANCE', 5)),
+            2: float(os.environ.get('QMAP_FI_POLYGON_TOLERANCE', 0)),
+        }
+        self.fi_max_feature_count = int(os.environ.get('QMAP_FI_MAX_FEATURE_COUNT', 50))
+        # GetMapBatch: maximum number of extents per request
+        self.batch_max_items = int(os.environ.get('QMAP_BATCH_MAX_ITEMS', 64))
+        # bumped on every invalidation; renders started before it are not cached
+        self._render_generation = 0
+        # per-process part of the response ETags: data edited while the server
+        # was down must not match validators handed out by a previous run
+        self._etag_salt = os.urandom(8).hex()
+        self._hooked_layer_ids = set()
+        self._attach_invalidation_hooks()
+
+    def _attach_invalidation_hooks(self):
+        """Invalidate GetMap images and map-settings templates on project changes.
+
+        Visibility and current-style changes already change the project
+        identity part of the cache keys; these hooks cover the rest (layer
+        tree order, map themes, symbology and data edits, added/removed
+        layers, project reload).
+        """
+        try:
+            project = QgsProject.instance()
+        except Exception:
+            return
+        for sname in ('layersAdded', 'layersRemoved', 'cleared', 'readProject'):
+            try:
+                sig = getattr(project, sname, None)
+                if sig and hasattr(sig, 'connect'):
+                    sig.connect(self._on_project_layers_changed)
+            except Exception:
+                continue
+        sources = []
+        try:
+            sources.append((project.layerTreeRoot(),
+                            ('visibilityChanged', 'layerOrderChanged', 'addedChildren', 'removedChildren')))
+        except Exception:
+            pass
+        try:
+            themes = project.mapThemeCollection()
+            sources.append((themes, ('mapThemesChanged', 'mapThemeChanged')))
+            for sname, slot in (('mapThemeChanged', self._on_map_theme_changed),
+                                ('mapThemeRenamed', self._on_map_theme_changed),
+                                ('mapThemesChanged', self._on_map_themes_changed)):
+                sig = getattr(themes, sname, None)
+                if sig and hasattr(sig, 'connect'):
+                    sig.connect(slot)
+        except Exception:
+            pass
+        for obj, names in sources:
+            for sname in names:
+                try:
+                    sig = getattr(obj, sname, None)
+                    if sig and hasattr(sig, 'connect'):
+                        sig.connect(self.invalidate_render_cache)
+                except Exception:
+                    continue
+        try:
+            self._hook_layers(project.mapLayers().values())
+        except Exception:
+            pass
+
+    def _hook_layers(self, layers):
+        for layer in list(layers or []):
+            try:
+                lid = layer.id()
+                if lid in self._hooked_layer_ids:
+                    continue
+                for sname in ('rendererChanged', 'styleChanged'):
+                    sig = getattr(layer, sname, None)
+                    if sig and hasattr(sig, 'connect'):
+                        try:
+                            sig.connect(self.invalidate_render_cache)
+                        except Exception:
+                            continue
+                # data edits (provider data, edit buffer, commit/rollback, filter)
+                # only stale the GetMap images that draw this layer.
+                # repaintRequested is not used: selection, auto-refresh and
+                # temporal updates emit it without any change to the served map
+                on_data = lambda *args, lid=lid: self._on_layer_data_changed(lid)
+                for sname in ('dataChanged', 'layerModified', 'afterCommitChanges', 'afterRollBack',
+                              'subsetStringChanged'):
+                    sig = getattr(layer, sname, None)
+                    if sig and hasattr(sig, 'connect'):
+                        try:
+                            sig.connect(on_data)
+                        except Exception:
+                            continue
+                # style QML of this layer (and themes embedding it)
+                on_style = lambda *args, lid=lid: self._on_layer_style_changed(lid)
+                sources = [(layer, ('rendererChanged', 'styleChanged'))]
+                try:
+                    sources.append((layer.styleManager(),
+                                    ('styleAdded', 'styleRemoved', 'styleRenamed', 'currentStyleChanged')))
+                except Exception:
+                    pass
+                for obj, names in sources:
+                    for sname in names:
+                        sig = getattr(obj, sname, None)
+                        if sig and hasattr(sig, 'connect'):
+                            try:
+                                sig.connect(on_style)
+                            except Exception:
+                                continue
+                # GetFeatureInfo index of this layer: geometry edits and data source changes
+                on_geometry = lambda *args, lid=lid: self.feature_index.invalidate(lid)
+                for sname in ('featureAdded', 'featuresDeleted', 'geometryChanged', 'afterCommitChanges',
+                              'afterRollBack', 'subsetStringChanged', 'dataSourceChanged'):
+                    sig = getattr(layer, sname, None)
+                    if sig and hasattr(sig, 'connect'):
+                        try:
+                            sig.connect(on_geometry)
+                        except Exception:
+                            continue
+                self._hooked_layer_ids.add(lid)
+            except Exception:
+                continue
+
+    def _on_project_layers_changed(self, *args):
+        try:
+            if args and isinstance(args[0], (list, tuple)):
+                self._hook_layers(a for a in args[0] if hasattr(a, 'id'))
+                # layersRemoved passes layer ids
+                for lid in args[0]:
+                    if isinstance(lid, str):
+                        self._hooked_layer_ids.discard(lid)
+                        self.feature_index.invalidate(lid)
+            else:
+                # cleared / readProject
+                self.feature_index.invalidate()
+        except Exception:
+            pass
+        # themes hold layer objects; removed layers also leave stale styles
+        self.theme_cache.invalidate()
+        self.style_cache.invalidate()
+        self.legend_cache.invalidate()
+        self.invalidate_render_cache()
+
+    def _on_layer_style_changed(self, layer_id):
+        """Drop the cached styles of ``layer_id`` and every resolved theme."""
+        self.style_cache.invalidate(lambda key: key[0] == layer_id)
+        self.legend_cache.invalidate(lambda key: layer_id in key[0])
+        self.theme_cache.invalidate()
+
+    def _on_map_theme_changed(self, name, *args):
+        self.theme_cache.pop(name)
+
+    def _on_map_themes_changed(self, *args):
+        self.theme_cache.invalidate()
+
+    def invalidate_render_cache(self, *args):
+        """Drop cached GetMap images and settings templates (signal slot; arguments are ignored)."""
+        self._render_generation += 1
+        self.getmap_cache.invalidate()
+        self.settings_templates.invalidate()
+
+    def _on_layer_data_changed(self, layer_id):
+        """Drop the cached GetMap images whose layer set contains ``layer_id``.
+
+        Settings templates do not depend on layer data and are kept. The
+        generation still moves on so renders running across the edit are
+        not stored.
+        """
+        self._render_generation += 1
+        self.getmap_cache.invalidate_where(
+            lambda key, value: value[1] is None or layer_id in value[1])
+
+    def _layer_style_qml(self, layer, style_name=None):
+        """QML of ``layer``'s style ``style_name`` (current style when empty), or None.
+
+        Results are kept in :attr:`style_cache` until the layer's style or
+        style manager changes. A non-current named style is read from the
+        style manager (``QgsMapLayerStyle.xmlData()``); the layer itself is
+        never switched to it.
+        """
+        from qgis.core import QgsMessageLog, Qgis
+        from qgis.PyQt.QtXml import QDomDocument
+
+        key = (layer.id(), style_name or '')
+        qml = self.style_cache.get(key)
+        if qml is not None:
+            return qml
+
+        style_manager = layer.styleManager()
+        if style_name and style_name not in style_manager.styles():
+            QgsMessageLog.logMessage(f"⚠️ Style '{style_name}' not found for '{layer.name()}'", "geo_webview", Qgis.Warning)
+            return None
+        if style_name and style_name != style_manager.currentStyle():
+            # 保存済みの名前付きスタイル（現在のスタイルの内容はレイヤ側にある）
+            qml = style_manager.style(style_name).xmlData()
+            if not qml:
+                QgsMessageLog.logMessage(f"⚠️ Style '{style_name}' of '{layer.name()}' is empty", "geo_webview", Qgis.Warning)
+                return None
+        else:
+            doc = QDomDocument()
+            with render_control.live_style_read():
+                error_msg = layer.exportNamedStyle(doc)
+            if error_msg:
+                QgsMessageLog.logMessage(f"⚠️ Style export failed for '{layer.name()}': {error_msg}", "geo_webview", Qgis.Warning)
+                return None
+            qml = doc.toString()
+        self.style_cache.put(key, qml)
+        return qml
+
+    def _getmap_cache_key(self, width, height, bbox, crs, themes=None, rotation=0.0,
+                          layers_param=None, styles_param=None, labels_param=None, angle_mode=None,
+                          image_format='png'):
+        """Normalized GetMap key: parameters in a fixed order plus the project identity.
+
+        BBOX coordinates are rounded to 9 significant digits (float noise
+        from clients must not defeat the cache), the CRS is upper-cased and
+        list parameters are whitespace-trimmed. LAYERS/STYLES/LABELS keep
+        their order because it is significant (draw order, positional styles).
+        Each output format has its own entries.
+        """
+        def _csv(value):
+            if not value:
+                return ''
+            return ','.join(v.strip() for v in str(value).split(','))
+
+        try:
+            bbox_key = ','.join('%.9g' % float(v) for v in str(bbox).split(','))
+        except Exception:
+            bbox_key = str(bbox)
+        try:
+            rot_key = round(float(rotation or 0.0) % 360.0, 6)
+        except Exception:
+            rot_key = 0.0
+        return (project_state.identity_short(), int(width), int(height), bbox_key,
+                str(crs or '').strip().upper(), str(themes or '').strip(), rot_key,
+                _csv(layers_param), _csv(styles_param), _csv(labels_param),
+                (angle_mode or 'northup') if rot_key else '', image_format or 'png')
+
+    def _response_etag(self, parts, data_dependent=True):
+        """Strong ETag of a dynamic response, known before any rendering.
+
+        ``parts`` is the normalized request (e.g. the GetMap cache key). The
+        project identity covers visible layers and styles; the render
+        generation (moved by style and data changes) is added unless the
+        response does not depend on layer data (legends).
+        """
+        raw = repr((self._etag_salt, project_state.identity_short(),
+                    self._render_generation if data_dependent else None, tuple(parts)))
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:32]
+
+    def _normalize_angle_mode(self, angle_mode):
+        """'direct' or 'northup' (unknown values fall back to the configured default)."""
+        mode = str(angle_mode or '').strip().lower()
+        if mode in ('direct', 'northup'):
+            return mode
+        return self.angle_mode
 
     def _safe_int(self, value, default: int) -> int:
         """文字列から安全にintに変換する。NaNや不正値は default を返す。"""
@@ -89,9 +427,16 @@ class GeoWebViewWMSService:
             QgsMessageLog.logMessage(f"❌ Failed to get canvas extent info: {e}", "geo_webview", Qgis.Warning)
             return {}
 
-    def handle_wms_request(self, conn, params: Dict[str, list], host: Optional[str] = None) -> None:
-        """WMSエンドポイントを処理 - パーマリンクパラメータにも対応"""
+    def handle_wms_request(self, conn, http_request: HTTPRequest) -> None:
+        """WMSエンドポイントを処理 - パーマリンクパラメータにも対応
+
+        Args:
+            conn: クライアント接続
+            http_request: フロントエンドで解析済みのリクエスト（params/host を参照）
+        """
         from qgis.core import QgsMessageLog, Qgis
+        params = http_request.params
+        host = http_request.host
 
 
         # デバッグ情報
@@ -129,6 +474,12 @@ class GeoWebViewWMSService:
             self._handle_wms_get_capabilities(conn, params, host)
         elif request == 'GETMAP':
             self._handle_wms_get_map(conn, params)
+        elif request == 'GETFEATUREINFO':
+            self._handle_wms_get_feature_info(conn, params)
+        elif request == 'GETLEGENDGRAPHIC':
+            self._handle_wms_get_legend_graphic(conn, params)
+        elif request == 'GETMAPBATCH':
+            self._handle_wms_get_map_batch(conn, params)
         else:
             from . import http_server
             http_server.send_wms_error_response(conn, "InvalidRequest", f"Request {request} is not supported")
@@ -168,8 +519,11 @@ class GeoWebViewWMSService:
         except Exception:
             geo_bbox = (-180, -90, 180, 90)
 
+        getmap_formats_xml = '\n'.join(f"                <Format>{mime}</Format>" for mime in image_formats.mime_types())
+        featureinfo_formats_xml = '\n'.join(f"                <Format>{mime}</Format>" for mime in feature_info.INFO_FORMATS)
+
         xml_content = f"""<?xml version="1.0" encoding="UTF-8"?>
-<WMS_Capabilities version="1.3.0" xmlns="http://www.opengis.net/wms" xmlns:ows="http://www.opengis.net/ows" xmlns:xlink="http://www.w3.org/1999/xlink">
+<WMS_Capabilities version="1.3.0" xmlns="http://www.opengis.net/wms" xmlns:ows="http://www.opengis.net/ows" xmlns:sld="http://www.opengis.net/sld" xmlns:xlink="http://www.w3.org/1999/xlink">
     <Service>
         <Name>WMS</Name>
         <Title>QMap</Title>
@@ -188,9 +542,7 @@ class GeoWebViewWMSService:
                 </DCPType>
             </GetCapabilities>
             <GetMap>
-                <Format>image/png</Format>
-                <Format>image/jpeg</Format>
-                <Format>image/png; mode=8bit</Format>
+{getmap_formats_xml}
                 <DCPType>
                     <HTTP>
                         <Get><OnlineResource xlink:href="http://{base_host}/wms"/></Get>
@@ -198,6 +550,23 @@ class GeoWebViewWMSService:
                     </HTTP>
                 </DCPType>
             </GetMap>
+            <GetFeatureInfo>
+{featureinfo_formats_xml}
+                <DCPType>
+                    <HTTP>
+                        <Get><OnlineResource xlink:href="http://{base_host}/wms"/></Get>
+                    </HTTP>
+                </DCPType>
+            </GetFeatureInfo>
+            <sld:GetLegendGraphic>
+                <Format>image/png</Format>
+                <Format>application/json</Format>
+                <DCPType>
+                    <HTTP>
+                        <Get><OnlineResource xlink:href="http://{base_host}/wms"/></Get>
+                    </HTTP>
+                </DCPType>
+            </sld:GetLegendGraphic>
         </Request>
         <Exception>
             <Format>application/vnd.ogc.se_xml</Format>
@@ -231,7 +600,8 @@ class GeoWebViewWMSService:
                 try:
                     lname = lyr.name()
                     lid = lyr.id()
-                    xml_content += f"      <Layer>\n"
+                    queryable = ' queryable="1"' if feature_info.is_queryable(lyr) else ''
+                    xml_content += f"      <Layer{queryable}>\n"
                     xml_content += f"        <Name>{lid}</Name>\n"
                     xml_content += f"        <Title>{lname}</Title>\n"
                     # include supported CRS for each layer
@@ -248,7 +618,7 @@ class GeoWebViewWMSService:
         xml_content += "</WMS_Capabilities>"
 
         from . import http_server
-        http_server.send_http_response(conn, 200, "OK", xml_content, content_type="text/xml; charset=utf-8")
+        http_server.send_http_response(conn, 200, "OK", xml_content, content_type="text/xml; charset=utf-8", cacheable=True)
 
     def _handle_wms_get_map(self, conn, params: Dict[str, list]) -> None:
         """WMS GetMapリクエストを処理 - 実際のQGIS地図画像を生成"""
@@ -301,59 +671,27 @@ class GeoWebViewWMSService:
                     rotation = 0.0
                     QgsMessageLog.logMessage(f"⚠️ Invalid ANGLE parameter: {e}, using 0°", "geo_webview", Qgis.Warning)
 
-            # Server returns the renderer's output image. Rotation is handled by the renderer.
+            # 回転モード（拡張: ANGLE_MODE=northup|direct、既定は QMAP_ANGLE_MODE）
+            angle_mode = params.get('ANGLE_MODE', [''])[0] if params.get('ANGLE_MODE') else None
 
-            # If WMS 1.3.0 and CRS is EPSG:4326, axis order in BBOX is lat,lon (y,x)
-            # so we need to swap coordinates when parsing. For other CRSs assume BBOX
-            # is minx,miny,maxx,maxy.
-            try:
-                bbox_coords = [float(v) for v in bbox.split(',')] if bbox else []
-                if bbox_coords and wms_version and str(wms_version).startswith('1.3') and original_crs and original_crs.upper().endswith('4326') and len(bbox_coords) == 4:
-                    # incoming BBOX: miny,minx,maxy,maxx -> reorder to minx,miny,maxx,maxy
-                    bbox = f"{bbox_coords[1]},{bbox_coords[0]},{bbox_coords[3]},{bbox_coords[2]}"
-                else:
-                    # keep as-is
-                    bbox = ','.join(str(v) for v in bbox_coords) if bbox_coords else ''
-            except Exception:
-                # if parsing fails, keep original string
-                pass
-            # オプションで任意CRSを強制的にEPSG:3857として扱う
-            if self.force_epsg3857:
-                crs = 'EPSG:3857'
-            else:
-                crs = original_crs
+            # 出力形式（FORMAT: image/png・image/jpeg・image/webp。省略時は PNG）
+            format_param = params.get('FORMAT', [''])[0] if params.get('FORMAT') else ''
+            image_format = image_formats.normalize(format_param) if format_param else image_formats.DEFAULT_FORMAT
+            if image_format is None or image_format not in image_formats.available():
+                from . import http_server
+                http_server.send_wms_error_response(conn, "InvalidFormat", f"Unsupported FORMAT: {format_param}. Supported: {', '.join(image_formats.mime_types())}")
+                return
 
-            # リクエストで与えられたBBOXがある場合、必要なら元々のCRSからEPSG:3857に変換する
-            # BBOXを変換するのは force_epsg3857 が無効な場合のみ
-            if not self.force_epsg3857:
-                try:
-                    if bbox and original_crs and original_crs.upper() != 'EPSG:3857':
-                        from qgis.core import QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsProject, QgsRectangle
-                        src_crs = QgsCoordinateReferenceSystem(original_crs)
-                        tgt_crs = QgsCoordinateReferenceSystem('EPSG:3857')
-                        if src_crs.isValid():
-                            try:
-                                coords = [float(x) for x in bbox.split(',')]
-                                if len(coords) == 4:
-                                            rect = QgsRectangle(coords[0], coords[1], coords[2], coords[3])
-                                            transform = QgsCoordinateTransform(src_crs, tgt_crs, QgsProject.instance())
-                                            rect = transform.transformBoundingBox(rect)
-                                            bbox = f"{rect.xMinimum()},{rect.yMinimum()},{rect.xMaximum()},{rect.yMaximum()}"
-                                            # Ensure the CRS variable matches the transformed BBOX coordinates
-                                            crs = 'EPSG:3857'
-                            except Exception as e:
-                                QgsMessageLog.logMessage(f"⚠️ Failed to transform BBOX to EPSG:3857: {e}", "geo_webview", Qgis.Warning)
-                        else:
-                            QgsMessageLog.logMessage(f"⚠️ Invalid source CRS: {original_crs}", "geo_webview", Qgis.Warning)
-                except Exception as e:
-                    QgsMessageLog.logMessage(f"⚠️ BBOX transformation error: {e}", "geo_webview", Qgis.Warning)
+            # Server returns the renderer's output image. Rotation is handled by the renderer.
+
+            bbox, crs = self._normalize_getmap_bbox(bbox, original_crs, wms_version)
 
             # BBOXが指定されている場合、それを直接使用して画像を生成
             if bbox:
                 try:
                     coords = [float(x) for x in bbox.split(',')]
                     if len(coords) == 4:
-                        self._handle_wms_get_map_with_bbox(conn, bbox, crs, width, height, themes, rotation, layers_param, styles_param, labels_param)
+                        self._handle_wms_get_map_with_bbox(conn, bbox, crs, width, height, themes, rotation, layers_param, styles_param, labels_param, angle_mode, image_format)
                         return
                 except Exception as e:
                     QgsMessageLog.logMessage(f"⚠️ Invalid BBOX format: {bbox}, error: {e}", "geo_webview", Qgis.Warning)
@@ -370,11 +708,95 @@ class GeoWebViewWMSService:
             from . import http_server
             http_server.send_http_response(conn, 500, "Internal Server Error", f"WMS GetMap failed: {str(e)}")
 
-    def _handle_wms_get_map_with_bbox(self, conn, bbox: str, crs: str, width: int, height: int, themes: str = None, rotation: float = 0.0, layers_param: str = None, styles_param: str = None, labels_param: str = None) -> None:
+    def _normalize_getmap_bbox(self, bbox: str, original_crs: str, wms_version: str) -> Tuple[str, str]:
+        """GetMap の BBOX を minx,miny,maxx,maxy に揃え、必要なら EPSG:3857 に変換する
+
+        Returns:
+            tuple: (bbox, crs) 描画に使う BBOX 文字列と CRS
+        """
+        # If WMS 1.3.0 and CRS is EPSG:4326, axis order in BBOX is lat,lon (y,x)
+        # so we need to swap coordinates when parsing. For other CRSs assume BBOX
+        # is minx,miny,maxx,maxy.
+        try:
+            bbox_coords = [float(v) for v in bbox.split(',')] if bbox else []
+            if bbox_coords and wms_version and str(wms_version).startswith('1.3') and original_crs and original_crs.upper().endswith('4326') and len(bbox_coords) == 4:
+                # incoming BBOX: miny,minx,maxy,maxx -> reorder to minx,miny,maxx,maxy
+                bbox = f"{bbox_coords[1]},{bbox_coords[0]},{bbox_coords[3]},{bbox_coords[2]}"
+            else:
+                # keep as-is
+                bbox = ','.join(str(v) for v in bbox_coords) if bbox_coords else ''
+        except Exception:
+            # if parsing fails, keep original string
+            pass
+        # オプションで任意CRSを強制的にEPSG:3857として扱う
+        if self.force_epsg3857:
+            crs = 'EPSG:3857'
+        else:
+            crs = original_crs
+
+        # リクエストで与えられたBBOXがある場合、必要なら元々のCRSからEPSG:3857に変換する
+        # BBOXを変換するのは force_epsg3857 が無効な場合のみ
+        if not self.force_epsg3857:
+            try:
+                if bbox and original_crs and original_crs.upper() != 'EPSG:3857':
+                    from qgis.core import QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsProject, QgsRectangle
+                    src_crs = QgsCoordinateReferenceSystem(original_crs)
+                    tgt_crs = QgsCoordinateReferenceSystem('EPSG:3857')
+                    if src_crs.isValid():
+                        try:
+                            coords = [float(x) for x in bbox.split(',')]
+                            if len(coords) == 4:
+                                        rect = QgsRectangle(coords[0], coords[1], coords[2], coords[3])
+                                        transform = QgsCoordinateTransform(src_crs, tgt_crs, QgsProject.instance())
+                                        rect = transform.transformBoundingBox(rect)
+                                        bbox = f"{rect.xMinimum()},{rect.yMinimum()},{rect.xMaximum()},{rect.yMaximum()}"
+                                        # Ensure the CRS variable matches the transformed BBOX coordinates
+                                        crs = 'EPSG:3857'
+                        except Exception as e:
+                            QgsMessageLog.logMessage(f"⚠️ Failed to transform BBOX to EPSG:3857: {e}", "geo_webview", Qgis.Warning)
+                    else:
+                        QgsMessageLog.logMessage(f"⚠️ Invalid source CRS: {original_crs}", "geo_webview", Qgis.Warning)
+            except Exception as e:
+                QgsMessageLog.logMessage(f"⚠️ BBOX transformation error: {e}", "geo_webview", Qgis.Warning)
+        return bbox, crs
+
+    def _get_map_image(self, width, height, bbox, crs, themes=None, rotation=0.0, layers_param=None, styles_param=None,
+                       labels_param=None, angle_mode=None, image_format='png', watch=None):
+        """GetMap 画像（キャッシュ済みならそれを返し、同一キーの同時描画は1回にまとめる）
+
+        Args:
+            watch: 呼び出し元がもう結果を必要としないとき True を返す関数（切断検知）
+
+        Returns:
+            bytes: image_format でエンコードした画像（失敗時は None）
+        """
+        angle_mode = self._normalize_angle_mode(angle_mode)
+        render_key = self._getmap_cache_key(width, height, bbox, crs, themes, rotation,
+                                            layers_param, styles_param, labels_param, angle_mode, image_format)
+        cached = self.getmap_cache.get(render_key)
+        if cached is not None:
+            return cached[0]
+        group = single_flight.group('wms-getmap')
+
+        def _render():
+            generation = self._render_generation
+            _rendered.layer_ids = None
+            # cancelled once every client waiting for this image has disconnected
+            with render_control.cancel_scope(lambda: group.abandoned(render_key)):
+                data = self._render_map_image(width, height, bbox, crs, themes, rotation, layers_param, styles_param, labels_param, angle_mode, image_format)
+            if data and generation == self._render_generation:
+                # with the ids of the layers it draws, for per-layer invalidation
+                self.getmap_cache.put(render_key, (data, _rendered.layer_ids), size=len(data))
+            return data
+
+        return group.do(render_key, _render, watch=watch)
+
+    def _handle_wms_get_map_with_bbox(self, conn, bbox: str, crs: str, width: int, height: int, themes: str = None, rotation: float = 0.0, layers_param: str = None, styles_param: str = None, labels_param: str = None, angle_mode: str = None, image_format: str = 'png') -> None:
         """BBOX指定でWMS GetMapを処理
 
         Args:
             layers_param (str|None): カンマ区切りのレイヤID/名前（WMS LAYERS パラメータ）
+            image_format (str): 出力形式（'png' / 'jpg' / 'webp'、image_formats 参照）
         """
         from qgis.core import QgsMessageLog, Qgis
 
@@ -393,24 +815,38 @@ class GeoWebViewWMSService:
                 http_server.send_wms_error_response(conn, "InvalidParameterValue", f"Image dimensions too large. Maximum allowed: {max_dimension}x{max_dimension}")
                 return
 
-            # 独立レンダリングで画像を生成
+            # conditional GET: validators from the normalized request before any rendering
+            from . import http_server
+            content_type = image_formats.mime_type(image_format)
+            etag = self._response_etag(self._getmap_cache_key(
+                width, height, bbox, crs, themes, rotation, layers_param, styles_param, labels_param,
+                self._normalize_angle_mode(angle_mode), image_format))
+            if http_server.check_not_modified(conn, etag, cache_control='no-cache', content_type=content_type):
+                return
+
+            # 独立レンダリングで画像を生成（同一リクエストが同時に来た場合は1回だけ描画）
             try:
-                image_data = self._render_map_image(width, height, bbox, crs, themes, rotation, layers_param, styles_param, labels_param)
+                image_data = self._get_map_image(width, height, bbox, crs, themes, rotation, layers_param, styles_param,
+                                                 labels_param, angle_mode, image_format,
+                                                 watch=render_control.disconnect_watch(conn))
 
+                if not image_data and getattr(conn, 'peer_closed', False):
+                    # client is gone (render cancelled or not): nothing to send
+                    return
                 if image_data:
-                    from . import http_server
-                    # Return the renderer-produced PNG (rotation already applied by renderer)
+                    # Return the renderer-produced image (rotation already applied by renderer)
                     # Use send_binary_response so Access-Control-Allow-Origin is included for CORS
                     try:
-                        http_server.send_binary_response(conn, 200, "OK", image_data, "image/png")
+                        http_server.send_binary_response(conn, 200, "OK", image_data, content_type,
+                                                         etag=etag, cache_control='no-cache')
                     except Exception:
                         # fallback to send_http_response if binary helper is unavailable
                         try:
-                            http_server.send_http_response(conn, 200, "OK", image_data, content_type="image/png")
+                            http_server.send_http_response(conn, 200, "OK", image_data, content_type=content_type,
+                                                           etag=etag, cache_control='no-cache')
                         except Exception:
                             pass
                 else:
-                    from . import http_server
                     http_server.send_wms_error_response(conn, "InternalError", "Failed to generate map image")
 
             except Exception as e:
@@ -429,6 +865,406 @@ class GeoWebViewWMSService:
             from . import http_server
             http_server.send_http_response(conn, 500, "Internal Server Error", f"WMS GetMap processing failed: {str(e)}")
 
+    def _handle_wms_get_feature_info(self, conn, params: Dict[str, list]) -> None:
+        """WMS GetFeatureInfoリクエストを処理 - 空間インデックスでの当たり判定
+
+        I/J（1.1.1 は X/Y）のピクセルを GetMap と同様に正規化した BBOX・CRS と
+        WIDTH・HEIGHT（ANGLE_MODE=direct なら ANGLE も）から地図座標に変換し、許容ピクセル幅の検索矩形で
+        QUERY_LAYERS の各ベクタレイヤをキャッシュ済み QgsSpatialIndex から検索する。
+        """
+        from . import http_server
+
+        def _param(*names):
+            for name in names:
+                if params.get(name):
+                    return params.get(name, [''])[0]
+            return ''
+
+        try:
+            query_layers = _param('QUERY_LAYERS')
+            if not query_layers:
+                http_server.send_wms_error_response(conn, "MissingParameterValue", "QUERY_LAYERS parameter is required for GetFeatureInfo requests")
+                return
+            wms_version = _param('VERSION', 'version') or '1.3.0'
+            crs = _param('CRS', 'SRS')
+            bbox = _param('BBOX')
+            if not crs or not bbox:
+                http_server.send_wms_error_response(conn, "MissingParameterValue", "CRS/SRS and BBOX parameters are required for GetFeatureInfo requests")
+                return
+            pixel_i = _param('I', 'X')
+            pixel_j = _param('J', 'Y')
+            try:
+                i = int(float(pixel_i))
+                j = int(float(pixel_j))
+            except ValueError:
+                http_server.send_wms_error_response(conn, "InvalidPoint", "I/J (X/Y) must be integer pixel coordinates")
+                return
+            width = self._safe_int(_param('WIDTH') or '256', 256)
+            height = self._safe_int(_param('HEIGHT') or '256', 256)
+            if not (0 <= i < width and 0 <= j < height):
+                http_server.send_wms_error_response(conn, "InvalidPoint", f"Point ({i}, {j}) is outside the {width}x{height} map")
+                return
+
+            info_format = (_param('INFO_FORMAT') or 'text/html').split(';')[0].strip().lower()
+            kind = feature_info.INFO_FORMATS.get(info_format)
+            if kind is None:
+                http_server.send_wms_error_response(conn, "InvalidFormat", f"Unsupported INFO_FORMAT: {info_format}. Supported: {', '.join(feature_info.INFO_FORMATS)}")
+                return
+            feature_count = max(1, min(self.fi_max_feature_count, self._safe_int(_param('FEATURE_COUNT') or '1', 1)))
+
+            try:
+                coords = [float(v) for v in bbox.split(',')]
+            except ValueError:
+                coords = []
+            if len(coords) != 4:
+                http_server.send_wms_error_response(conn, "InvalidParameterValue", f"Invalid BBOX: {bbox}")
+                return
+            # GetMap と同じ正規化（1.3.0 + EPSG:4326 の軸順、EPSG:3857 への変換）を行い、
+            # 画像が実際に描画された範囲・CRS でピクセルを地図座標に戻す
+            bbox, crs = self._normalize_getmap_bbox(bbox, crs, wms_version)
+            coords = [float(v) for v in bbox.split(',')]
+            map_crs = QgsCoordinateReferenceSystem(crs)
+            if not map_crs.isValid():
+                http_server.send_wms_error_response(conn, "InvalidCRS", f"Invalid CRS: {crs}")
+                return
+
+            # ANGLE は direct モードでのみ画像自体が回転している（northup は北上の画像）
+            rotation = 0.0
+            if self._normalize_angle_mode(_param('ANGLE_MODE') or None) == 'direct':
+                try:
+                    rotation = float(_param('ANGLE') or 0.0)
+                except ValueError:
+                    rotation = 0.0
+
+            tolerances = dict(self.fi_tolerance_px)
+            common = _param('TOLERANCE')
+            for kind_id, name in ((0, 'FI_POINT_TOLERANCE'), (1, 'FI_LINE_TOLERANCE'), (2, 'FI_POLYGON_TOLERANCE')):
+                value = _param(name) or common
+                if value:
+                    try:
+                        tolerances[kind_id] = max(0.0, float(value))
+                    except ValueError:
+                        pass
+
+            project = QgsProject.instance()
+            layers = []
+            for name in (s.strip() for s in query_layers.split(',') if s.strip()):
+                lyr = project.mapLayer(name)
+                if lyr is None:
+                    candidates = project.mapLayersByName(name)
+                    lyr = candidates[0] if candidates else None
+                if lyr is None:
+                    http_server.send_wms_error_response(conn, "LayerNotDefined", f"Layer not found: {name}")
+                    return
+                if not feature_info.is_queryable(lyr):
+                    http_server.send_wms_error_response(conn, "LayerNotQueryable", f"Layer is not queryable: {name}")
+                    return
+                layers.append(lyr)
+
+            etag = self._response_etag(('featureinfo', tuple(lyr.id() for lyr in layers), bbox, crs.upper(),
+                                        width, height, i, j, rotation, kind, feature_count,
+                                        tuple(sorted(tolerances.items()))))
+            if http_server.check_not_modified(conn, etag, cache_control='no-cache',
+                                              content_type=feature_info.CONTENT_TYPES[kind]):
+                return
+
+            point, mupp = feature_info.pixel_to_map(QgsRectangle(*coords), width, height, i, j, rotation)
+            results = []
+            for lyr in layers:
+                features = feature_info.identify(lyr, point, map_crs, mupp, tolerances, feature_count, self.feature_index)
+                results.append((lyr, features))
+
+            body = feature_info.render(kind, results)
+            http_server.send_http_response(conn, 200, "OK", body, content_type=feature_info.CONTENT_TYPES[kind],
+                                           etag=etag, cache_control='no-cache')
+
+        except Exception as e:
+            import traceback
+            QgsMessageLog.logMessage(f"❌ WMS GetFeatureInfo error: {e}", "geo_webview", Qgis.Critical)
+            QgsMessageLog.logMessage(f"❌ Error traceback: {traceback.format_exc()}", "geo_webview", Qgis.Critical)
+            http_server.send_wms_error_response(conn, "InternalError", f"GetFeatureInfo failed: {str(e)}")
+
+    def _legend_key(self, layer, style_name, symbol_width, symbol_height):
+        """``(key, qml)`` of the legend atlas of ``layer`` in style ``style_name`` ('' = current).
+
+        The key holds the style identity (QML digest), so it also serves as
+        the legend's validator. ``(None, None)`` when the style does not exist.
+        """
+        qml = self._layer_style_qml(layer, style_name or None)
+        if qml is None:
+            return None, None
+        return ((layer.id(),), style_name or '', legend.style_identity(qml), symbol_width, symbol_height), qml
+
+    def _legend_atlas(self, layer, key, qml):
+        """Cached ``legend.LegendAtlas`` for an atlas ``key`` from :meth:`_legend_key`."""
+        atlas = self.legend_cache.get(key)
+        if atlas is None:
+            def _build():
+                built = legend.build_atlas(layer, qml, key[3], key[4])
+                self.legend_cache.put(key, built, size=built.nbytes())
+                return built
+            atlas = single_flight.group('wms-legend').do(key, _build)
+        return atlas
+
+    def _handle_wms_get_legend_graphic(self, conn, params: Dict[str, list]) -> None:
+        """WMS GetLegendGraphicリクエストを処理 - スタイル単位でキャッシュしたシンボルアトラスから凡例を返す
+
+        LAYER（または LAYERS のカンマ区切り）と STYLE/STYLES、FORMAT
+        （image/png・application/json）、SYMBOLWIDTH/SYMBOLHEIGHT（px）、TRANSPARENT。
+        """
+        from . import http_server
+
+        def _param(*names):
+            for name in names:
+                if params.get(name):
+                    return params.get(name, [''])[0]
+            return ''
+
+        try:
+            layer_names = [s.strip() for s in _param('LAYER', 'LAYERS').split(',') if s.strip()]
+            if not layer_names:
+                http_server.send_wms_error_response(conn, "MissingParameterValue", "LAYER parameter is required for GetLegendGraphic requests")
+                return
+            style_names = [s.strip() for s in _param('STYLE', 'STYLES').split(',')]
+            fmt = (_param('FORMAT') or 'image/png').split(';')[0].strip().lower()
+            if fmt not in ('image/png', 'application/json'):
+                http_server.send_wms_error_response(conn, "InvalidFormat", f"Unsupported FORMAT: {fmt}. Supported: image/png, application/json")
+                return
+            symbol_width = max(4, min(256, self._safe_int(_param('SYMBOLWIDTH') or '20', 20)))
+            symbol_height = max(4, min(256, self._safe_int(_param('SYMBOLHEIGHT') or '20', 20)))
+            transparent = _param('TRANSPARENT').upper() == 'TRUE'
+
+            project = QgsProject.instance()
+            layers, keys, qmls = [], [], []
+            for idx, name in enumerate(layer_names):
+                lyr = project.mapLayer(name)
+                if lyr is None:
+                    candidates = project.mapLayersByName(name)
+                    lyr = candidates[0] if candidates else None
+                if lyr is None or not lyr.isValid():
+                    http_server.send_wms_error_response(conn, "LayerNotDefined", f"Layer not found: {name}")
+                    return
+                style_name = style_names[idx] if idx < len(style_names) else ''
+                if style_name.lower() == 'default':
+                    style_name = ''
+                key, qml = self._legend_key(lyr, style_name, symbol_width, symbol_height)
+                if key is None:
+                    http_server.send_wms_error_response(conn, "StyleNotDefined", f"Style '{style_name}' not found for layer {name}")
+                    return
+                layers.append(lyr)
+                keys.append(key)
+                qmls.append(qml)
+
+            # the atlas keys carry the style identities: 304 before building anything
+            content_type = "application/json; charset=utf-8" if fmt == 'application/json' else "image/png"
+            etag = self._response_etag(('legend', fmt, transparent, tuple(keys), tuple(lyr.name() for lyr in layers)),
+                                       data_dependent=False)
+            if http_server.check_not_modified(conn, etag, cache_control='no-cache', content_type=content_type):
+                return
+            atlases = [self._legend_atlas(lyr, key, qml) for lyr, key, qml in zip(layers, keys, qmls)]
+
+            if fmt == 'application/json':
+                http_server.send_http_response(conn, 200, "OK", legend.to_json(atlases, layers),
+                                               content_type=content_type, etag=etag, cache_control='no-cache')
+                return
+
+            composed_key = (tuple(lyr.id() for lyr in layers), 'composed', tuple(keys), transparent)
+            png = self.legend_cache.get(composed_key)
+            if png is None:
+                png = image_formats.encode(legend.compose(atlases, transparent), 'png')
+                if not png:
+                    http_server.send_wms_error_response(conn, "InternalError", "Failed to encode legend image")
+                    return
+                self.legend_cache.put(composed_key, png)
+            http_server.send_binary_response(conn, 200, "OK", png, content_type, etag=etag, cache_control='no-cache')
+
+        except Exception as e:
+            import traceback
+            QgsMessageLog.logMessage(f"❌ WMS GetLegendGraphic error: {e}", "geo_webview", Qgis.Critical)
+            QgsMessageLog.logMessage(f"❌ Error traceback: {traceback.format_exc()}", "geo_webview", Qgis.Critical)
+            http_server.send_wms_error_response(conn, "InternalError", f"GetLegendGraphic failed: {str(e)}")
+
+    def _parse_batch_items(self, params: Dict[str, list], width: int, height: int, rotation: float):
+        """GetMapBatch の BBOX 群を解析（BBOX の繰り返し、または ';' 区切り）
+
+        各項目は ``minx,miny,maxx,maxy[,width,height[,angle]]``。省略した値は
+        共通の WIDTH/HEIGHT/ANGLE を使う。解析できない項目は error 付きで返す。
+        """
+        raw = []
+        for value in params.get('BBOX', []):
+            raw.extend(v.strip() for v in value.split(';') if v.strip())
+        items = []
+        for index, text in enumerate(raw[:max(1, self.batch_max_items)]):
+            item = {'index': index, 'bbox': text, 'width': width, 'height': height, 'angle': rotation, 'error': None}
+            try:
+                values = [float(v) for v in text.split(',')]
+                if len(values) not in (4, 6, 7):
+                    raise ValueError('expected minx,miny,maxx,maxy[,width,height[,angle]]')
+                item['bbox'] = ','.join(repr(v) for v in values[:4])
+                if len(values) >= 6:
+                    item['width'], item['height'] = int(values[4]), int(values[5])
+                if len(values) == 7:
+                    item['angle'] = values[6]
+                if values[2] <= values[0] or values[3] <= values[1]:
+                    raise ValueError('empty extent')
+                if not (0 < item['width'] <= self.max_image_dimension and 0 < item['height'] <= self.max_image_dimension):
+                    raise ValueError(f"image size must be within 1..{self.max_image_dimension}")
+            except ValueError as e:
+                item['error'] = str(e)
+            items.append(item)
+        return items, len(raw)
+
+    def _handle_wms_get_map_batch(self, conn, params: Dict[str, list]) -> None:
+        """WMS GetMapBatchリクエストを処理 - 同じ地図状態の複数範囲を1リクエストで返す
+
+        GetMap と同じ共通パラメータ（CRS・LAYERS・STYLES・LABELS・theme・FORMAT・
+        WIDTH/HEIGHT・ANGLE/ANGLE_MODE）に複数の BBOX を付けて送る。マップ設定の
+        テンプレートは一度だけ構築して全範囲で共有し、各範囲は描画スロットの予算内で
+        並列に描画して、でき上がった順に multipart/mixed（既定）または
+        PACKAGE=zip で ZIP としてストリーミングする。1件の失敗はその項目のエラー
+        パートになるだけでバッチ全体は失敗しない。最後に manifest（JSON）を付ける。
+        """
+        from . import http_server
+
+        def _param(*names):
+            for name in names:
+                if params.get(name):
+                    return params.get(name, [''])[0]
+            return ''
+
+        response = None
+        try:
+            original_crs = _param('CRS', 'SRS')
+            if not original_crs:
+                http_server.send_wms_error_response(conn, "MissingParameterValue", "CRS/SRS parameter is required for GetMapBatch requests")
+                return
+            wms_version = _param('VERSION', 'version') or '1.3.0'
+            width = self._safe_int(_param('WIDTH') or '256', 256)
+            height = self._safe_int(_param('HEIGHT') or '256', 256)
+            try:
+                rotation = float(_param('ANGLE') or 0.0)
+            except ValueError:
+                rotation = 0.0
+            angle_mode = _param('ANGLE_MODE') or None
+            themes = _param('theme') or None
+            layers_param = _param('LAYERS') or None
+            styles_param = _param('STYLES') or None
+            labels_param = _param('LABELS') or None
+            format_param = _param('FORMAT')
+            image_format = image_formats.normalize(format_param) if format_param else image_formats.DEFAULT_FORMAT
+            if image_format is None or image_format not in image_formats.available():
+                http_server.send_wms_error_response(conn, "InvalidFormat", f"Unsupported FORMAT: {format_param}. Supported: {', '.join(image_formats.mime_types())}")
+                return
+            package = (_param('PACKAGE') or 'multipart').strip().lower()
+            if package not in ('multipart', 'zip'):
+                http_server.send_wms_error_response(conn, "InvalidParameterValue", "PACKAGE must be multipart or zip")
+                return
+
+            items, requested = self._parse_batch_items(params, width, height, rotation)
+            if not items:
+                http_server.send_wms_error_response(conn, "MissingParameterValue", "At least one BBOX is required for GetMapBatch requests")
+                return
+            if requested > len(items):
+                http_server.send_wms_error_response(conn, "InvalidParameterValue", f"Too many extents: {requested} (maximum {self.batch_max_items})")
+                return
+            # 全項目で共通の描画 CRS（GetMap の正規化の結果は常に EPSG:3857）に揃える。
+            # 変換できなかった範囲はその項目のエラーとし、別の CRS では描画しない
+            crs = 'EPSG:3857'
+            if not self.force_epsg3857 and original_crs.upper() != crs \
+                    and not QgsCoordinateReferenceSystem(original_crs).isValid():
+                http_server.send_wms_error_response(conn, "InvalidCRS", f"Invalid CRS: {original_crs}")
+                return
+            for item in items:
+                if item['error'] is None:
+                    item['bbox'], item_crs = self._normalize_getmap_bbox(item['bbox'], original_crs, wms_version)
+                    if item_crs != crs:
+                        item['error'] = f"Failed to transform BBOX to {crs}"
+
+            # one map-settings build for the whole batch: every item clones this template
+            try:
+                self._create_map_settings_from_canvas(width, height, crs, themes, layer_ids=layers_param,
+                                                      styles_param=styles_param, labels_param=labels_param)
+            except Exception as e:
+                QgsMessageLog.logMessage(f"⚠️ GetMapBatch settings template build failed: {e}", "geo_webview", Qgis.Warning)
+
+            watch = render_control.disconnect_watch(conn)
+            mime = image_formats.mime_type(image_format)
+            extension = 'png' if image_format == 'png8' else image_format
+
+            # the shared pool threads get this request's priority and PNG level
+            @_in_request_context
+            def _render(item):
+                return self._get_map_image(item['width'], item['height'], item['bbox'], crs, themes, item['angle'],
+                                           layers_param, styles_param, labels_param, angle_mode, image_format,
+                                           watch=watch)
+
+            boundary = f"qmap-batch-{os.urandom(8).hex()}"
+            if package == 'zip':
+                content_type = 'application/zip'
+                extra = ['Content-Disposition: attachment; filename="getmap-batch.zip"']
+            else:
+                content_type = f'multipart/mixed; boundary="{boundary}"'
+                extra = []
+            response = http_server.StreamingResponse(conn, 200, "OK", content_type, extra)
+            writer = _BatchWriter(response, package, boundary)
+
+            manifest = []
+
+            def _emit(item, data, error):
+                entry = {k: item[k] for k in ('index', 'bbox', 'width', 'height', 'angle')}
+                if data:
+                    entry.update(status='ok', file=f"{item['index']:04d}.{extension}", bytes=len(data))
+                    writer.part(entry['file'], mime, data, item['index'], 'ok')
+                else:
+                    entry.update(status='error', error=error or 'Failed to generate map image',
+                                 file=f"{item['index']:04d}.error.json")
+                    writer.part(entry['file'], 'application/json; charset=utf-8',
+                                json.dumps(entry, ensure_ascii=False).encode('utf-8'), item['index'], 'error')
+                manifest.append(entry)
+
+            valid = [item for item in items if item['error'] is None]
+            for item in items:
+                if item['error'] is not None:
+                    _emit(item, None, item['error'])
+            pool = _batch_executor()
+            futures = {pool.submit(_render, item): item for item in valid}
+            for future in concurrent.futures.as_completed(futures):
+                item = futures[future]
+                if future.cancelled():
+                    continue
+                try:
+                    data, error = future.result(), None
+                except Exception as e:
+                    data, error = None, str(e)
+                if getattr(conn, 'peer_closed', False):
+                    # client gone: drop the items that have not started yet
+                    for pending in futures:
+                        pending.cancel()
+                    continue
+                _emit(item, data, error)
+
+            if getattr(conn, 'peer_closed', False):
+                return
+            manifest.sort(key=lambda e: e['index'])
+            summary = {'items': manifest, 'ok': sum(1 for e in manifest if e['status'] == 'ok'),
+                       'failed': sum(1 for e in manifest if e['status'] != 'ok'), 'crs': crs}
+            writer.part('manifest.json', 'application/json; charset=utf-8',
+                        json.dumps(summary, ensure_ascii=False).encode('utf-8'), None, 'manifest')
+            writer.close()
+
+        except Exception as e:
+            import traceback
+            QgsMessageLog.logMessage(f"❌ WMS GetMapBatch error: {e}", "geo_webview", Qgis.Critical)
+            QgsMessageLog.logMessage(f"❌ Error traceback: {traceback.format_exc()}", "geo_webview", Qgis.Critical)
+            if response is not None:
+                # head already sent: the body cannot turn into an error response
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            else:
+                http_server.send_wms_error_response(conn, "InternalError", f"GetMapBatch failed: {str(e)}")
+
     def _handle_permalink_as_wms_getmap(self, conn, params: Dict[str, list]) -> None:
         """パーマリンクパラメータをWMS GetMapパラメータに変換して処理"""
         from qgis.core import QgsMessageLog, Qgis
@@ -482,7 +1318,7 @@ class GeoWebViewWMSService:
             from . import http_server
             http_server.send_http_response(conn, 500, "Internal Server Error", f"Permalink processing failed: {str(e)}")
 
-    def _render_map_image(self, width, height, bbox, crs, themes=None, rotation=0.0, layers_param: str = None, styles_param: str = None, labels_param: str = None):
+    def _render_map_image(self, width, height, bbox, crs, themes=None, rotation=0.0, layers_param: str = None, styles_param: str = None, labels_param: str = None, angle_mode: str = None, image_format: str = 'png'):
         """
         完全独立マップレンダリング
 
@@ -492,9 +1328,12 @@ class GeoWebViewWMSService:
             bbox (str): "minx,miny,maxx,maxy" 形式の範囲
             crs (str): 座標系（例: "EPSG:4326"）
             rotation (float): 回転角度（度）、デフォルト0.0
+            angle_mode (str): 'northup'（既定: north-up 画像を返す）または
+                'direct'（回転した地図を要求サイズで直接描画）
+            image_format (str): 出力形式（'png' / 'jpg' / 'webp'）
 
         Returns:
-            bytes: PNG画像データ（失敗時はNone）
+            bytes: image_format でエンコードした画像データ（失敗時はNone）
         """
         try:
             from qgis.core import QgsMessageLog, Qgis, QgsProject
@@ -505,14 +1344,9 @@ class GeoWebViewWMSService:
             )
 
             # 1. 現在のキャンバスのマップ設定をベースにする
-            map_settings = self._create_map_settings_from_canvas(width, height, crs, themes, layer_ids=layers_param, styles_param=styles_param)
-
-            # Apply temporary labeling if LABELS param provided. We will restore originals after rendering.
-            original_labeling_map = {}
-            try:
-                original_labeling_map = self._apply_temporary_labeling(map_settings, labels_param)
-            except Exception:
-                original_labeling_map = {}
+            # LABELS is applied as per-request style overrides (live layers are not touched)
+            map_settings = self._create_map_settings_from_canvas(width, height, crs, themes, layer_ids=layers_param,
+                                                                 styles_param=styles_param, labels_param=labels_param)
 
             # 2. BBOXから表示範囲を設定
             # Require an explicit BBOX for independent rendering. Do not silently
@@ -563,7 +1397,7 @@ class GeoWebViewWMSService:
                         if not image or image.isNull():
                             QgsMessageLog.logMessage("❌ WMS rendering produced no image (fast path)", "geo_webview", Qgis.Warning)
                             return None
-                        png_data = self._save_image_as_png(image)
+                        png_data = self._encode_image(image, image_format)
                         if png_data:
                             return png_data
                         QgsMessageLog.logMessage("❌ WMS rendering failed (fast path, png conversion)", "geo_webview", Qgis.Warning)
@@ -573,6 +1407,27 @@ class GeoWebViewWMSService:
                         QgsMessageLog.logMessage(f"❌ Fast-path rendering error: {e}", "geo_webview", Qgis.Critical)
                         return None
 
+                # ANGLE_MODE=direct: render the rotated map straight at the requested
+                # size. setRotation turns the map around the bbox center at the bbox'
+                # map-units-per-pixel, so every output pixel covers the same ground
+                # as the north-up output rotated by ANGLE; no enlarged render and
+                # no image-space rotation.
+                if angle_mode == 'direct' and hasattr(map_settings, 'setRotation'):
+                    try:
+                        map_settings.setExtent(extent)
+                        map_settings.setOutputSize(QSize(width, height))
+                        map_settings.setOutputDpi(96)
+                        map_settings.setRotation(float(rotation))
+
+                        image = self._execute_parallel_rendering(map_settings)
+                        if not image or image.isNull():
+                            QgsMessageLog.logMessage("❌ WMS rendering produced no image (direct rotation)", "geo_webview", Qgis.Warning)
+                            return None
+                        return self._encode_image(image, image_format)
+                    except Exception as e:
+                        QgsMessageLog.logMessage(f"❌ Direct rotation rendering error: {e}", "geo_webview", Qgis.Critical)
+                        return None
+
                 def _rot(px, py, cx, cy, a):
                     dx = px - cx
                     dy = py - cy
@@ -628,7 +1483,6 @@ class GeoWebViewWMSService:
                     render_h = max_dimension
 
                 # configure map_settings for expanded extent and rotation
-                from qgis.PyQt.QtCore import Qt
                 map_settings.setExtent(self._parse_bbox_to_extent(f"{bminx},{bminy},{bmaxx},{bmaxy}", crs))
                 map_settings.setOutputSize(QSize(render_w, render_h))
                 map_settings.setOutputDpi(96)
@@ -641,106 +1495,20 @@ class GeoWebViewWMSService:
                     QgsMessageLog.logMessage("❌ Rotated rendering produced no image", "geo_webview", Qgis.Warning)
                     return None
 
-                # Instead of attempting to map rotated coords to pixels (which is fragile
-                # when renderer applies rotation), perform an image-space inverse rotation
-                # then center-crop the region corresponding to the original bbox and resample.
+                # Inverse-rotate the render back to north-up and take the center
+                # region of the original bbox. The rotated image is painted straight
+                # into the requested size instead of materializing the whole
+                # rotated intermediate and cropping it (same pixels, less memory).
                 try:
-                    from qgis.PyQt.QtGui import QTransform
-
-                    # rotate whole image by -rotation to make content north-up
-                    inv_transform = QTransform()
-                    # rotate around image center
-                    img_w0 = big_image.width()
-                    img_h0 = big_image.height()
-                    cx_img = img_w0 / 2.0
-                    cy_img = img_h0 / 2.0
-                    # translate to center, rotate, translate back
-                    try:
-                        inv_transform.translate(cx_img, cy_img)
-                        inv_transform.rotate(-float(rotation))
-                        inv_transform.translate(-cx_img, -cy_img)
-                    except Exception:
-                        # fallback: simple rotate
-                        inv_transform = QTransform()
-                        inv_transform.rotate(-float(rotation))
-                    try:
-                        # Normalize rotation to [0,360)
-                        try:
-                            deg_norm = (float(rotation) % 360 + 360) % 360
-                        except Exception:
-                            deg_norm = float(rotation)
-
-                        # Fast paths for 90-degree multiples
-                        if abs(deg_norm - 180.0) < 1e-6:
-                            # 180° rotation can be executed as a mirror in both axes
-                            try:
-                                big_rotated = big_image.mirrored(True, True)
-                            except Exception:
-                                # fallback to general transform
-                                big_rotated = big_image.transformed(inv_transform, Qt.SmoothTransformation)
-                        elif abs(deg_norm - 90.0) < 1e-6 or abs(deg_norm - 270.0) < 1e-6:
-                            # 90/270 can use a transform but prefer FastTransformation for performance
-                            try:
-                                big_rotated = big_image.transformed(inv_transform, Qt.FastTransformation)
-                            except Exception:
-                                try:
-                                    big_rotated = big_image.transformed(inv_transform, Qt.SmoothTransformation)
-                                except Exception:
-                                    big_rotated = big_image.transformed(inv_transform)
-                        else:
-                            # general arbitrary-angle inverse rotation (slower, high-quality)
-                            try:
-                                big_rotated = big_image.transformed(inv_transform, Qt.SmoothTransformation)
-                            except Exception:
-                                big_rotated = big_image.transformed(inv_transform)
-                    except Exception:
-                        # final fallback: try general transform without explicit quality flag
-                        try:
-                            big_rotated = big_image.transformed(inv_transform)
-                        except Exception:
-                            big_rotated = big_image
-
-                    # compute pixel-per-map-unit in the original big image
-                    pixels_per_map_x = float(render_w) / float(bw)
-                    pixels_per_map_y = float(render_h) / float(bh)
-
-                    # compute crop size in pixels corresponding to original bbox A
-                    # 要求サイズに正確に一致させる（丸め誤差を最小化）
-                    crop_w_px = width
-                    crop_h_px = height
-
-                    # center-crop around image center (map center corresponds to image center)
-                    img_w = big_rotated.width()
-                    img_h = big_rotated.height()
-                    cx_px = int(img_w // 2)
-                    cy_px = int(img_h // 2)
-
-                    px_min = int(cx_px - (crop_w_px // 2))
-                    py_min = int(cy_px - (crop_h_px // 2))
-
-                    # clamp
-                    if px_min < 0:
-                        px_min = 0
-                    if py_min < 0:
-                        py_min = 0
-                    if px_min + crop_w_px > img_w:
-                        crop_w_px = img_w - px_min
-                    if py_min + crop_h_px > img_h:
-                        crop_h_px = img_h - py_min
-
-                    cropped = big_rotated.copy(px_min, py_min, crop_w_px, crop_h_px)
-
-                    # 拡大縮小を避けるため、クロップサイズが要求サイズと一致するようにレンダリングサイズを調整済み
-                    # もしサイズが若干異なる場合のみ、高品質でリサイズ
-                    if cropped.width() != width or cropped.height() != height:
-                        try:
-                            scaled = cropped.scaled(width, height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
-                        except Exception:
-                            scaled = cropped.scaled(width, height)
-                        png_data = self._save_image_as_png(scaled)
-                    else:
-                        # サイズが一致する場合はそのまま使用（画質劣化なし）
-                        png_data = self._save_image_as_png(cropped)
+                    deg_norm = (float(rotation) % 360 + 360) % 360
+                    north_up = None
+                    if abs(deg_norm - 180.0) >= 1e-6:
+                        quarter = min(abs(deg_norm - 90.0), abs(deg_norm - 270.0)) < 1e-6
+                        north_up = inverse_rotate_crop(big_image, rotation, width, height, smooth=not quarter)
+                    if north_up is None:
+                        north_up = self._inverse_rotate_crop_legacy(big_image, rotation, width, height)
+                    big_image = None
+                    png_data = self._encode_image(north_up, image_format)
                 except Exception as e:
                     QgsMessageLog.logMessage(f"❌ Rotated image post-processing failed: {e}", "geo_webview", Qgis.Warning)
                     return None
@@ -762,16 +1530,104 @@ class GeoWebViewWMSService:
             QgsMessageLog.logMessage(f"❌ WMS rendering error: {e}", "geo_webview", Qgis.Critical)
             QgsMessageLog.logMessage(f"❌ Error traceback: {traceback.format_exc()}", "geo_webview", Qgis.Critical)
             return None
-        finally:
-            # restore any temporary labeling we applied
+
+    def _inverse_rotate_crop_legacy(self, big_image, rotation, width, height):
+        """Inverse-rotate the whole enlarged render, then center-crop/resample.
+
+        Fallback of :func:`inverse_rotate_crop` (180°, or when the crop does
+        not fit because the enlarged render was clamped).
+        """
+        from qgis.PyQt.QtCore import Qt
+        from qgis.PyQt.QtGui import QTransform
+
+        # rotate whole image by -rotation to make content north-up
+        inv_transform = QTransform()
+        # rotate around image center
+        img_w0 = big_image.width()
+        img_h0 = big_image.height()
+        cx_img = img_w0 / 2.0
+        cy_img = img_h0 / 2.0
+        # translate to center, rotate, translate back
+        try:
+            inv_transform.translate(cx_img, cy_img)
+            inv_transform.rotate(-float(rotation))
+            inv_transform.translate(-cx_img, -cy_img)
+        except Exception:
+            # fallback: simple rotate
+            inv_transform = QTransform()
+            inv_transform.rotate(-float(rotation))
+        try:
+            # Normalize rotation to [0,360)
             try:
-                if 'original_labeling_map' in locals() and original_labeling_map:
+                deg_norm = (float(rotation) % 360 + 360) % 360
+            except Exception:
+                deg_norm = float(rotation)
+
+            # Fast paths for 90-degree multiples
+            if abs(deg_norm - 180.0) < 1e-6:
+                # 180° rotation can be executed as a mirror in both axes
+                try:
+                    big_rotated = big_image.mirrored(True, True)
+                except Exception:
+                    # fallback to general transform
+                    big_rotated = big_image.transformed(inv_transform, Qt.SmoothTransformation)
+            elif abs(deg_norm - 90.0) < 1e-6 or abs(deg_norm - 270.0) < 1e-6:
+                # 90/270 can use a transform but prefer FastTransformation for performance
+                try:
+                    big_rotated = big_image.transformed(inv_transform, Qt.FastTransformation)
+                except Exception:
                     try:
-                        self._restore_labeling(original_labeling_map)
+                        big_rotated = big_image.transformed(inv_transform, Qt.SmoothTransformation)
                     except Exception:
-                        pass
+                        big_rotated = big_image.transformed(inv_transform)
+            else:
+                # general arbitrary-angle inverse rotation (slower, high-quality)
+                try:
+                    big_rotated = big_image.transformed(inv_transform, Qt.SmoothTransformation)
+                except Exception:
+                    big_rotated = big_image.transformed(inv_transform)
+        except Exception:
+            # final fallback: try general transform without explicit quality flag
+            try:
+                big_rotated = big_image.transformed(inv_transform)
             except Exception:
-                pass
+                big_rotated = big_image
+
+        # compute crop size in pixels corresponding to original bbox A
+        # 要求サイズに正確に一致させる（丸め誤差を最小化）
+        crop_w_px = width
+        crop_h_px = height
+
+        # center-crop around image center (map center corresponds to image center)
+        img_w = big_rotated.width()
+        img_h = big_rotated.height()
+        cx_px = int(img_w // 2)
+        cy_px = int(img_h // 2)
+
+        px_min = int(cx_px - (crop_w_px // 2))
+        py_min = int(cy_px - (crop_h_px // 2))
+
+        # clamp
+        if px_min < 0:
+            px_min = 0
+        if py_min < 0:
+            py_min = 0
+        if px_min + crop_w_px > img_w:
+            crop_w_px = img_w - px_min
+        if py_min + crop_h_px > img_h:
+            crop_h_px = img_h - py_min
+
+        cropped = big_rotated.copy(px_min, py_min, crop_w_px, crop_h_px)
+
+        # 拡大縮小を避けるため、クロップサイズが要求サイズと一致するようにレンダリングサイズを調整済み
+        # もしサイズが若干異なる場合のみ、高品質でリサイズ
+        if cropped.width() != width or cropped.height() != height:
+            try:
+                return cropped.scaled(width, height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+            except Exception:
+                return cropped.scaled(width, height)
+        # サイズが一致する場合はそのまま使用（画質劣化なし）
+        return cropped
 
     def _apply_label_rotation_correction(self, map_settings, rotation):
         """地図回転時の文字回転補正を適用
@@ -916,85 +1772,115 @@ class GeoWebViewWMSService:
 
         return original_labelings
 
-    def _apply_temporary_labeling(self, map_settings, labels_param: str = None):
-        """LABELS パラメータに基づき、レンダリング前に一時的にラベルを設定して有効化する
-
-        戻り値: {layer: (original_labeling, original_enabled)} の辞書
-        """
-        originals = {}
-        try:
-            if not labels_param:
-                return originals
+    def _apply_labeling_overrides(self, map_settings, labels_param: str = None):
+        """LABELS パラメータのラベル設定を map_settings のスタイルオーバーライドとして追加する
 
-            from qgis.core import QgsMessageLog, Qgis, QgsVectorLayer, QgsPalLayerSettings, QgsVectorLayerSimpleLabeling
+        LAYERS に対応する順でフィールド名を受け取り、各ベクタレイヤのスタイル
+        （STYLES/テーマで既にオーバーライドがあればそれ、なければ現在のスタイル）の
+        <labeling> を単純ラベル（指定フィールド）に差し替えて labelsEnabled=1 にした QML を、
+        layerStyleOverrides としてこの map_settings だけに設定する。
+        プロジェクトのレイヤ自体は変更しないため、並行する描画にラベル設定が漏れない。
 
-            fields = [s.strip() for s in str(labels_param).split(',')]
-            layers = map_settings.layers()
-            for idx, layer in enumerate(layers):
-                try:
-                    if not isinstance(layer, QgsVectorLayer):
-                        continue
+        戻り値: オーバーライドを設定したレイヤ数
+        """
+        if not labels_param:
+            return 0
+        from qgis.core import (
+            QgsMessageLog, Qgis, QgsVectorLayer, QgsPalLayerSettings,
+            QgsVectorLayerSimpleLabeling, QgsReadWriteContext
+        )
+        from qgis.PyQt.QtXml import QDomDocument
 
-                    field = fields[idx] if idx < len(fields) else None
-                    if not field:
-                        continue
+        fields = [s.strip() for s in str(labels_param).split(',')]
+        try:
+            overrides = dict(map_settings.layerStyleOverrides() or {})
+        except Exception:
+            overrides = {}
+        applied = 0
+        for idx, layer in enumerate(map_settings.layers()):
+            field = fields[idx] if idx < len(fields) else None
+            if not field or not isinstance(layer, QgsVectorLayer):
+                continue
+            try:
+                doc = QDomDocument()
+                base_qml = overrides.get(layer.id())
+                if base_qml:
+                    doc.setContent(base_qml)
+                else:
+                    with render_control.live_style_read():
+                        error_msg = layer.exportNamedStyle(doc)
+                    if error_msg:
+                        raise RuntimeError(error_msg)
+                root = doc.documentElement()
+
+                pal = QgsPalLayerSettings()
+                pal.enabled = True
+                pal.fieldName = field
+                labeling = QgsVectorLayerSimpleLabeling(pal).save(doc, QgsReadWriteContext())
+                previous = root.firstChildElement('labeling')
+                if previous.isNull():
+                    root.appendChild(labeling)
+                else:
+                    root.replaceChild(labeling, previous)
+                root.setAttribute('labelsEnabled', '1')
 
-                    orig_labeling = None
-                    orig_enabled = False
-                    try:
-                        orig_labeling = layer.labeling()
-                    except Exception:
-                        orig_labeling = None
-                    try:
-                        orig_enabled = bool(layer.labelsEnabled())
-                    except Exception:
-                        orig_enabled = False
+                overrides[layer.id()] = doc.toString()
+                applied += 1
+                QgsMessageLog.logMessage(f"🔤 Labels for '{layer.name()}' using field '{field}' (style override)", "geo_webview", Qgis.Info)
+            except Exception as e:
+                QgsMessageLog.logMessage(f"⚠️ Failed to build labeling override for layer '{layer.name()}': {e}", "geo_webview", Qgis.Warning)
+        if applied:
+            map_settings.setLayerStyleOverrides(overrides)
+        return applied
 
-                    originals[layer] = (orig_labeling, orig_enabled)
+    def _create_map_settings_from_canvas(self, width, height, crs, themes=None, layer_ids: str = None, styles_param: str = None,
+                                         labels_param: str = None):
+        """完全に独立した仮想マップビューのマップ設定を返す
 
-                    # create simple labeling using field
-                    pal = QgsPalLayerSettings()
-                    pal.enabled = True
-                    pal.fieldName = field
-                    # create simple labeling object
-                    labeling = QgsVectorLayerSimpleLabeling(pal)
-                    layer.setLabeling(labeling)
-                    layer.setLabelsEnabled(True)
+        レイヤ構成・テーマ・スタイル指定・ラベル指定・CRS ごとに構築済みの
+        テンプレートを複製し、出力サイズだけをリクエストごとに設定する。
+        """
+        key = ('canvas', str(crs or '').strip().upper(), str(themes or ''), str(layer_ids or ''), str(styles_param or ''),
+               str(labels_param or ''))
 
-                    QgsMessageLog.logMessage(f"🔤 Temporarily enabled labels for '{layer.name()}' using field '{field}'", "geo_webview", Qgis.Info)
-                except Exception as e:
-                    QgsMessageLog.logMessage(f"⚠️ Failed to apply temporary labeling for layer '{getattr(layer, 'name', lambda: '<unknown>')()}': {e}", "geo_webview", Qgis.Warning)
+        def _build():
+            template = self._build_map_settings_from_canvas(width, height, crs, themes, layer_ids, styles_param)
+            if template is not None and labels_param:
+                self._apply_labeling_overrides(template, labels_param)
+            return template
 
-        except Exception as e:
-            try:
-                from qgis.core import QgsMessageLog, Qgis
-                QgsMessageLog.logMessage(f"❌ _apply_temporary_labeling error: {e}", "geo_webview", Qgis.Critical)
-            except Exception:
-                pass
+        map_settings = self.map_settings_from_template(key, _build)
+        if map_settings is not None:
+            map_settings.setOutputSize(QSize(width, height))
+        return map_settings
 
-        return originals
+    def map_settings_from_template(self, key, build):
+        """Return a private copy of the QgsMapSettings template for ``key``.
 
-    def _restore_labeling(self, originals: dict):
-        """Apply original labeling objects and enabled flags back to layers."""
-        try:
-            from qgis.core import QgsMessageLog, Qgis
-            for layer, (orig_labeling, orig_enabled) in list(originals.items()):
-                try:
-                    # restore labeling and enabled flag
-                    try:
-                        layer.setLabeling(orig_labeling)
-                    except Exception:
-                        pass
-                    try:
-                        layer.setLabelsEnabled(bool(orig_enabled))
-                    except Exception:
-                        pass
-                except Exception as e:
-                    QgsMessageLog.logMessage(f"⚠️ Failed to restore labeling for layer '{getattr(layer, 'name', lambda: '<unknown>')()}': {e}", "geo_webview", Qgis.Warning)
-        except Exception:
-            pass
+        On a miss the template is made with ``build()``. Keys are combined
+        with the project identity; templates are dropped on layer-tree,
+        theme and style changes (see :meth:`invalidate_render_cache`).
+        Construction and clone times are recorded as the ``settings_build``
+        and ``settings_clone`` stages of the render statistics.
+        """
+        from qgis.core import QgsMapSettings
+        full_key = (project_state.identity_short(),) + tuple(key)
+        started = time.perf_counter()
+        template = self.settings_templates.get(full_key)
+        stage = 'settings_clone'
+        if template is None:
+            stage = 'settings_build'
+            generation = self._render_generation
+            template = build()
+            if template is None:
+                return None
+            if generation == self._render_generation:
+                self.settings_templates.put(full_key, template, size=1)
+        map_settings = QgsMapSettings(template)
+        render_control.record_stage(stage, time.perf_counter() - started)
+        return map_settings
 
-    def _create_map_settings_from_canvas(self, width, height, crs, themes=None, layer_ids: str = None, styles_param: str = None):
+    def _build_map_settings_from_canvas(self, width, height, crs, themes=None, layer_ids: str = None, styles_param: str = None):
         """完全に独立した仮想マップビューを作成してWMS用のマップ設定を構築"""
         from qgis.core import (
             QgsMapSettings, QgsCoordinateReferenceSystem, QgsProject,
@@ -1136,44 +2022,12 @@ class GeoWebViewWMSService:
                                 continue
 
                             try:
-                                cache_for_layer = self._layer_cache.setdefault(lyr.id(), {})
-                                if style_name in cache_for_layer:
-                                    layer_style_overrides[lyr.id()] = cache_for_layer[style_name]
-                                    continue
-
-                                style_manager = lyr.styleManager()
-                                if style_name in style_manager.styles():
-                                    try:
-                                        original_style = style_manager.currentStyle()
-                                    except Exception:
-                                        original_style = None
-                                    try:
-                                        style_manager.setCurrentStyle(style_name)
-                                        doc = QDomDocument()
-                                        error_msg = lyr.exportNamedStyle(doc)
-                                        if not error_msg:
-                                            qml_string = doc.toString()
-                                            layer_style_overrides[lyr.id()] = qml_string
-                                            cache_for_layer[style_name] = qml_string
-                                            QgsMessageLog.logMessage(
-                                                f"✅ Applied style '{style_name}' to '{lyr.name()}'",
-                                                "geo_webview", Qgis.Info
-                                            )
-                                        else:
-                                            QgsMessageLog.logMessage(
-                                                f"⚠️ Style export failed for '{lyr.name()}': {error_msg}",
-                                                "geo_webview", Qgis.Warning
-                                            )
-                                    finally:
-                                        if original_style is not None:
-                                            try:
-                                                style_manager.setCurrentStyle(original_style)
-                                            except Exception:
-                                                pass
-                                else:
+                                qml_string = self._layer_style_qml(lyr, style_name)
+                                if qml_string is not None:
+                                    layer_style_overrides[lyr.id()] = qml_string
                                     QgsMessageLog.logMessage(
-                                        f"⚠️ Style '{style_name}' not found for '{lyr.name()}'",
-                                        "geo_webview", Qgis.Warning
+                                        f"✅ Applied style '{style_name}' to '{lyr.name()}'",
+                                        "geo_webview", Qgis.Info
                                     )
                             except Exception as e:
                                 QgsMessageLog.logMessage(
@@ -1266,8 +2120,9 @@ class GeoWebViewWMSService:
         # テーマが指定されている場合(キャッシュを利用)
         if themes:
             # キャッシュをチェック
-            if themes in self._theme_cache:
-                virtual_layers, layer_style_overrides = self._theme_cache[themes]
+            cached_theme = self.theme_cache.get(themes)
+            if cached_theme is not None:
+                virtual_layers, layer_style_overrides = cached_theme
                 map_settings.setLayers(virtual_layers)
                 if layer_style_overrides:
                     map_settings.setLayerStyleOverrides(layer_style_overrides)
@@ -1310,57 +2165,16 @@ class GeoWebViewWMSService:
                     # 可視レイヤーをリストに追加
                     virtual_layers.append(layer)
                     
-                    # スタイルの取得と適用
+                    # スタイルの取得と適用（テーマ指定のスタイル、なければ現在のスタイル）
                     style_name = layer_record.currentStyle if not layer_record.usingCurrentStyle else None
-                    
-                    if style_name:
-                        # 特定のスタイルを適用
-                        style_manager = layer.styleManager()
-                        if style_name in style_manager.styles():
-                            # 現在のスタイルを一時保存
-                            original_style = style_manager.currentStyle()
-                            
-                            try:
-                                # 指定スタイルに切り替え
-                                style_manager.setCurrentStyle(style_name)
-                                
-                                # スタイルをQML文字列として取得
-                                doc = QDomDocument()
-                                error_msg = layer.exportNamedStyle(doc)
-                                
-                                if not error_msg:
-                                    qml_string = doc.toString()
-                                    layer_style_overrides[layer.id()] = qml_string
-                                    QgsMessageLog.logMessage(
-                                        f"✅ '{layer.name()}' -> style '{style_name}'",
-                                        "geo_webview", Qgis.Info
-                                    )
-                                else:
-                                    QgsMessageLog.logMessage(
-                                        f"⚠️ Style export failed for '{layer.name()}': {error_msg}",
-                                        "geo_webview", Qgis.Warning
-                                    )
-                            finally:
-                                # 元のスタイルに戻す（プロジェクトに影響を与えない）
-                                style_manager.setCurrentStyle(original_style)
-                        else:
-                            QgsMessageLog.logMessage(
-                                f"⚠️ Style '{style_name}' not found for '{layer.name()}'",
-                                "geo_webview", Qgis.Warning
-                            )
-                    else:
-                        # 現在のスタイルをそのまま使用
-                        doc = QDomDocument()
-                        error_msg = layer.exportNamedStyle(doc)
-                        
-                        if not error_msg:
-                            qml_string = doc.toString()
-                            layer_style_overrides[layer.id()] = qml_string
-                            QgsMessageLog.logMessage(
-                                f"✅ '{layer.name()}' -> current style",
-                                "geo_webview", Qgis.Info
-                            )
-                
+                    qml_string = self._layer_style_qml(layer, style_name)
+                    if qml_string is not None:
+                        layer_style_overrides[layer.id()] = qml_string
+                        QgsMessageLog.logMessage(
+                            f"✅ '{layer.name()}' -> {f'style {style_name!r}' if style_name else 'current style'}",
+                            "geo_webview", Qgis.Info
+                        )
+
                 # 仮想マップビューに設定を適用
                 map_settings.setLayers(virtual_layers)
                 
@@ -1376,8 +2190,9 @@ class GeoWebViewWMSService:
                         "geo_webview", Qgis.Info
                     )
                 
-                # キャッシュに保存
-                self._theme_cache[themes] = (virtual_layers, layer_style_overrides)
+                # キャッシュに保存（QML の長さ＋レイヤごとの概算で課金）
+                self.theme_cache.put(themes, (virtual_layers, layer_style_overrides),
+                                     size=sum(len(q) for q in layer_style_overrides.values()) + 64 * len(virtual_layers) + 64)
             else:
                 # テーマが見つからない場合
                 canvas_layers = canvas.mapSettings().layers()
@@ -1437,7 +2252,8 @@ class GeoWebViewWMSService:
                             qml_has_labeling = False
                             try:
                                 doc = QDomDocument()
-                                err = layer.exportNamedStyle(doc)
+                                with render_control.live_style_read():
+                                    err = layer.exportNamedStyle(doc)
                                 if not err:
                                     qml = doc.toString()
                                     if '<labeling' in qml or '<Labeling' in qml:
@@ -1602,38 +2418,29 @@ class GeoWebViewWMSService:
                 "geo_webview", Qgis.Info
             )
             
+            # layers of the request before the per-extent filtering (a data edit
+            # can bring a dropped layer into the extent)
+            _rendered.layer_ids = frozenset(layer.id() for layer in layers) | (_rendered.layer_ids or frozenset())
+
+            # 描画準備: 縮尺範囲外・範囲外レイヤの除外とズーム帯ごとの簡略化
+            render_prep.prepare(map_settings)
+
             # 並列レンダリングジョブを作成
             render_job = QgsMapRendererParallelJob(map_settings)
 
-            # イベントループで完了を待つ
-            loop = QEventLoop()
-            render_job.finished.connect(loop.quit)
-            
+            # イベントループで完了を待つ（クライアント切断時はキャンセル）
             render_start = time.time()
-            render_job.start()
-
-            # タイムアウト設定(30秒 - OpenLayersは大きめの画像を要求する可能性)
-            timer = QTimer()
-            timer.timeout.connect(loop.quit)
-            timer.setSingleShot(True)
-            try:
-                timer.start(int(self.render_timeout_s * 1000))
-            except Exception:
-                # fallback to 30s if misconfigured
-                timer.start(30000)
-
-            # Qt5 had exec_(), Qt6 uses exec(). Support both.
-            if hasattr(loop, 'exec_'):
-                loop.exec_()
-            else:
-                loop.exec()
-            
+            outcome = render_control.wait_for_job(render_job, self.render_timeout_s)
             render_elapsed = time.time() - render_start
 
-            if render_job.isActive():
-                # タイムアウトした場合
-                render_job.cancel()
-                QgsMessageLog.logMessage(f"⚠️ Rendering timeout (30s)", "geo_webview", Qgis.Warning)
+            if outcome == 'cancelled':
+                QgsMessageLog.logMessage(
+                    f"🛑 Rendering cancelled after {render_elapsed:.2f}s: client disconnected",
+                    "geo_webview", Qgis.Info
+                )
+                return None
+            if outcome == 'timeout':
+                QgsMessageLog.logMessage(f"⚠️ Rendering timeout ({self.render_timeout_s}s)", "geo_webview", Qgis.Warning)
                 return None
 
             # レンダリング結果を取得
@@ -1665,32 +2472,86 @@ class GeoWebViewWMSService:
 
     def _save_image_as_png(self, image):
         """QImageをPNGバイトデータに変換"""
-        try:
-            from qgis.PyQt.QtCore import QBuffer, QIODevice
-            buffer = QBuffer()
-            # QIODevice.WriteOnly may be namespaced differently in Qt6/PyQt6.
-            write_mode = getattr(QIODevice, 'WriteOnly', None)
-            if write_mode is None:
-                om = getattr(QIODevice, 'OpenMode', None) or getattr(QIODevice, 'OpenModeFlag', None)
-                if om is not None and hasattr(om, 'WriteOnly'):
-                    write_mode = getattr(om, 'WriteOnly')
-            if write_mode is None:
-                # fallback to integer 1 if nothing else available
-                try:
-                    write_mode = int(1)
-                except Exception:
-                    write_mode = 1
-            buffer.open(write_mode)
-            image.save(buffer, "PNG")
-            png_data = buffer.data()
-            # Ensure we return Python bytes (QByteArray -> bytes)
-            try:
-                png_bytes = bytes(png_data)
-            except Exception:
-                png_bytes = png_data
-            buffer.close()
-            return png_bytes
-        except Exception as e:
-            from qgis.core import QgsMessageLog, Qgis
-            QgsMessageLog.logMessage(f"⚠️ Failed to save image as PNG: {e}", "geo_webview", Qgis.Warning)
-            return None
\ No newline at end of file
+        return self._encode_image(image, 'png')
+
+    def _encode_image(self, image, image_format='png'):
+        """QImageを image_format（'png' / 'jpg' / 'webp'）のバイトデータに変換
+
+        描画ワーカーではなく encode_pool で実行し、所要時間は 'encode' ステージとして記録する。
+        """
+        return encode_pool.encode(image, image_format)
+
+
+_batch_pool = None
+_batch_pool_lock = threading.Lock()
+
+
+def _batch_executor():
+    """Worker pool shared by all GetMapBatch requests (created on first use).
+
+    Sized by the render slot budget at that time; the budget itself still
+    bounds how many renders run at once.
+    """
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is None:
+            _batch_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, render_slots.scheduler().budget), thread_name_prefix='qmap-batch')
+        return _batch_pool
+
+
+def _in_request_context(fn):
+    """Wrap ``fn`` to run with the render priority and PNG level of the calling thread.
+
+    Both are thread-local, so pool threads would otherwise render a
+    background (e.g. prewarm) batch in the foreground with the interactive level.
+    """
+    priority = render_slots.current_priority()
+    level = encode_pool.current_level()
+
+    def _run(*args, **kwargs):
+        with encode_pool.compression_level(level):
+            if priority == render_slots.BACKGROUND:
+                with render_slots.background():
+                    return fn(*args, **kwargs)
+            return fn(*args, **kwargs)
+    return _run
+
+
+class _BatchWriter:
+    """GetMapBatch body writer: multipart/mixed parts or entries of a streamed ZIP."""
+
+    def __init__(self, response, package, boundary):
+        self._response = response
+        self._boundary = boundary
+        self._zip = None
+        if package == 'zip':
+            import zipfile
+            # the response is not seekable: zipfile writes data descriptors
+            self._zip = zipfile.ZipFile(self, 'w', zipfile.ZIP_STORED)
+
+    # file-like interface used by zipfile
+    def write(self, data):
+        self._response.write(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def part(self, name, content_type, data, index, status):
+        if self._zip is not None:
+            self._zip.writestr(name, data)
+            return
+        head = [f"--{self._boundary}", f"Content-Type: {content_type}",
+                f'Content-Disposition: attachment; filename="{name}"', f"X-Batch-Status: {status}",
+                f"Content-Length: {len(data)}"]
+        if index is not None:
+            head += [f"Content-ID: <item-{index}>", f"X-Batch-Index: {index}"]
+        self._response.write(("\r\n".join(head) + "\r\n\r\n").encode('utf-8') + data + b"\r\n")
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        else:
+            self._response.write(f"--{self._boundary}--\r\n".encode('utf-8'))
+        self._response.close()
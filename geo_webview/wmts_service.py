@@ -16,6 +16,38 @@ import json
 import concurrent.futures
 import threading
 
+from . import encode_pool
+from . import image_formats
+from . import project_state
+from . import render_control
+from . import render_slots
+from . import single_flight
+
+
+class _CaptureConn:
+    """Socket stand-in that collects a response produced by the WMS pipeline."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def sendall(self, data):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            self.buffer.extend(data)
+
+    def close(self):
+        pass
+
+
+def _captured_is_image(head):
+    """True when a captured response head is a 200 with an image Content-Type."""
+    lines = head.decode('iso-8859-1', errors='ignore').split('\r\n')
+    if len(lines[0].split()) < 2 or lines[0].split()[1] != '200':
+        return False
+    for line in lines[1:]:
+        if line.lower().startswith('content-type:'):
+            return line.split(':', 1)[1].strip().startswith('image')
+    return False
+
 
 class GeoWebViewWMTSService:
     """Simple WMTS-like handler that maps XYZ tiles to a WMS GetMap BBOX.
@@ -28,24 +60,34 @@ class GeoWebViewWMTSService:
 
     def __init__(self, server_manager):
         self.server_manager = server_manager
-        # Configurable defaults (CPU-derived defaults; environment variables not used for render worker counts)
-        # Prefer a computed default based on CPU count; enforce a sensible minimum for parallelism.
-        try:
-            cpu_count = os.cpu_count()
-        except Exception:
-            cpu_count = None
-        if not cpu_count:
-            cpu_count = 8
-        # max_render_workers: cpu_count - 1, but at least 6
-        try:
-            self.max_render_workers = max(6, max(1, int(cpu_count) - 1))
-        except Exception:
-            self.max_render_workers = 6
+        # Render concurrency is not configured here: every render takes slots
+        # from the process-wide budget in render_slots (QMAP_MAX_RENDER_WORKERS).
         self.max_io_workers = int(os.environ.get('QMAP_MAX_IO_WORKERS', 20))
         self.request_timeout_s = int(os.environ.get('QMAP_REQUEST_TIMEOUT_S', 10))
         self.retry_count = int(os.environ.get('QMAP_RETRY_COUNT', 2))
         # tile size (default 256)
         self.tile_size = int(os.environ.get('QMAP_TILE_SIZE', 256))
+        # Cache-Control max-age for tiles requested with the current ?v=<identity>
+        try:
+            self.tile_max_age_s = int(os.environ.get('QMAP_TILE_MAX_AGE_S', 86400))
+        except Exception:
+            self.tile_max_age_s = 86400
+        # Metatiles: render N x N tiles (plus a pixel buffer on every side so
+        # labels are placed once and not cut at tile edges) in one job and
+        # slice the result; QMAP_METATILE_SIZE=1 renders tile by tile.
+        try:
+            self.metatile_size = max(1, int(os.environ.get('QMAP_METATILE_SIZE', 4)))
+        except Exception:
+            self.metatile_size = 4
+        try:
+            self.metatile_buffer = max(0, int(os.environ.get('QMAP_METATILE_BUFFER', 64)))
+        except Exception:
+            self.metatile_buffer = 64
+        # PNG tiles of these TileMatrixSets are palette-quantized (PNG8); '*' = all.
+        # Per request: FORMAT=image/png; mode=8bit or the .png8 extension.
+        self.png8_tile_matrix_sets = {
+            v.strip().upper() for v in os.environ.get('QMAP_PNG8_TILE_MATRIX_SETS', '').split(',') if v.strip()
+        }
         # cache directory for WMTS tiles
         self.cache_dir = os.path.join(os.path.dirname(__file__), os.environ.get('QMAP_CACHE_DIR', '.cache'), 'wmts')
         # Maximum allowed zoom to avoid absurd requests (sane default)
@@ -105,6 +147,11 @@ class GeoWebViewWMTSService:
         self._prewarm_lock = threading.Lock()
         self._is_prewarming = False
 
+    @property
+    def max_render_workers(self):
+        """Render slot budget; shared with WMS and enforced by ``render_slots``."""
+        return render_slots.scheduler().budget
+
     def _on_style_changed(self, *args, **kwargs):
         """Signal handler called when a layer's current style changes.
 
@@ -183,46 +230,11 @@ class GeoWebViewWMTSService:
                 continue
 
     def _extract_style_id(self, layer_obj):
-        """Attempt to extract a stable style identifier from a QGIS layer object.
+        """Return a stable style identifier of a QGIS layer ('' if none).
 
-        The function tries several common APIs across QGIS versions and layer
-        types and returns a string (or empty string if nothing found).
+        See :func:`project_state.extract_style_id`.
         """
-        # Only use the style manager's explicit currentStyleId if available.
-        # Per request, no fallbacks: if currentStyleId is not present, return ''
-        try:
-            if layer_obj is None:
-                return ''
-            sm_attr = getattr(layer_obj, 'styleManager', None)
-            sm = None
-            if callable(sm_attr):
-                try:
-                    sm = sm_attr()
-                except Exception:
-                    sm = None
-            else:
-                sm = sm_attr
-            if sm is None:
-                return ''
-            # Use a single, reliable attribute to avoid complexity: prefer
-            # `currentStyle` (observed in many QGIS versions). If absent or
-            # empty, return empty string. Do not attempt multiple fallbacks.
-            try:
-                val = getattr(sm, 'currentStyle', None)
-                if val is None:
-                    return ''
-                if callable(val):
-                    try:
-                        v = val()
-                    except Exception:
-                        v = None
-                else:
-                    v = val
-                return str(v) if v else ''
-            except Exception:
-                return ''
-        except Exception:
-            return ''
+        return project_state.extract_style_id(layer_obj)
 
     def _tile_xyz_to_bbox(self, z, x, y):
         """Convert XYZ tile coordinates to WebMercator bbox string.
@@ -256,6 +268,258 @@ class GeoWebViewWMTSService:
             return False, f'Tile coordinates out of range for z={z} (0..{max_index})'
         return True, ''
 
+    def _tile_format(self, fmt, tile_matrix_set=None):
+        """Effective tile format: ``png`` becomes ``png8`` for configured TileMatrixSets.
+
+        Paths without a TileMatrixSet (``/wmts|xyz/{z}/{x}/{y}``, prewarm)
+        use the only one served, ``EPSG:3857``.
+        """
+        if fmt != 'png' or not self.png8_tile_matrix_sets:
+            return fmt
+        tms = str(tile_matrix_set or 'EPSG:3857').strip().upper()
+        if '*' in self.png8_tile_matrix_sets or tms in self.png8_tile_matrix_sets:
+            return 'png8'
+        return fmt
+
+    def _tile_cache_path(self, identity_dir, z, x, y, fmt):
+        """Disk cache path of a tile: ``<identity_dir>/<z>/<x>/<y>.<fmt>``."""
+        return os.path.join(identity_dir, str(z), str(x), f"{y}.{fmt}")
+
+    def _render_tile(self, z, x, y, fmt, identity_hash, identity_dir,
+                     identity_short=None, identity_raw=None, layers_param=None, conn=None):
+        """Render one tile and store it in the disk cache, coalescing duplicates.
+
+        Concurrent requests for the same tile (several tabs, KVP and REST
+        clients, the prewarm pool) share a single render and a single cache
+        write through the ``wmts-tile`` single-flight group (or, in metatile
+        mode, share the render of the surrounding block). The render is
+        cancelled when every requesting client has disconnected, unless
+        ``QMAP_WMTS_FINISH_ON_DISCONNECT`` keeps it going for the cache
+        (prewarm renders, ``conn=None``, always finish).
+
+        Returns:
+            bytes: the captured raw HTTP response of the WMS pipeline
+        """
+        if self._use_metatiles():
+            return self._render_tile_from_metatile(z, x, y, fmt, identity_hash, identity_dir,
+                                                   identity_short, identity_raw, layers_param, conn)
+        key = (identity_hash, int(self.tile_size), z, x, y, fmt, layers_param or '')
+        group = single_flight.group('wmts-tile')
+        watch = None
+        if not render_control.WMTS_FINISH_ON_DISCONNECT:
+            watch = render_control.disconnect_watch(conn)
+        return group.do(
+            key,
+            lambda: self._render_and_store_tile(z, x, y, fmt, identity_dir,
+                                                identity_short, identity_raw, layers_param,
+                                                cancel_check=lambda: group.abandoned(key)),
+            watch=watch)
+
+    def _render_and_store_tile(self, z, x, y, fmt, identity_dir, identity_short, identity_raw, layers_param,
+                               cancel_check=None):
+        bbox = self._tile_xyz_to_bbox(z, x, y)
+        size = int(self.tile_size)
+        cap = _CaptureConn()
+        with render_control.cancel_scope(cancel_check) as scope:
+            if layers_param:
+                # pass layers if supported by server_manager (best-effort)
+                try:
+                    self.server_manager._handle_wms_get_map_with_bbox(cap, bbox, 'EPSG:3857', size, size, rotation=0.0, layers_param=layers_param, image_format=fmt)
+                except TypeError:
+                    # older signature without layers_param
+                    cap = _CaptureConn()
+                    self.server_manager._handle_wms_get_map_with_bbox(cap, bbox, 'EPSG:3857', size, size, rotation=0.0, image_format=fmt)
+            else:
+                self.server_manager._handle_wms_get_map_with_bbox(cap, bbox, 'EPSG:3857', size, size, rotation=0.0, image_format=fmt)
+        raw = bytes(cap.buffer)
+        if scope.cancelled:
+            # nobody is waiting for this tile; never cache a partial result
+            return raw
+
+        sep = raw.find(b"\r\n\r\n")
+        if identity_dir and sep >= 0 and _captured_is_image(raw[:sep]):
+            self._store_tile(identity_dir, z, x, y, fmt, memoryview(raw)[sep + 4:], identity_short, identity_raw)
+        return raw
+
+    def _store_tile(self, identity_dir, z, x, y, fmt, body, identity_short=None, identity_raw=None):
+        """Atomically write one tile (and its sidecar meta) into the disk cache."""
+        cache_path = self._tile_cache_path(identity_dir, z, x, y, fmt)
+        tmppath = None
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmpfd, tmppath = tempfile.mkstemp(dir=identity_dir, suffix='.tmp')
+            with os.fdopen(tmpfd, 'wb') as tfh:
+                tfh.write(body)
+            os.replace(tmppath, cache_path)
+            tmppath = None
+            if identity_raw is not None:
+                # write sidecar metadata for easier inspection
+                with open(cache_path + '.meta.json', 'w', encoding='utf-8') as mf:
+                    json.dump({
+                        'cache_key': f"{identity_short}:{fmt}:{z}/{x}/{y}",
+                        'identity_short': identity_short,
+                        'identity_raw': identity_raw,
+                        'format': fmt,
+                        'z': z,
+                        'x': x,
+                        'y': y,
+                        'path': cache_path,
+                    }, mf, ensure_ascii=False, indent=2)
+        except Exception:
+            pass
+        finally:
+            if tmppath:
+                try:
+                    os.remove(tmppath)
+                except Exception:
+                    pass
+
+    # ------------------------------------------------------------------
+    # metatiles
+    # ------------------------------------------------------------------
+    def _use_metatiles(self):
+        return self.metatile_size > 1 and hasattr(self.server_manager, 'render_map_qimage')
+
+    def _metatile_origin(self, z, x, y):
+        """Return ``(nx, ny, mx, my)``: block size at zoom ``z`` and its top-left tile.
+
+        Blocks are aligned to multiples of the metatile size; the last block
+        of a row/column is clipped to the ``2**z`` grid, so sizes that are
+        not powers of two never produce tiles outside the matrix.
+        """
+        n = max(1, int(self.metatile_size))
+        mx, my = (x // n) * n, (y // n) * n
+        return min(n, 2 ** z - mx), min(n, 2 ** z - my), mx, my
+
+    def _render_tile_from_metatile(self, z, x, y, fmt, identity_hash, identity_dir,
+                                   identity_short=None, identity_raw=None, layers_param=None, conn=None):
+        """Return tile ``z/x/y`` as a captured response, rendering its metatile if needed.
+
+        Requests for any tile of the same block share one metatile render
+        (``wmts-metatile`` single-flight group); every tile of the block is
+        written to the cache by that render.
+        """
+        nx, ny, mx, my = self._metatile_origin(z, x, y)
+        key = (identity_hash, int(self.tile_size), z, mx, my, nx, ny, fmt, layers_param or '')
+        group = single_flight.group('wmts-metatile')
+        watch = None
+        if not render_control.WMTS_FINISH_ON_DISCONNECT:
+            watch = render_control.disconnect_watch(conn)
+        tiles = group.do(
+            key,
+            lambda: self._render_metatile(z, mx, my, nx, ny, fmt, identity_dir, identity_short, identity_raw,
+                                          layers_param, cancel_check=lambda: group.abandoned(key)),
+            watch=watch)
+        body = tiles.get((x, y)) if tiles else None
+        if not body:
+            return b''
+        return (f"HTTP/1.1 200 OK\r\nContent-Type: {image_formats.mime_type(fmt)}\r\nContent-Length: {len(body)}\r\n\r\n"
+                .encode('ascii') + body)
+
+    def _render_metatile(self, z, mx, my, nx, ny, fmt, identity_dir, identity_short, identity_raw, layers_param=None,
+                         cancel_check=None):
+        """Render an ``nx`` x ``ny`` block (plus buffer) once and slice it into tiles.
+
+        Returns:
+            dict: ``{(x, y): tile_bytes}`` encoded as ``fmt``, or None when rendering failed or was cancelled
+        """
+        ts = int(self.tile_size)
+        pad = int(self.metatile_buffer)
+        minx, _, _, maxy = (float(v) for v in self._tile_xyz_to_bbox(z, mx, my).split(','))
+        _, miny, maxx, _ = (float(v) for v in self._tile_xyz_to_bbox(z, mx + nx - 1, my + ny - 1).split(','))
+        res = (maxx - minx) / (nx * ts)
+        bbox = f"{minx - pad * res},{miny - pad * res},{maxx + pad * res},{maxy + pad * res}"
+        width, height = nx * ts + 2 * pad, ny * ts + 2 * pad
+
+        with render_control.cancel_scope(cancel_check) as scope:
+            image = self.server_manager.render_map_qimage(width, height, bbox, 'EPSG:3857', layers_param=layers_param or None)
+        if image is None or scope.cancelled:
+            return None
+
+        # slices are encoded in parallel on the encode pool
+        cells = [(i, j) for i in range(nx) for j in range(ny)]
+        encoded = encode_pool.encode_many(
+            [image.copy(pad + i * ts, pad + j * ts, ts, ts) for i, j in cells], fmt)
+        del image
+
+        tiles = {}
+        for (i, j), tile_bytes in zip(cells, encoded):
+            if not tile_bytes:
+                continue
+            tiles[(mx + i, my + j)] = tile_bytes
+            if identity_dir:
+                self._store_tile(identity_dir, z, mx + i, my + j, fmt, tile_bytes, identity_short, identity_raw)
+        return tiles
+
+    def _forward_captured_response(self, conn, raw, etag=None, cache_control=None, extra_headers=None):
+        """Re-send a response captured from the WMS pipeline to ``conn``.
+
+        The captured bytes carry their own ``Connection`` header, so they are
+        re-emitted through ``http_server`` to get headers that match the
+        client's keep-alive state instead of forwarding them verbatim.
+        ``etag``/``cache_control`` are only applied to successful responses.
+        """
+        from . import http_server
+        sep = b"\r\n\r\n"
+        if sep not in raw:
+            http_server.send_http_response(conn, 500, 'Internal Server Error', 'WMTS tile rendering produced no response', 'text/plain; charset=utf-8')
+            return
+        hdr, body = raw.split(sep, 1)
+        lines = hdr.decode('iso-8859-1', errors='ignore').split('\r\n')
+        status_code, reason = 500, 'Internal Server Error'
+        try:
+            parts = lines[0].split(' ', 2)
+            status_code = int(parts[1])
+            reason = parts[2] if len(parts) > 2 else ''
+        except Exception:
+            pass
+        content_type = 'application/octet-stream'
+        for line in lines[1:]:
+            if line.lower().startswith('content-type:'):
+                content_type = line.split(':', 1)[1].strip()
+                break
+        if status_code != 200:
+            etag = cache_control = None
+        http_server.send_binary_response(conn, status_code, reason, body, content_type,
+                                         etag=etag, cache_control=cache_control, extra_headers=extra_headers)
+
+    @staticmethod
+    def _layer_key(layer):
+        """Short digest of a requested layer list (ETag suffix and cache subdirectory)."""
+        return hashlib.sha1(str(layer).encode('utf-8')).hexdigest()[:12]
+
+    def _get_identity_info(self):
+        """Return ``(identity_short, identity_raw)`` for the current map state.
+
+        Visible layers in layer-tree order plus their style ids (see SPEC
+        "WMTS キャッシュと identity" and :func:`project_state.identity_info`).
+        """
+        return project_state.identity_info()
+
+    def _tile_validators(self, identity_raw, z, x, y, fmt, params, layer=None):
+        """Return ``(etag, cache_control)`` for a tile.
+
+        The identity hash covers the visible layers and styles, so together
+        with the tile address, format and the requested layer list (KVP
+        ``LAYER``, if any) it is a strong ETag that is known before touching
+        the disk cache or the renderer. Tiles requested with the current
+        ``?v=<identity_short>`` are immutable for that URL and get a long
+        max-age; anything else must revalidate.
+        """
+        identity_hash = hashlib.sha1(identity_raw.encode('utf-8')).hexdigest()
+        etag = f"{identity_hash[:20]}-{z}-{x}-{y}-{fmt}"
+        if layer:
+            etag += f"-{self._layer_key(layer)}"
+        try:
+            v = params.get('v', [''])[0] if params else ''
+        except Exception:
+            v = ''
+        if v and v == identity_hash[:12] and self.tile_max_age_s > 0:
+            cache_control = f"public, max-age={self.tile_max_age_s}"
+        else:
+            cache_control = 'no-cache'
+        return etag, cache_control
+
     def get_identity_diagnostics(self):
         """Return a dict with diagnostic info about layer-tree and canvas layers.
 
@@ -419,15 +683,15 @@ class GeoWebViewWMTSService:
         # intentionally quiet: return diagnostics without logging
         return diag
 
-    def handle_wmts_request(self, conn, parsed_url, params, host=None):
+    def handle_wmts_request(self, conn, http_request):
         """Handle an incoming /wmts request.
 
         Args:
-            conn: socket connection
-            parsed_url: result of urllib.parse.urlparse(target)
-            params: dict from urllib.parse.parse_qs
-            host: Host header value (optional)
+            conn: client connection
+            http_request: parsed ``http_server.HTTPRequest`` (path, params, host)
         """
+        params = http_request.params
+        host = http_request.host
         try:
             # Ensure local tile vars exist so early returns (e.g. GetCapabilities)
             # don't trigger UnboundLocalError when `z` is assigned later in
@@ -502,6 +766,22 @@ class GeoWebViewWMTSService:
                     xyz_tile_url_template_esc = xyz_tile_url.replace('&', '&amp;')
                     matrix_order_template_esc = matrix_order_template.replace('&', '&amp;')
 
+                # One <Format> and one set of ResourceURLs per output format; each
+                # format is a separate tile cache namespace (see image_formats).
+                def _with_ext(template, ext):
+                    if '{Format}' in template:
+                        return template.replace('{Format}', ext)
+                    return f'.{ext}'.join(template.rsplit('.png', 1))
+
+                formats_xml = '\n'.join(f"            <Format>{mime}</Format>" for mime in image_formats.mime_types())
+                resource_urls = []
+                for ext in image_formats.available():
+                    mime = image_formats.mime_type(ext)
+                    for template in (tile_url_template_esc, matrix_order_template_esc, xyz_tile_url_template_esc):
+                        resource_urls.append(
+                            f"            <ResourceURL resourceType=\"tile\" format=\"{mime}\" width=\"256\" height=\"256\" template=\"{_with_ext(template, ext)}\"/>")
+                resource_urls_xml = '\n'.join(resource_urls)
+
                 # Build TileMatrix entries for each zoom level (0.._max_zoom)
                 origin = 20037508.342789244
                 full_width = origin * 2
@@ -600,17 +880,14 @@ class GeoWebViewWMTSService:
                         f"            <Style isDefault=\"true\">\n"
                         f"                <ows:Identifier>default</ows:Identifier>\n"
                         f"            </Style>\n"
-                        f"            <Format>image/png</Format>\n"
-                        f"            <Format>image/jpeg</Format>\n"
+                        f"{formats_xml}\n"
                         f"            <TileMatrixSetLink>\n"
                         f"                <TileMatrixSet>EPSG:3857</TileMatrixSet>\n"
                         f"                <TileMatrixSetLimits>\n{tile_matrix_limits_xml}\n"
                         f"                </TileMatrixSetLimits>\n"
                         f"            </TileMatrixSetLink>\n"
-                        f"            <ResourceURL resourceType=\"tile\" format=\"image/png\" width=\"256\" height=\"256\" template=\"{tile_url_template_esc}\"/>\n"
-                        f"            <ResourceURL resourceType=\"tile\" format=\"image/png\" width=\"256\" height=\"256\" template=\"{matrix_order_template_esc}\"/>\n"
                         f"            <!-- Also provide a simple XYZ endpoint for convenience: /xyz/{{z}}/{{x}}/{{y}}.png -->\n"
-                        f"            <ResourceURL resourceType=\"tile\" format=\"image/png\" width=\"256\" height=\"256\" template=\"{xyz_tile_url_template_esc}\"/>\n"
+                        f"{resource_urls_xml}\n"
                         f"        </Layer>"
                     )
                     return entry
@@ -636,19 +913,18 @@ class GeoWebViewWMTSService:
                         "            <Style isDefault=\"true\">\n"
                         "                <ows:Identifier>default</ows:Identifier>\n"
                         "            </Style>\n"
-                        "            <Format>image/png</Format>\n"
-                        "            <Format>image/jpeg</Format>\n"
+                        f"{formats_xml}\n"
                         "            <TileMatrixSetLink>\n"
                         "                <TileMatrixSet>EPSG:3857</TileMatrixSet>\n"
                         f"                <TileMatrixSetLimits>\n{tile_matrix_limits_xml}\n"
                         "                </TileMatrixSetLimits>\n"
                         "            </TileMatrixSetLink>\n"
-                        f"            <ResourceURL resourceType=\"tile\" format=\"image/png\" width=\"256\" height=\"256\" template=\"{tile_url_template_esc}\"/>\n"
-                        f"            <ResourceURL resourceType=\"tile\" format=\"image/png\" width=\"256\" height=\"256\" template=\"{matrix_order_template_esc}\"/>\n"
-                        f"            <ResourceURL resourceType=\"tile\" format=\"image/png\" width=\"256\" height=\"256\" template=\"{xyz_tile_url_template_esc}\"/>\n"
+                        f"{resource_urls_xml}\n"
                         "        </Layer>\n"
                     )
 
+                format_values_xml = ''.join(f"<ows:Value>{mime}</ows:Value>" for mime in image_formats.mime_types())
+
                 # Build a more standards-oriented GetCapabilities response.
                 xml = f'''<?xml version="1.0" encoding="UTF-8"?>
 <Capabilities
@@ -694,7 +970,7 @@ class GeoWebViewWMTSService:
             <ows:Parameter name="VERSION"><ows:Value>1.0.0</ows:Value></ows:Parameter>
             <ows:Parameter name="LAYER"><ows:Value>qgis_map</ows:Value></ows:Parameter>
             <ows:Parameter name="TILEMATRIXSET"><ows:Value>EPSG:3857</ows:Value></ows:Parameter>
-            <ows:Parameter name="FORMAT"><ows:Value>image/png</ows:Value><ows:Value>image/jpeg</ows:Value></ows:Parameter>
+            <ows:Parameter name="FORMAT">{format_values_xml}</ows:Parameter>
         </ows:Operation>
     </ows:OperationsMetadata>
     <Contents>
@@ -708,7 +984,7 @@ class GeoWebViewWMTSService:
     <ServiceMetadataURL xlink:href="{service_metadata_href_esc}"/>
 </Capabilities>'''
                 from . import http_server
-                http_server.send_http_response(conn, 200, 'OK', xml, 'text/xml; charset=utf-8')
+                http_server.send_http_response(conn, 200, 'OK', xml, 'text/xml; charset=utf-8', cacheable=True)
                 return
 
             # KVP GetTile handling: support REQUEST=GetTile&LAYER=...&TILEMATRIXSET=...&TILEMATRIX=...&TILEROW=...&TILECOL=...&FORMAT=...
@@ -726,15 +1002,13 @@ class GeoWebViewWMTSService:
                     fmt_param = getp('FORMAT') or 'image/png'
                     style_param = getp('STYLE') or getp('Style') or ''
 
-                    # Normalize format to short ext
-                    fmt_low = fmt_param.split('/')[-1].lower()
-                    if fmt_low in ('png', 'image/png'):
-                        fmt_ext = 'png'
-                    elif fmt_low in ('jpeg', 'jpg', 'image/jpeg'):
-                        fmt_ext = 'jpg'
-                    else:
-                        # best-effort: use last token
-                        fmt_ext = fmt_low.split()[-1]
+                    # Normalize format to short ext (also the cache namespace)
+                    fmt_ext = image_formats.normalize(fmt_param)
+                    if fmt_ext is None or fmt_ext not in image_formats.available():
+                        from . import http_server
+                        http_server.send_http_response(conn, 400, 'Bad Request', f'Unsupported FORMAT: {fmt_param}', 'text/plain; charset=utf-8')
+                        return
+                    fmt_ext = self._tile_format(fmt_ext, tms_param)
 
                     # Parse tilematrix index: try int(tm_param) or last colon-separated part
                     try:
@@ -757,67 +1031,31 @@ class GeoWebViewWMTSService:
                         http_server.send_http_response(conn, 400, 'Bad Request', msg, 'text/plain; charset=utf-8')
                         return
 
-                    # compute bbox and delegate to WMS path
-                    bbox = self._tile_xyz_to_bbox(z, x, y)
-
-                    if hasattr(self.server_manager, '_handle_wms_get_map_with_bbox'):
-                        class _CaptureConn:
-                            def __init__(self):
-                                self._buf = bytearray()
-                            def sendall(self, b):
-                                if isinstance(b, (bytes, bytearray)):
-                                    self._buf.extend(b)
-                            def close(self):
-                                pass
-
-                        cap = _CaptureConn()
-                        # pass style via later params if supported by server_manager (best-effort)
-                        try:
-                            self.server_manager._handle_wms_get_map_with_bbox(cap, bbox, 'EPSG:3857', int(self.tile_size), int(self.tile_size), rotation=0.0, layers_param=layer_param or None)
-                        except TypeError:
-                            # older signature without layers_param
-                            self.server_manager._handle_wms_get_map_with_bbox(cap, bbox, 'EPSG:3857', int(self.tile_size), int(self.tile_size), rotation=0.0)
-
-                        raw = bytes(cap._buf)
-                        sep = b"\r\n\r\n"
-                        if sep in raw:
-                            hdr, body = raw.split(sep, 1)
-                            hdr_text = hdr.decode('utf-8', errors='ignore')
-                            content_type = 'application/octet-stream'
-                            for line in hdr_text.splitlines():
-                                if line.lower().startswith('content-type:'):
-                                    content_type = line.split(':', 1)[1].strip()
-                                    break
-                            if content_type.startswith('image'):
-                                try:
-                                    # attempt to cache tile similarly to REST path
-                                    cache_dir = self.cache_dir
-                                    identity_short, identity_raw = self._get_identity_info()
-                                    identity_hash, identity_dir = self.ensure_identity(identity_short, identity_raw)
-                                    tile_dir = os.path.join(identity_dir, str(z), str(x))
-                                    os.makedirs(tile_dir, exist_ok=True)
-                                    cache_path = os.path.join(tile_dir, f"{y}.{fmt_ext}")
-                                    tmpfd, tmppath = tempfile.mkstemp(dir=identity_dir, suffix='.tmp')
-                                    with os.fdopen(tmpfd, 'wb') as tfh:
-                                        tfh.write(body)
-                                    os.replace(tmppath, cache_path)
-                                except Exception:
-                                    pass
-                            try:
-                                conn.sendall(raw)
-                            except Exception:
-                                pass
-                            return
-                        else:
-                            try:
-                                conn.sendall(raw)
-                            except Exception:
-                                pass
-                            return
-                    else:
+                    # conditional GET: answer 304 before any disk/render work
+                    tile_etag = tile_cache_control = None
+                    try:
                         from . import http_server
-                        http_server.send_http_response(conn, 500, 'Internal Server Error', 'WMS rendering method not available', 'text/plain; charset=utf-8')
-                        return
+                        identity_short, identity_raw = self._get_identity_info()
+                        tile_etag, tile_cache_control = self._tile_validators(identity_raw, z, x, y, fmt_ext, params,
+                                                                              layer=layer_param)
+                        if http_server.check_not_modified(conn, tile_etag, cache_control=tile_cache_control,
+                                                          content_type=image_formats.mime_type(fmt_ext)):
+                            return
+                    except Exception:
+                        pass
+
+                    identity_short, identity_raw = self._get_identity_info()
+                    identity_hash, identity_dir = self.ensure_identity(identity_short, identity_raw)
+                    if identity_dir and layer_param:
+                        # tiles of a LAYER subset must not land in (or be served from) the full-map cache
+                        identity_dir = os.path.join(identity_dir, 'layers', self._layer_key(layer_param))
+                    raw = self._render_tile(z, x, y, fmt_ext, identity_hash, identity_dir,
+                                            layers_param=layer_param or None, conn=conn)
+                    try:
+                        self._forward_captured_response(conn, raw, tile_etag, tile_cache_control)
+                    except Exception:
+                        pass
+                    return
                 except Exception as e:
                     from . import http_server
                     http_server.send_http_response(conn, 400, 'Bad Request', f'GetTile KVP failed: {e}', 'text/plain; charset=utf-8')
@@ -826,7 +1064,10 @@ class GeoWebViewWMTSService:
             # Tile request patterns:
             # - Legacy /wmts/{z}/{x}/{y}.png or /xyz/{z}/{x}/{y}.png (kept for backward compatibility)
             # - New style-based: /wmts/{Style}/{TileMatrixSet}/{TileMatrix}/{TileRow}/{TileCol}.{Format}
-            m_style = re.match(r'^/wmts/([^/]+)/([^/]+)/(\d+)/(\d+)/(\d+)\.(png|jpg|jpeg)$', parsed_url.path, flags=re.IGNORECASE)
+            # - Extension-less /xyz/{z}/{x}/{y}: format negotiated from the Accept header
+            vary = None
+            tileset = None
+            m_style = re.match(r'^/wmts/([^/]+)/([^/]+)/(\d+)/(\d+)/(\d+)\.(png|png8|jpg|jpeg|webp)$', http_request.path, flags=re.IGNORECASE)
             if m_style:
                 # style, tileset, z, row, col
                 style = m_style.group(1)
@@ -834,10 +1075,7 @@ class GeoWebViewWMTSService:
                 z = int(m_style.group(3))
                 row = int(m_style.group(4))
                 col = int(m_style.group(5))
-                fmt = m_style.group(6).lower()
-                # Normalize fmt
-                if fmt == 'jpeg':
-                    fmt = 'jpg'
+                fmt = image_formats.normalize(m_style.group(6))
                 x = col
                 y = row
                 # Accept any TileMatrixSet but prefer EPSG:3857 semantics
@@ -845,17 +1083,24 @@ class GeoWebViewWMTSService:
                 # users should request EPSG:3857 TileMatrixSet for correct bbox mapping.
             else:
                 # Legacy pattern: /wmts/{z}/{x}/{y}.png or /xyz/{z}/{x}/{y}.png
-                m = re.match(r'^/(?:wmts|xyz)/(\d+)/(\d+)/(\d+)\.(png|jpg|jpeg)$', parsed_url.path, flags=re.IGNORECASE)
-                if m:
+                m = re.match(r'^/(?:wmts|xyz)/(\d+)/(\d+)/(\d+)(?:\.(png|png8|jpg|jpeg|webp))?$', http_request.path, flags=re.IGNORECASE)
+                if m and (m.group(4) or http_request.path.lower().startswith('/xyz/')):
                     z = int(m.group(1))
                     x = int(m.group(2))
                     y = int(m.group(3))
-                    fmt = m.group(4).lower()
-                    if fmt == 'jpeg':
-                        fmt = 'jpg'
+                    if m.group(4):
+                        fmt = image_formats.normalize(m.group(4))
+                    else:
+                        fmt = image_formats.negotiate(http_request.headers.get('accept'))
+                        vary = ['Vary: Accept']
                 else:
                     m = None
             if (m_style or m):
+                if fmt not in image_formats.available():
+                    from . import http_server
+                    http_server.send_http_response(conn, 404, 'Not Found', f'Tile format not available: {fmt}', 'text/plain; charset=utf-8')
+                    return
+                fmt = self._tile_format(fmt, tileset)
 
                 # Detect TMS (bottom-left origin) flag in params (tms=1 or tms=true)
                 tms_flag = False
@@ -865,7 +1110,7 @@ class GeoWebViewWMTSService:
                 except Exception:
                     tms_flag = False
 
-                # If TMS requested, invert y before validation and bbox computation
+                # If TMS requested, invert y before validation
                 if tms_flag:
                     try:
                         y = (2 ** z - 1) - y
@@ -878,122 +1123,42 @@ class GeoWebViewWMTSService:
                     http_server.send_http_response(conn, 400, 'Bad Request', msg, 'text/plain; charset=utf-8')
                     return
 
-                # compute WebMercator bbox for XYZ tile (origin top-left)
-                bbox = self._tile_xyz_to_bbox(z, x, y)
-
+                # conditional GET: answer 304 before any disk/render work
+                tile_etag = tile_cache_control = None
                 try:
-                    # Try cache first
-                    try:
-                        cache_dir = self.cache_dir
-                        os.makedirs(cache_dir, exist_ok=True)
-                        # extension/format is already determined for both patterns
-                        if not fmt:
-                            fmt = 'png'
-
-                        # Determine a stable identity for the current layer/theme
-                        identity_short, identity_raw = self._get_identity_info()
-                        cache_key = f"{identity_short}:{fmt}:{z}/{x}/{y}"
+                    from . import http_server
+                    identity_short, identity_raw = self._get_identity_info()
+                    tile_etag, tile_cache_control = self._tile_validators(identity_raw, z, x, y, fmt, params)
+                    if http_server.check_not_modified(conn, tile_etag, cache_control=tile_cache_control,
+                                                      content_type=image_formats.mime_type(fmt), extra_headers=vary):
+                        return
+                except Exception:
+                    pass
 
-                        # Ensure identity folder/meta exists (centralized)
-                        try:
-                            identity_hash, identity_dir = self.ensure_identity(identity_short, identity_raw)
-                        except Exception:
-                            identity_hash = hashlib.sha1(identity_raw.encode('utf-8')).hexdigest()
-                            identity_dir = os.path.join(cache_dir, identity_hash)
-                            try:
-                                os.makedirs(identity_dir, exist_ok=True)
-                            except Exception:
-                                pass
+                try:
+                    if not fmt:
+                        fmt = 'png'
+                    # Determine a stable identity for the current layer/theme
+                    identity_short, identity_raw = self._get_identity_info()
+                    # Ensure identity folder/meta exists (centralized)
+                    identity_hash, identity_dir = self.ensure_identity(identity_short, identity_raw)
 
-                            cache_dir = self.cache_dir
-                            os.makedirs(cache_dir, exist_ok=True)
-                        # tile path: nested by z/x/y for easier inspection
-                        tile_dir = os.path.join(identity_dir, str(z), str(x))
-                        try:
-                            os.makedirs(tile_dir, exist_ok=True)
-                        except Exception:
-                            pass
-
-                        cache_path = os.path.join(tile_dir, f"{y}.{fmt}")
-                        if os.path.exists(cache_path):
-                            with open(cache_path, 'rb') as fh:
-                                data = fh.read()
-                            from . import http_server
-                            content_type = 'image/png' if fmt == 'png' else f'image/{fmt}'
-                            http_server.send_binary_response(conn, 200, 'OK', data, content_type)
+                    # Try cache first. Cache hit: header + sendfile, tile bytes
+                    # never enter the Python heap.
+                    if identity_dir:
+                        from . import http_server
+                        cache_path = self._tile_cache_path(identity_dir, z, x, y, fmt)
+                        content_type = image_formats.mime_type(fmt)
+                        if http_server.send_file_response(conn, cache_path, content_type,
+                                                          etag=tile_etag, cache_control=tile_cache_control,
+                                                          extra_headers=vary):
                             return
-                    except Exception:
-                        pass
 
-                    # Delegate to server manager's WMS GetMap-with-BBOX pipeline (256x256)
-                    if hasattr(self.server_manager, '_handle_wms_get_map_with_bbox'):
-                        class _CaptureConn:
-                            def __init__(self):
-                                self._buf = bytearray()
-                            def sendall(self, b):
-                                if isinstance(b, (bytes, bytearray)):
-                                    self._buf.extend(b)
-                            def close(self):
-                                pass
-                        cap = _CaptureConn()
-                        self.server_manager._handle_wms_get_map_with_bbox(cap, bbox, 'EPSG:3857', int(self.tile_size), int(self.tile_size), rotation=0.0)
-                    try:
-                        raw = bytes(cap._buf)
-                        sep = b"\r\n\r\n"
-                        if sep in raw:
-                            hdr, body = raw.split(sep, 1)
-                            hdr_text = hdr.decode('utf-8', errors='ignore')
-                            content_type = 'application/octet-stream'
-                            for line in hdr_text.splitlines():
-                                if line.lower().startswith('content-type:'):
-                                    content_type = line.split(':', 1)[1].strip()
-                                    break
-                            if content_type.startswith('image'):
-                                try:
-                                    tmpfd, tmppath = tempfile.mkstemp(dir=identity_dir, suffix='.tmp')
-                                    with os.fdopen(tmpfd, 'wb') as tfh:
-                                        tfh.write(body)
-                                    os.replace(tmppath, cache_path)
-                                    # write sidecar metadata for easier inspection
-                                    meta_path = cache_path + '.meta.json'
-                                    try:
-                                        with open(meta_path, 'w', encoding='utf-8') as mf:
-                                            json.dump({
-                                                'cache_key': cache_key,
-                                                'identity_short': identity_short,
-                                                'identity_raw': identity_raw,
-                                                'format': fmt,
-                                                'z': z,
-                                                'x': x,
-                                                'y': y,
-                                                'path': cache_path,
-                                            }, mf, ensure_ascii=False, indent=2)
-                                    except Exception:
-                                        pass
-                                except Exception:
-                                    try:
-                                        if os.path.exists(tmppath):
-                                            os.remove(tmppath)
-                                    except Exception:
-                                        pass
-                            # forward the captured bytes to original conn
-                            try:
-                                conn.sendall(raw)
-                            except Exception:
-                                pass
-                            return
-                        else:
-                            # not an HTTP response: just forward raw buffer
-                            try:
-                                conn.sendall(raw)
-                            except Exception:
-                                pass
-                            return
-                    except Exception as e:
-                        from . import http_server
-                        http_server.send_http_response(conn, 500, 'Internal Server Error', f'WMTS tile failed: {e}')
-                    else:
-                        raise RuntimeError('WMS rendering method not available on server manager')
+                    # Render through the WMS GetMap-with-BBOX pipeline (coalesced)
+                    raw = self._render_tile(z, x, y, fmt, identity_hash, identity_dir, identity_short, identity_raw,
+                                            conn=conn)
+                    # re-send the captured response to the original conn
+                    self._forward_captured_response(conn, raw, tile_etag, tile_cache_control, vary)
                 except Exception as e:
                     from . import http_server
                     http_server.send_http_response(conn, 500, 'Internal Server Error', f'WMTS tile failed: {e}')
@@ -1037,6 +1202,9 @@ class GeoWebViewWMTSService:
 
             identity_hash = hashlib.sha1(identity_raw.encode('utf-8')).hexdigest()
             identity_dir = os.path.join(cache_dir, identity_hash)
+            # unchanged identity: meta already written and prewarm already started
+            if identity_hash == self._last_identity_hash and os.path.isdir(identity_dir):
+                return identity_hash, identity_dir
             try:
                 os.makedirs(identity_dir, exist_ok=True)
             except Exception:
@@ -1069,7 +1237,8 @@ class GeoWebViewWMTSService:
                 self._maybe_start_prewarm(identity_short, identity_hash, identity_dir)
             except Exception:
                 pass
-            
+            self._last_identity_hash = identity_hash
+
             return identity_hash, identity_dir
         except Exception:
             return None, None
@@ -1172,53 +1341,14 @@ class GeoWebViewWMTSService:
         """
         try:
             # Check if tile already exists in cache
-            tile_dir = os.path.join(identity_dir, str(z), str(x))
-            cache_path = os.path.join(tile_dir, f"{y}.png")
-            
-            if os.path.exists(cache_path):
+            fmt = self._tile_format('png')
+            if os.path.exists(self._tile_cache_path(identity_dir, z, x, y, fmt)):
                 return  # Already cached
-            
-            # Create directory
-            os.makedirs(tile_dir, exist_ok=True)
-            
-            # Calculate bbox for this tile
-            origin = 20037508.342789244
-            tiles = 2 ** z
-            tile_size = (origin * 2) / tiles
-            minx = -origin + x * tile_size
-            maxx = -origin + (x + 1) * tile_size
-            maxy = origin - y * tile_size
-            miny = origin - (y + 1) * tile_size
-            bbox = f"{minx},{miny},{maxx},{maxy}"
-            
-            # Render tile (delegate to server_manager's WMS method)
-            if hasattr(self.server_manager, '_handle_wms_get_map_with_bbox'):
-                class _CaptureConn:
-                    def __init__(self):
-                        self._buf = bytearray()
-                    def sendall(self, b):
-                        if isinstance(b, (bytes, bytearray)):
-                            self._buf.extend(b)
-                    def close(self):
-                        pass
-                
-                cap = _CaptureConn()
-                self.server_manager._handle_wms_get_map_with_bbox(
-                    cap, bbox, 'EPSG:3857', int(self.tile_size), int(self.tile_size), rotation=0.0
-                )
-                
-                # Parse response and cache if successful
-                raw = bytes(cap._buf)
-                sep = b"\r\n\r\n"
-                if sep in raw:
-                    _, body = raw.split(sep, 1)
-                    
-                    # Write to cache atomically
-                    tmpfd, tmppath = tempfile.mkstemp(dir=identity_dir, suffix='.tmp')
-                    with os.fdopen(tmpfd, 'wb') as tfh:
-                        tfh.write(body)
-                    os.replace(tmppath, cache_path)
-                    
+            # coalesced with any client request for the same tile; prewarmed
+            # tiles are written once and served many times, so compress hard.
+            # Prewarm renders yield render slots to client requests.
+            with encode_pool.compression_level(encode_pool.PNG_LEVEL_PREWARM), render_slots.background():
+                self._render_tile(z, x, y, fmt, identity_hash, identity_dir, identity_short)
         except Exception as e:
             # Prewarm failures are non-critical, just log quietly
             try:
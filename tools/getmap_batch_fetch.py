@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Fetch many WMS extents with one GetMapBatch request and compare with one GetMap per extent.
+
+Usage (against a running server; start it with QMAP_GETMAP_CACHE_BYTES=0 to
+time real renders):
+  python tools/getmap_batch_fetch.py --bbox 15540000,4250000,15560000,4270000 --grid 4
+  python tools/getmap_batch_fetch.py --layers roads,towns --grid 6 --package multipart --out batch_out
+
+Splits ``--bbox`` into a ``--grid`` x ``--grid`` block of extents (EPSG:3857
+unless ``--crs``), requests them all with ``REQUEST=GetMapBatch`` (ZIP or
+multipart/mixed) and then one ``GetMap`` at a time, and prints both
+wall-clock times, the number of images received and any failed items
+from the batch manifest. ``--out`` writes the batch images to a directory.
+"""
+from __future__ import annotations
+import argparse
+import email.parser
+import email.policy
+import io
+import json
+import os
+import sys
+import time
+import urllib.parse
+import urllib.request
+import zipfile
+
+
+def extents(bbox, grid):
+    minx, miny, maxx, maxy = (float(v) for v in bbox.split(','))
+    dx, dy = (maxx - minx) / grid, (maxy - miny) / grid
+    return [f'{minx + i * dx},{miny + j * dy},{minx + (i + 1) * dx},{miny + (j + 1) * dy}'
+            for j in range(grid) for i in range(grid)]
+
+
+def common_params(args):
+    params = {'SERVICE': 'WMS', 'VERSION': '1.3.0', 'CRS': args.crs, 'WIDTH': args.size,
+              'HEIGHT': args.size, 'FORMAT': 'image/png'}
+    if args.layers:
+        params['LAYERS'] = args.layers
+    return params
+
+
+def fetch(url, timeout=600):
+    with urllib.request.urlopen(url, timeout=timeout) as r:
+        return r.headers.get('Content-Type', ''), r.read()
+
+
+def unpack(content_type, body):
+    """``{name: bytes}`` of a ZIP or multipart/mixed batch response."""
+    if content_type.startswith('application/zip'):
+        with zipfile.ZipFile(io.BytesIO(body)) as z:
+            return {name: z.read(name) for name in z.namelist()}
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f'Content-Type: {content_type}\r\n\r\n'.encode('latin-1') + body)
+    return {part.get_filename(): part.get_payload(decode=True) for part in message.iter_parts()}
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description='GetMapBatch vs sequential GetMap')
+    ap.add_argument('--url', default='http://localhost:8089', help='server base URL')
+    ap.add_argument('--bbox', default='15540000,4250000,15560000,4270000')
+    ap.add_argument('--crs', default='EPSG:3857')
+    ap.add_argument('--grid', type=int, default=4, help='extents per side')
+    ap.add_argument('--size', type=int, default=512, help='pixels per image side')
+    ap.add_argument('--layers', default='', help='LAYERS parameter')
+    ap.add_argument('--package', choices=('zip', 'multipart'), default='zip')
+    ap.add_argument('--out', default='', help='directory for the batch images')
+    args = ap.parse_args()
+
+    boxes = extents(args.bbox, max(1, args.grid))
+    base = f'{args.url.rstrip("/")}/wms?'
+
+    params = dict(common_params(args), REQUEST='GetMapBatch', PACKAGE=args.package)
+    query = urllib.parse.urlencode(params) + ''.join('&BBOX=' + urllib.parse.quote(b) for b in boxes)
+    t0 = time.perf_counter()
+    content_type, body = fetch(base + query)
+    t_batch = time.perf_counter() - t0
+    files = unpack(content_type, body)
+    manifest = json.loads(files.pop('manifest.json', b'{}') or b'{}')
+
+    t0 = time.perf_counter()
+    for b in boxes:
+        fetch(base + urllib.parse.urlencode(dict(common_params(args), REQUEST='GetMap', BBOX=b)))
+    t_single = time.perf_counter() - t0
+
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+        for name, data in files.items():
+            with open(os.path.join(args.out, name), 'wb') as f:
+                f.write(data)
+
+    print(f'{len(boxes)} extents of {args.size}px: batch {t_batch:.2f}s ({args.package}, '
+          f'{manifest.get("ok", 0)} ok, {manifest.get("failed", 0)} failed), sequential GetMap {t_single:.2f}s')
+    for item in manifest.get('items', []):
+        if item.get('status') != 'ok':
+            print(f'  item {item["index"]} {item["bbox"]}: {item.get("error")}')
+    return 0 if manifest.get('failed', 1) == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""Micro-benchmark for the embedded server's request reader/parser.
+
+Usage examples:
+  python tools/http_request_parse_benchmark.py
+  python tools/http_request_parse_benchmark.py --iterations 20000 --headers 20
+
+Runs without QGIS. Compares the previous approach (``data += chunk`` with
+1024-byte ``recv``, decoding the whole buffer, ``splitlines()`` twice and a
+second ``unquote_plus`` pass over ``parse_qs`` output) with the current one
+(a per-connection ``bytearray`` filled via ``recv_into`` and a single-pass
+``http_server.parse_request_head`` that also builds the header dict).
+Both read the same request from a local socketpair so the I/O path is
+part of the measurement. ``parse_qs`` dominates small requests, so expect
+parity there and a growing gap as the head gets larger.
+"""
+from __future__ import annotations
+import argparse
+import os
+import socket
+import sys
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from geo_webview import http_server  # noqa: E402
+
+
+def build_request(n_headers: int, query_len: int) -> bytes:
+    layers = ','.join(f'layer_{i}' for i in range(max(1, query_len // 8)))
+    target = ('/wms?SERVICE=WMS&REQUEST=GetMap&VERSION=1.3.0&CRS=EPSG%3A3857'
+              '&BBOX=15540000,4250000,15560000,4270000&WIDTH=256&HEIGHT=256'
+              f'&LAYERS={urllib.parse.quote(layers)}&STYLES=&FORMAT=image%2Fpng')
+    lines = [f'GET {target} HTTP/1.1', 'Host: localhost:8089']
+    for i in range(n_headers):
+        lines.append(f'X-Bench-{i}: ' + 'v' * 40)
+    lines.append('Connection: keep-alive')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('ascii')
+
+
+def legacy_read_and_parse(conn):
+    data = b''
+    while b'\r\n\r\n' not in data and len(data) < 65536:
+        chunk = conn.recv(1024)
+        if not chunk:
+            break
+        data += chunk
+    text = data.decode('iso-8859-1', errors='replace')
+    method, target, _ = text.splitlines()[0].split()
+    parsed = urllib.parse.urlparse(target)
+    params = urllib.parse.parse_qs(parsed.query)
+    for key in params:
+        params[key] = [urllib.parse.unquote_plus(v) for v in params[key]]
+    host = None
+    for line in text.splitlines():
+        if line.lower().startswith('host:'):
+            host = line.split(':', 1)[1].strip()
+            break
+    return method, parsed.path, params, host
+
+
+_CONN_BUFFER = bytearray(65536)  # one per connection in the server
+
+
+def current_read_and_parse(conn):
+    head = http_server.read_http_request(conn, max_size=65536, buffer=_CONN_BUFFER)
+    req = http_server.parse_request_head(head)
+    return req.method, req.path, req.params, req.host
+
+
+def run(fn, payload: bytes, iterations: int) -> float:
+    a, b = socket.socketpair()
+    try:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            b.sendall(payload)
+            fn(a)
+        return time.perf_counter() - start
+    finally:
+        a.close()
+        b.close()
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description='Request reader/parser micro-benchmark')
+    ap.add_argument('--iterations', type=int, default=5000)
+    ap.add_argument('--headers', type=int, default=12, help='extra header lines per request')
+    ap.add_argument('--query-len', type=int, default=400, help='approximate LAYERS value length')
+    args = ap.parse_args()
+
+    payload = build_request(args.headers, args.query_len)
+    print(f'request head: {len(payload)} bytes, {args.headers + 3} header lines, {args.iterations} iterations')
+
+    # sanity: both paths must agree on the parsed result
+    a, b = socket.socketpair()
+    b.sendall(payload)
+    legacy = legacy_read_and_parse(a)
+    b.sendall(payload)
+    current = current_read_and_parse(a)
+    a.close()
+    b.close()
+    if legacy != current:
+        print('WARNING: parsers disagree')
+        print(' legacy :', legacy)
+        print(' current:', current)
+
+    # the legacy second unquote_plus pass corrupts already-decoded values
+    probe = b'GET /wms?FILTER=a%2Bb%2525 HTTP/1.1\r\nHost: x\r\n\r\n'
+    a, b = socket.socketpair()
+    b.sendall(probe)
+    legacy_val = legacy_read_and_parse(a)[2]['FILTER'][0]
+    b.sendall(probe)
+    current_val = current_read_and_parse(a)[2]['FILTER'][0]
+    a.close()
+    b.close()
+    print(f"decode check: FILTER=a%2Bb%2525 -> legacy {legacy_val!r}, current {current_val!r}")
+
+    results = {}
+    for name, fn in (('legacy', legacy_read_and_parse), ('current', current_read_and_parse)):
+        run(fn, payload, min(200, args.iterations))  # warm-up
+        elapsed = run(fn, payload, args.iterations)
+        results[name] = elapsed
+        print(f'{name:8s}: {elapsed * 1e6 / args.iterations:8.2f} us/request')
+
+    if results.get('current'):
+        print(f'speedup : {results["legacy"] / results["current"]:.2f}x')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Concurrency check for WMS GetMap LABELS: no labeling leaks between requests.
+
+Usage (against a running server; start it with QMAP_GETMAP_CACHE_BYTES=0 so
+every request is really rendered):
+  python tools/labels_concurrency_check.py --layers roads,towns --labels "name,name;,;ref,"
+  python tools/labels_concurrency_check.py --url http://localhost:8089 --rounds 10 --workers 8
+
+``--labels`` lists LABELS variants separated by ``;`` (an empty variant
+means no LABELS parameter). Each variant is first rendered alone to get a
+reference image. Then all variants are requested many times in parallel,
+interleaved, and every response is compared with the reference of its own
+variant. A response equal to another variant's reference is reported as
+leakage (labeling of one request showing up in another); any other
+difference is reported as a mismatch. Exit status is 0 when every
+response matched.
+"""
+from __future__ import annotations
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import random
+import sys
+import urllib.parse
+import urllib.request
+
+
+def getmap(url, args, labels):
+    params = {
+        'SERVICE': 'WMS', 'REQUEST': 'GetMap', 'VERSION': '1.3.0', 'CRS': args.crs,
+        'BBOX': args.bbox, 'WIDTH': args.width, 'HEIGHT': args.height, 'FORMAT': 'image/png',
+    }
+    if args.layers:
+        params['LAYERS'] = args.layers
+    if labels:
+        params['LABELS'] = labels
+    q = urllib.parse.urlencode(params)
+    with urllib.request.urlopen(f'{url.rstrip("/")}/wms?{q}', timeout=120) as r:
+        body = r.read()
+        if r.status != 200 or not r.headers.get('Content-Type', '').startswith('image/'):
+            raise RuntimeError(f'HTTP {r.status} {r.headers.get("Content-Type")}: {body[:200]!r}')
+    return hashlib.sha256(body).hexdigest()
+
+
+def getmap_cache_enabled(url):
+    try:
+        with urllib.request.urlopen(f'{url.rstrip("/")}/server-stats', timeout=10) as r:
+            stats = json.loads(r.read().decode('utf-8'))
+        return int(stats.get('getmap_cache', {}).get('max_bytes', 0)) > 0
+    except Exception:
+        return None
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description='LABELS concurrency / leakage check')
+    ap.add_argument('--url', default='http://localhost:8089', help='server base URL')
+    ap.add_argument('--layers', default='', help='LAYERS parameter')
+    ap.add_argument('--labels', required=True, help='LABELS variants separated by ";" (empty = none)')
+    ap.add_argument('--bbox', default='15540000,4250000,15560000,4270000')
+    ap.add_argument('--crs', default='EPSG:3857')
+    ap.add_argument('--width', type=int, default=512)
+    ap.add_argument('--height', type=int, default=512)
+    ap.add_argument('--rounds', type=int, default=5, help='requests per variant in the parallel phase')
+    ap.add_argument('--workers', type=int, default=8, help='concurrent client connections')
+    args = ap.parse_args()
+
+    variants = list(dict.fromkeys(v.strip() for v in args.labels.split(';')))
+    if len(variants) < 2:
+        print('give at least two different LABELS variants (e.g. "name;")')
+        return 2
+    if getmap_cache_enabled(args.url):
+        print('warning: the GetMap cache is enabled; parallel responses may come from the cache '
+              '(restart the server with QMAP_GETMAP_CACHE_BYTES=0)')
+
+    reference = {}
+    for v in variants:
+        reference[v] = getmap(args.url, args, v)
+        print(f'reference LABELS={v or "(none)"!s:30} {reference[v][:16]}')
+    if len(set(reference.values())) < len(variants):
+        print('warning: some variants render identically; leakage between them cannot be detected')
+
+    jobs = [v for v in variants for _ in range(max(1, args.rounds))]
+    random.shuffle(jobs)
+    owner = {}
+    for v, digest in reference.items():
+        owner.setdefault(digest, v)
+
+    leaks = mismatches = errors = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(getmap, args.url, args, v): v for v in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            v = futures[future]
+            try:
+                digest = future.result()
+            except Exception as e:
+                errors += 1
+                print(f'error    LABELS={v or "(none)"}: {e}')
+                continue
+            if digest == reference[v]:
+                continue
+            if digest in owner:
+                leaks += 1
+                print(f'LEAK     LABELS={v or "(none)"} returned the image of LABELS={owner[digest] or "(none)"}')
+            else:
+                mismatches += 1
+                print(f'mismatch LABELS={v or "(none)"} {digest[:16]}')
+
+    print(f'{len(jobs)} parallel requests, {args.workers} workers: '
+          f'{leaks} leaked, {mismatches} mismatched, {errors} failed')
+    return 0 if not (leaks or mismatches or errors) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""Size and encode-time comparison of 32-bit PNG and PNG8 tiles.
+
+Usage examples (run with the QGIS Python interpreter, NumPy required):
+  python tools/png8_benchmark.py
+  python tools/png8_benchmark.py --cache-dir geo_webview/.cache/wmts --limit 500 --colors 128
+
+Walks the WMTS tile cache (``*.png`` tiles of every identity directory),
+decodes each tile and encodes it twice: as the 32-bit PNG the server
+writes by default and as PNG8 (``png_quantize.quantize`` + PNG palette
+writer, i.e. what ``FORMAT=image/png; mode=8bit`` / ``QMAP_PNG8_TILE_MATRIX_SETS``
+produce). Reports total and median sizes, encode times (PNG8 includes the
+quantization), how many tiles were converted exactly (<= palette size
+colours) and the mean per-channel error of the lossy ones.
+"""
+from __future__ import annotations
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', 'geo_webview', '.cache', 'wmts')
+
+
+def find_tiles(cache_dir: str, limit: int):
+    tiles = []
+    for root, _dirs, files in os.walk(cache_dir):
+        for name in sorted(files):
+            if name.endswith('.png'):
+                tiles.append(os.path.join(root, name))
+                if limit and len(tiles) >= limit:
+                    return tiles
+    return tiles
+
+
+def encode_png(image) -> bytes:
+    from qgis.PyQt.QtCore import QBuffer, QByteArray, QIODevice
+
+    data = QByteArray()
+    buf = QBuffer(data)
+    buf.open(QIODevice.WriteOnly)
+    image.save(buf, 'PNG')
+    buf.close()
+    return bytes(data)
+
+
+def argb_array(image):
+    import numpy as np
+    from qgis.PyQt.QtGui import QImage
+
+    img = image.convertToFormat(QImage.Format_ARGB32)
+    ptr = img.constBits()
+    ptr.setsize(img.height() * img.bytesPerLine())
+    px = np.frombuffer(ptr, dtype=np.uint32).reshape(img.height(), img.bytesPerLine() // 4)[:, :img.width()]
+    return np.stack([(px >> s) & 0xFF for s in (24, 16, 8, 0)], axis=-1).astype(np.int16)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description='PNG vs PNG8 tile benchmark over the WMTS cache')
+    ap.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    ap.add_argument('--limit', type=int, default=0, help='maximum number of tiles (0 = all)')
+    ap.add_argument('--colors', type=int, default=256, help='palette size')
+    args = ap.parse_args()
+
+    try:
+        import numpy as np
+    except ImportError:
+        print('NumPy is required (PNG8 quantization falls back to 32-bit PNG without it)')
+        return 1
+    from qgis.PyQt.QtGui import QImage
+    from geo_webview import png_quantize
+
+    tiles = find_tiles(os.path.abspath(args.cache_dir), args.limit)
+    if not tiles:
+        print(f'no .png tiles under {os.path.abspath(args.cache_dir)} (browse the map or prewarm first)')
+        return 1
+
+    sizes32, sizes8, t32, t8, errors = [], [], [], [], []
+    exact = 0
+    for path in tiles:
+        image = QImage(path)
+        if image.isNull():
+            continue
+        image = image.convertToFormat(QImage.Format_ARGB32_Premultiplied)  # as rendered
+
+        t0 = time.perf_counter()
+        png32 = encode_png(image)
+        t1 = time.perf_counter()
+        indexed = png_quantize.quantize(image, args.colors)
+        png8 = encode_png(indexed) if indexed is not None else png32
+        t2 = time.perf_counter()
+
+        sizes32.append(len(png32))
+        sizes8.append(len(png8))
+        t32.append(t1 - t0)
+        t8.append(t2 - t1)
+        if indexed is not None:
+            if len(np.unique(argb_array(image).reshape(-1, 4), axis=0)) <= args.colors:
+                exact += 1
+            else:
+                errors.append(np.abs(argb_array(indexed) - argb_array(image)).mean(axis=(0, 1)))
+
+    n = len(sizes32)
+    if not n:
+        print('no decodable tiles')
+        return 1
+    total32, total8 = sum(sizes32), sum(sizes8)
+    print(f'tiles: {n} ({exact} exact, {len(errors)} quantized) from {os.path.abspath(args.cache_dir)}')
+    print(f"{'':10s} {'total KiB':>10} {'median B':>9} {'encode ms/tile':>15}")
+    print(f"{'PNG32':10s} {total32 / 1024:10.1f} {statistics.median(sizes32):9.0f} {statistics.mean(t32) * 1000:15.2f}")
+    print(f"{'PNG8':10s} {total8 / 1024:10.1f} {statistics.median(sizes8):9.0f} {statistics.mean(t8) * 1000:15.2f}")
+    print(f'size ratio: {total8 / total32:.3f} (saved {(total32 - total8) / 1024:.1f} KiB)')
+    print(f'encode time ratio: {sum(t8) / sum(t32):.2f}')
+    if errors:
+        a, r, g, b = np.mean(errors, axis=0)
+        print(f'mean abs error of quantized tiles (A,R,G,B): {a:.2f} {r:.2f} {g:.2f} {b:.2f}')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,136 @@
+"""Render time with and without the render-preparation stage at z8, z12 and z16.
+
+Usage examples (run with the QGIS Python interpreter, e.g. ``python-qgis``):
+  python tools/render_prep_benchmark.py --project data/parcels.qgz
+  python tools/render_prep_benchmark.py --project my.qgz --lonlat 139.76,35.68 --zooms 8,12,16 --grid 3 --size 1152
+
+Loads the project headless, renders a ``--grid`` x ``--grid`` block of
+Web Mercator tiles around ``--lonlat`` at every zoom (layers visible in
+the layer tree, as the server does) and times each tile twice: the plain
+job, and the job after ``render_prep.prepare`` (scale/extent layer
+filtering and zoom-band simplification, see ``QMAP_SIMPLIFY_BANDS``).
+``--size 1152`` matches a 4x4 metatile with its 64 px buffer.
+Reports the median render time, layers rendered and simplified per zoom
+and the share of pixels that differ between the two outputs.
+"""
+from __future__ import annotations
+import argparse
+import math
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+ORIGIN = 20037508.342789244
+
+
+def tile_bbox(z, x, y):
+    size = 2 * ORIGIN / (1 << z)
+    minx = -ORIGIN + x * size
+    maxy = ORIGIN - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def lonlat_to_tile(lon, lat, z):
+    n = 1 << z
+    x = int((lon + 180.0) / 360.0 * n)
+    lat_r = math.radians(lat)
+    y = int((1.0 - math.log(math.tan(lat_r) + 1.0 / math.cos(lat_r)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def map_settings(layers, bbox, size):
+    from qgis.core import QgsCoordinateReferenceSystem, QgsMapSettings, QgsRectangle
+    from qgis.PyQt.QtCore import QSize
+
+    ms = QgsMapSettings()
+    ms.setLayers(layers)
+    ms.setDestinationCrs(QgsCoordinateReferenceSystem('EPSG:3857'))
+    ms.setExtent(QgsRectangle(*bbox))
+    ms.setOutputSize(QSize(size, size))
+    ms.setOutputDpi(96)
+    ms.setFlag(QgsMapSettings.Antialiasing, True)
+    return ms
+
+
+def render(ms):
+    from qgis.core import QgsMapRendererParallelJob
+
+    job = QgsMapRendererParallelJob(ms)
+    t0 = time.perf_counter()
+    job.start()
+    job.waitForFinished()
+    return time.perf_counter() - t0, job.renderedImage()
+
+
+def differing_share(a, b):
+    from qgis.PyQt.QtGui import QImage
+
+    a = a.convertToFormat(QImage.Format_ARGB32)
+    b = b.convertToFormat(QImage.Format_ARGB32)
+    if a.size() != b.size():
+        return 1.0
+    try:
+        import numpy as np
+        pa, pb = a.constBits(), b.constBits()
+        pa.setsize(a.sizeInBytes())
+        pb.setsize(b.sizeInBytes())
+        return float(np.mean(np.frombuffer(pa, np.uint32) != np.frombuffer(pb, np.uint32)))
+    except ImportError:
+        return 0.0 if a == b else float('nan')
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description='render_prep benchmark (scale filtering + zoom-band simplification)')
+    ap.add_argument('--project', required=True, help='.qgs/.qgz project to render')
+    ap.add_argument('--lonlat', default='139.767,35.681', help='center as lon,lat (WGS84)')
+    ap.add_argument('--zooms', default='8,12,16')
+    ap.add_argument('--grid', type=int, default=3, help='tiles per side at each zoom')
+    ap.add_argument('--size', type=int, default=256, help='output pixels per tile')
+    args = ap.parse_args()
+
+    from qgis.core import QgsApplication, QgsProject
+    app = QgsApplication([], False)
+    app.initQgis()
+    try:
+        project = QgsProject.instance()
+        if not project.read(args.project):
+            print(f'cannot read project {args.project}')
+            return 1
+        from geo_webview import render_prep
+
+        root = project.layerTreeRoot()
+        layers = [n.layer() for n in root.findLayers() if n.isVisible() and n.layer() and n.layer().isValid()]
+        lon, lat = (float(v) for v in args.lonlat.split(','))
+        print(f'{len(layers)} visible layers, bands: {", ".join(render_prep.stats()["band_config"]) or "off"}')
+        print(f"{'zoom':>4} {'scale':>12} {'plain ms':>9} {'prep ms':>8} {'speedup':>8} "
+              f"{'layers':>7} {'simpl.':>6} {'diff px':>8}")
+        for z in (int(v) for v in args.zooms.split(',') if v.strip()):
+            cx, cy = lonlat_to_tile(lon, lat, z)
+            half = args.grid // 2
+            plain, prepped, diffs = [], [], []
+            info = {}
+            for x in range(cx - half, cx - half + args.grid):
+                for y in range(cy - half, cy - half + args.grid):
+                    bbox = tile_bbox(z, x % (1 << z), min(max(y, 0), (1 << z) - 1))
+                    t_plain, img_plain = render(map_settings(layers, bbox, args.size))
+                    ms = map_settings(layers, bbox, args.size)
+                    t0 = time.perf_counter()
+                    info = render_prep.prepare(ms)
+                    t_stage = time.perf_counter() - t0
+                    t_prep, img_prep = render(ms)
+                    plain.append(t_plain)
+                    prepped.append(t_stage + t_prep)  # the stage itself is included
+                    diffs.append(differing_share(img_plain, img_prep))
+            p, q = statistics.median(plain), statistics.median(prepped)
+            print(f'{z:4d} {info.get("scale") or 0:12.0f} {p * 1000:9.1f} {q * 1000:8.1f} {p / q if q else 0:7.2f}x '
+                  f'{info.get("layers", 0):7d} {info.get("simplified", 0):6d} {statistics.mean(diffs) * 100:7.2f}%')
+    finally:
+        app.exitQgis()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
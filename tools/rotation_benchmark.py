@@ -0,0 +1,182 @@
+"""Benchmark of the rotated (ANGLE != 0) GetMap post-processing.
+
+Usage examples (run with the QGIS Python interpreter, e.g. ``python-qgis``):
+  python tools/rotation_benchmark.py
+  python tools/rotation_benchmark.py --size 1024x768 --angles 0.5,15,30,45,90,135,270
+  python tools/rotation_benchmark.py --url http://localhost:8089 --bbox 15540000,4250000,15560000,4270000
+
+Rendering a rotated view first renders an enlarged extent, then turns the
+result back to north-up and takes the center region of the requested
+size. The previous pipeline materialized the whole inverse-rotated image
+(``QImage.transformed``, up to ~2x the render in both axes for 45°) and
+cropped it; the current one paints the rotated render straight into an
+image of the requested size (``wms_service.inverse_rotate_crop``).
+
+For each angle this script builds a synthetic enlarged render, runs both
+paths, checks that the outputs are pixel-identical and reports latency and
+the peak bytes of the images each path holds at once.
+
+With ``--url`` it additionally times live GetMap requests against a
+running server: the default north-up output and ``ANGLE_MODE=direct``
+(rotated map rendered at the requested size via ``setRotation``).
+"""
+from __future__ import annotations
+import argparse
+import itertools
+import math
+import os
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def enlarged_size(width: int, height: int, angle: float):
+    a = math.radians(angle)
+    c, s = abs(math.cos(a)), abs(math.sin(a))
+    return max(1, int(width * c + height * s + 0.5)), max(1, int(width * s + height * c + 0.5))
+
+
+def synthetic_render(w: int, h: int):
+    """Striped, gridded ARGB image so rotation differences show up in pixels."""
+    from qgis.PyQt.QtCore import Qt
+    from qgis.PyQt.QtGui import QColor, QImage, QPainter, QPen
+
+    img = QImage(w, h, QImage.Format_ARGB32_Premultiplied)
+    img.fill(QColor(240, 235, 220))
+    p = QPainter(img)
+    p.setRenderHint(QPainter.Antialiasing, True)
+    p.setPen(QPen(QColor(40, 90, 160), 3))
+    for x in range(0, w, 32):
+        p.drawLine(x, 0, x, h)
+    p.setPen(QPen(QColor(180, 40, 40), 2))
+    for y in range(0, h, 32):
+        p.drawLine(0, y, w, y)
+    p.setBrush(QColor(20, 140, 60, 160))
+    p.setPen(Qt.NoPen)
+    p.drawEllipse(w // 4, h // 4, w // 2, h // 2)
+    p.end()
+    return img
+
+
+def image_bytes(img) -> int:
+    try:
+        return int(img.sizeInBytes())
+    except AttributeError:
+        return int(img.byteCount())
+
+
+def legacy(img, angle, width, height, smooth):
+    """Previous pipeline: full inverse-rotated image, then center crop."""
+    from qgis.PyQt.QtCore import Qt
+    from qgis.PyQt.QtGui import QTransform
+
+    t = QTransform()
+    t.translate(img.width() / 2.0, img.height() / 2.0)
+    t.rotate(-float(angle))
+    t.translate(-img.width() / 2.0, -img.height() / 2.0)
+    rotated = img.transformed(t, Qt.SmoothTransformation if smooth else Qt.FastTransformation)
+    px_min = rotated.width() // 2 - width // 2
+    py_min = rotated.height() // 2 - height // 2
+    out = rotated.copy(px_min, py_min, width, height)
+    return out, image_bytes(rotated) + image_bytes(out)
+
+
+def current(img, angle, width, height, smooth):
+    from geo_webview.wms_service import inverse_rotate_crop
+
+    out = inverse_rotate_crop(img, angle, width, height, smooth=smooth)
+    return out, (image_bytes(out) if out is not None else 0)
+
+
+def timed(fn, repeat):
+    best = None
+    result = None
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        result = fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None or dt < best else best
+    return best, result
+
+
+def bench_local(width, height, angles, repeat):
+    from qgis.PyQt.QtGui import QImage
+    from qgis.PyQt.QtWidgets import QApplication
+
+    app = QApplication.instance() or QApplication([])  # QPainter needs it
+    print(f'output {width}x{height}, best of {repeat} (Qt platform: {app.platformName()})')
+    print(f"{'angle':>7} {'render':>11} {'legacy ms':>10} {'paint ms':>9} "
+          f"{'legacy MiB':>11} {'paint MiB':>10} {'identical':>9}")
+    for angle in angles:
+        rw, rh = enlarged_size(width, height, angle)
+        src = synthetic_render(rw, rh)
+        deg = (angle % 360 + 360) % 360
+        smooth = min(abs(deg - 90.0), abs(deg - 270.0)) >= 1e-6
+        t_old, (old, old_peak) = timed(lambda: legacy(src, angle, width, height, smooth), repeat)
+        t_new, (new, new_peak) = timed(lambda: current(src, angle, width, height, smooth), repeat)
+        if new is None:
+            same = 'fallback'
+        else:
+            a = old.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+            b = new.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+            same = 'yes' if a == b else 'NO'
+        # the enlarged render itself is held by both paths
+        base = image_bytes(src)
+        print(f'{angle:7.1f} {rw:5d}x{rh:<5d} {t_old * 1000:10.2f} {t_new * 1000:9.2f} '
+              f'{(base + old_peak) / 1048576:11.2f} {(base + new_peak) / 1048576:10.2f} {same:>9}')
+
+
+def bench_url(url, bbox, crs, width, height, angles, repeat):
+    print(f'\nlive GetMap {url} {width}x{height}, best of {repeat}')
+    coords = [float(v) for v in bbox.split(',')]
+    nudge = itertools.count(1)
+    print(f"{'angle':>7} {'northup ms':>11} {'direct ms':>10} {'northup KiB':>12} {'direct KiB':>11}")
+    for angle in angles:
+        row = []
+        for mode in ('northup', 'direct'):
+            best = None
+            size = 0
+            for _ in range(max(1, repeat)):
+                # shift the BBOX by a fraction of a pixel per request so the
+                # GetMap result cache never answers and every request renders
+                shift = next(nudge) * 0.5
+                q = urllib.parse.urlencode({
+                    'SERVICE': 'WMS', 'REQUEST': 'GetMap', 'VERSION': '1.3.0', 'CRS': crs,
+                    'BBOX': ','.join(str(v + shift) for v in coords),
+                    'WIDTH': width, 'HEIGHT': height, 'FORMAT': 'image/png',
+                    'ANGLE': angle, 'ANGLE_MODE': mode,
+                })
+                t0 = time.perf_counter()
+                with urllib.request.urlopen(f'{url.rstrip("/")}/wms?{q}', timeout=120) as r:
+                    size = len(r.read())
+                dt = time.perf_counter() - t0
+                best = dt if best is None or dt < best else best
+            row.append((best, size))
+        (tn, sn), (td, sd) = row
+        print(f'{angle:7.1f} {tn * 1000:11.1f} {td * 1000:10.1f} {sn / 1024:12.1f} {sd / 1024:11.1f}')
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description='Rotated GetMap post-processing benchmark')
+    ap.add_argument('--size', default='800x600', help='output WIDTHxHEIGHT')
+    ap.add_argument('--angles', default='0.5,15,30,45,60,90,135,270,330')
+    ap.add_argument('--repeat', type=int, default=5)
+    ap.add_argument('--url', help='base URL of a running server (e.g. http://localhost:8089)')
+    ap.add_argument('--bbox', default='15540000,4250000,15560000,4270000')
+    ap.add_argument('--crs', default='EPSG:3857')
+    args = ap.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    angles = [float(a) for a in args.angles.split(',') if a.strip()]
+
+    bench_local(width, height, angles, args.repeat)
+    if args.url:
+        bench_url(args.url, args.bbox, args.crs, width, height, angles, args.repeat)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())